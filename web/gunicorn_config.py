@@ -0,0 +1,9 @@
+"""
+gunicorn settings: gunicorn -c gunicorn_config.py gunicorn_entry:app
+More than one thread means the gthread worker, which long polls on GET /tow_request_batch need
+"""
+from terraintracker.constants import GUNICORN_THREADS, GUNICORN_WORKERS
+
+bind = ':8000'
+workers = GUNICORN_WORKERS
+threads = GUNICORN_THREADS
@@ -1,8 +1,14 @@
+import sys
+
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 from terraintracker.app import app
 from terraintracker.app_init import db
-from terraintracker.scripts import create_users, initial_live_config
+from terraintracker.models.notification_outbox import notification_outbox
+from terraintracker.models.timeout_sweeper import timeout_sweeper
+from terraintracker.scripts import build_water_mask as water_mask_builder, create_users, initial_live_config
+from terraintracker.scripts import maintain_location_history as location_history_maintenance
+from terraintracker.scripts import provider_standin as provider_standin_server
 
 migrate = Migrate(app, db)
 
@@ -27,6 +33,57 @@ def initialize():
     initial_live_config.run()
 
 
+@manager.command
+def maintain_location_history(archive=False):
+    """Creates upcoming location_history partitions, downsamples and drops (or --archive's) old ones"""
+    location_history_maintenance.run(archive=archive)
+
+
+@manager.option('--min-lat', dest='min_lat', required=True)
+@manager.option('--min-lon', dest='min_lon', required=True)
+@manager.option('--max-lat', dest='max_lat', required=True)
+@manager.option('--max-lon', dest='max_lon', required=True)
+@manager.option('--source', dest='source', default='google', help="'shapefile' or 'google'")
+@manager.option('--shapefile', dest='shapefile_path', default=None, help="Polygons of water (or land, with --land)")
+@manager.option('--land', dest='land', action='store_true', help="The shapefile's polygons are land, not water")
+@manager.option('--cell-degrees', dest='cell_degrees', default=None)
+@manager.option('--path', dest='path', default=None, help="Defaults to water_mask_path from the .ini")
+def build_water_mask(min_lat, min_lon, max_lat, max_lon, source, shapefile_path, land, cell_degrees, path):
+    """Builds the offline is_water raster for a lat/lon box"""
+    kwargs = dict((k, v) for k, v in (('cell_degrees', cell_degrees), ('path', path)) if v is not None)
+    try:
+        water_mask_builder.run(min_lat, min_lon, max_lat, max_lon, source=source, shapefile_path=shapefile_path,
+                               land=land, **kwargs)
+    except ValueError as e:
+        sys.exit("build_water_mask: {}".format(e))
+
+
+@manager.command
+def deliver_notifications():
+    """Sends queued pushes and texts until killed. Run this when [Notifications] delivery = worker"""
+    notification_outbox.run_forever()
+
+
+@manager.command
+def sweep_timeouts():
+    """One timeout_sweeper pass. Cron it when [SystemRuntime] timeout_sweeper = cron"""
+    print("Timed out {} tow request batches and {} tow events. Escalated {} waves".format(*timeout_sweeper.sweep()))
+
+
+@manager.option('--host', dest='host', default='127.0.0.1')
+@manager.option('--port', dest='port', default=5050)
+@manager.option('--latency-ms', dest='latency_ms', default=0)
+@manager.option('--jitter-ms', dest='jitter_ms', default=0)
+@manager.option('--error-rate', dest='error_rate', default=0.0, help="Fraction of calls that get a 500")
+@manager.option('--rate-limit', dest='rate_limits', action='append',
+                help="provider=requests/second, e.g. twilio=10. 429s past it. Can be repeated")
+@manager.option('--land', dest='land', action='store_true', help="Static maps are all land instead of all water")
+def provider_standin(host, port, latency_ms, jitter_ms, error_rate, rate_limits, land):
+    """Runs a local fake OneSignal/Twilio/Stripe/Facebook/Google Maps for load testing"""
+    provider_standin_server.run(host=host, port=port, latency_ms=latency_ms, jitter_ms=jitter_ms,
+                                error_rate=error_rate, rate_limits=rate_limits, land=land)
+
+
 #@manager.command
 #def print_users():
 #get_all_users.print_users()
@@ -39,12 +39,17 @@ def exclude_data_from_config(name, section=None):
 
 exclude_tables = exclude_data_from_config('tables')
 exclude_indexes = exclude_data_from_config('indexes')
+exclude_table_prefixes = tuple(exclude_data_from_config('table_prefixes'))
 
 
 def include_object(object, name, type_, reflected, compare_to):
     if type_ == "table" and name in exclude_tables:
         print('=> ignore table: {}'.format(name))
         return False
+    elif exclude_table_prefixes and type_ == "table" and name.startswith(exclude_table_prefixes):
+        return False
+    elif exclude_table_prefixes and type_ == "index" and object.table.name.startswith(exclude_table_prefixes):
+        return False
     elif type_ == "index" and name in exclude_indexes:
         print('=> ignore index: {}'.format(name))
         return False
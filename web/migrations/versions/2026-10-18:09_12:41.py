@@ -0,0 +1,28 @@
+"""GiST index on active towers' last_geo_point_seen
+
+Revision ID: 50c9ae6c9e0c
+Revises: 8b79523b4a25
+Create Date: 2026-10-18 09:12:41.304119
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '50c9ae6c9e0c'
+down_revision = '8b79523b4a25'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Partial index: only active towers are ever searched for, so keep the index small.
+    # The predicate has to match the filters in User._active_towers_query for the planner to use it.
+    op.create_index('ix_terraintracker_user_active_tower_geo',
+                    'terraintracker_user',
+                    ['last_geo_point_seen'],
+                    postgresql_using='gist',
+                    postgresql_where=sa.text('active = true AND role = 2'))
+
+
+def downgrade():
+    op.drop_index('ix_terraintracker_user_active_tower_geo', table_name='terraintracker_user')
@@ -0,0 +1,30 @@
+"""Wave dispatch for tow request batches
+
+Revision ID: 0bb9a51b37e7
+Revises: 50c9ae6c9e0c
+Create Date: 2026-10-18 10:03:17.581230
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0bb9a51b37e7'
+down_revision = '50c9ae6c9e0c'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('tow_request_batch', sa.Column('wave_size', sa.Integer(), nullable=True))
+    op.add_column('tow_request_batch', sa.Column('num_waves', sa.Integer(), nullable=True))
+    op.add_column('tow_request_batch', sa.Column('last_wave_time', sa.DateTime(), nullable=True))
+    op.add_column('live_configuration', sa.Column('dispatch_wave_size', sa.Integer(), nullable=True))
+    op.add_column('live_configuration', sa.Column('dispatch_wave_wait_seconds', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('live_configuration', 'dispatch_wave_wait_seconds')
+    op.drop_column('live_configuration', 'dispatch_wave_size')
+    op.drop_column('tow_request_batch', 'last_wave_time')
+    op.drop_column('tow_request_batch', 'num_waves')
+    op.drop_column('tow_request_batch', 'wave_size')
@@ -0,0 +1,124 @@
+"""Monthly partitions for location_history
+
+location_history becomes the parent of one child table per month (location_history_yYYYYmMM),
+using table inheritance + an insert trigger since we're on Postgres 9.4.
+Partitions are created ahead of time by scripts/maintain_location_history.py. If one is missing,
+rows land in the parent so nothing is lost.
+
+Revision ID: aa7fbb64642f
+Revises: 0bb9a51b37e7
+Create Date: 2026-10-18 10:41:52.118734
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'aa7fbb64642f'
+down_revision = '0bb9a51b37e7'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+CREATE_PARTITION_FUNCTION = """
+CREATE OR REPLACE FUNCTION location_history_create_partition(for_month date) RETURNS text AS $$
+DECLARE
+    start_date date := date_trunc('month', for_month);
+    end_date date := date_trunc('month', for_month) + interval '1 month';
+    child text := 'location_history_' || to_char(for_month, '"y"YYYY"m"MM');
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_class WHERE relname = child AND relkind = 'r') THEN
+        EXECUTE format('CREATE TABLE %I (CHECK ("timestamp" >= %L AND "timestamp" < %L)) INHERITS (location_history)',
+                       child, start_date, end_date);
+        EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (id)', child);
+        EXECUTE format('CREATE INDEX %I ON %I (user_id, "timestamp")', 'ix_' || child || '_user_id_timestamp', child);
+    END IF;
+    RETURN child;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+INSERT_TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION location_history_insert() RETURNS trigger AS $$
+DECLARE
+    child text;
+BEGIN
+    IF NEW."timestamp" IS NULL THEN
+        NEW."timestamp" := now();
+    END IF;
+    child := 'location_history_' || to_char(NEW."timestamp", '"y"YYYY"m"MM');
+    -- Checked up front rather than with an EXCEPTION block, which would make every insert a subtransaction
+    IF NOT EXISTS (SELECT 1 FROM pg_class WHERE relname = child AND relkind = 'r') THEN
+        -- No partition for this month yet. Keep it in the parent until maintenance runs
+        RETURN NEW;
+    END IF;
+    EXECUTE format('INSERT INTO %I SELECT ($1).*', child) USING NEW;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade():
+    op.add_column('location_history', sa.Column('lat', sa.Float(), nullable=True))
+    op.add_column('location_history', sa.Column('lon', sa.Float(), nullable=True))
+
+    # Copy position + time onto the history rows so we don't need the location table to read a track
+    op.execute("""
+        UPDATE location_history lh
+        SET lat = l.lat, lon = l.lon, "timestamp" = COALESCE(lh."timestamp", l.last_seen)
+        FROM location l
+        WHERE l.id = lh.location_id
+    """)
+    op.create_index('ix_location_history_user_id_timestamp', 'location_history', ['user_id', 'timestamp'])
+
+    op.execute(CREATE_PARTITION_FUNCTION)
+    op.execute(INSERT_TRIGGER_FUNCTION)
+
+    # One partition for every month we already have data for, plus this month and the next
+    op.execute("""
+        SELECT location_history_create_partition(month::date)
+        FROM generate_series(
+            date_trunc('month', COALESCE((SELECT min("timestamp") FROM location_history), now())),
+            date_trunc('month', now()) + interval '1 month',
+            interval '1 month') AS month
+    """)
+    op.execute("""
+        CREATE TRIGGER location_history_insert_trigger
+        BEFORE INSERT ON location_history
+        FOR EACH ROW EXECUTE PROCEDURE location_history_insert()
+    """)
+
+    # Move existing rows out of the parent. Re-inserting them goes through the trigger.
+    # Rows without a timestamp (their location is gone too) stay in the parent.
+    op.execute("""
+        WITH moved AS (DELETE FROM ONLY location_history WHERE "timestamp" IS NOT NULL RETURNING *)
+        INSERT INTO location_history SELECT * FROM moved
+    """)
+
+
+def downgrade():
+    op.execute("DROP TRIGGER location_history_insert_trigger ON location_history")
+
+    # Pull everything back into the parent and drop the partitions
+    op.execute("""
+        DO $$
+        DECLARE
+            child text;
+        BEGIN
+            FOR child IN
+                SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'location_history'::regclass
+            LOOP
+                -- Trigger is gone, so this lands in the parent
+                EXECUTE format('INSERT INTO location_history SELECT * FROM %I', child);
+                EXECUTE format('DROP TABLE %I', child);
+            END LOOP;
+        END;
+        $$
+    """)
+    op.execute("DROP FUNCTION location_history_insert()")
+    op.execute("DROP FUNCTION location_history_create_partition(date)")
+
+    op.drop_index('ix_location_history_user_id_timestamp', table_name='location_history')
+    op.drop_column('location_history', 'lon')
+    op.drop_column('location_history', 'lat')
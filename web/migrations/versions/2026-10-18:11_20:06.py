@@ -0,0 +1,29 @@
+"""is_water cache table
+
+Revision ID: 774c9c136b7f
+Revises: aa7fbb64642f
+Create Date: 2026-10-18 11:20:06.402915
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '774c9c136b7f'
+down_revision = 'aa7fbb64642f'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'is_water_cache',
+        sa.Column('cell_key', sa.String(length=64), nullable=False),
+        sa.Column('is_water', sa.Boolean(), nullable=True),
+        sa.Column('color_google', sa.String(length=36), nullable=True),
+        sa.Column('checked_time', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('cell_key')
+    )
+
+
+def downgrade():
+    op.drop_table('is_water_cache')
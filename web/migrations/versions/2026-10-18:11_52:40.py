@@ -0,0 +1,38 @@
+"""notification outbox table
+
+Revision ID: 19b2d8a272fb
+Revises: 774c9c136b7f
+Create Date: 2026-10-18 11:52:40.118304
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '19b2d8a272fb'
+down_revision = '774c9c136b7f'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'notification_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('provider', sa.String(length=16), nullable=True),
+        sa.Column('payload', sa.Text(), nullable=True),
+        sa.Column('status', sa.Integer(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('last_error', sa.String(length=255), nullable=True),
+        sa.Column('created_time', sa.DateTime(), nullable=True),
+        sa.Column('next_attempt_time', sa.DateTime(), nullable=True),
+        sa.Column('claimed_time', sa.DateTime(), nullable=True),
+        sa.Column('sent_time', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_notification_outbox_status_provider_next_attempt_time', 'notification_outbox',
+                    ['status', 'provider', 'next_attempt_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_notification_outbox_status_provider_next_attempt_time', table_name='notification_outbox')
+    op.drop_table('notification_outbox')
@@ -0,0 +1,24 @@
+"""status, time_sent indexes for the timeout sweeper
+
+Revision ID: 435b4cdae944
+Revises: 19b2d8a272fb
+Create Date: 2026-10-18 12:31:07.552190
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '435b4cdae944'
+down_revision = '19b2d8a272fb'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index('ix_tow_request_batch_status_time_sent', 'tow_request_batch', ['_status', 'time_sent'],
+                    unique=False)
+    op.create_index('ix_tow_event_status_time_sent', 'tow_event', ['status', 'time_sent'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tow_event_status_time_sent', table_name='tow_event')
+    op.drop_index('ix_tow_request_batch_status_time_sent', table_name='tow_request_batch')
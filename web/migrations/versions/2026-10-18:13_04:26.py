@@ -0,0 +1,23 @@
+"""tow_request_batch version, for long polling
+
+Revision ID: eb6ec901fa05
+Revises: 435b4cdae944
+Create Date: 2026-10-18 13:04:26.301847
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'eb6ec901fa05'
+down_revision = '435b4cdae944'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # server_default so existing batches start at 0, not NULL (NULL + 1 is NULL)
+    op.add_column('tow_request_batch', sa.Column('version', sa.Integer(), server_default='0', nullable=True))
+
+
+def downgrade():
+    op.drop_column('tow_request_batch', 'version')
@@ -0,0 +1,24 @@
+"""terraintracker_user.last_fix_time, so last_time_seen can move on every ping
+
+Revision ID: 56d31bafbb87
+Revises: eb6ec901fa05
+Create Date: 2026-10-18 14:02:10.517203
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '56d31bafbb87'
+down_revision = 'eb6ec901fa05'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('terraintracker_user', sa.Column('last_fix_time', sa.DateTime(), nullable=True))
+    # Up to now last_time_seen only moved when a fix was stored
+    op.execute("UPDATE terraintracker_user SET last_fix_time = last_time_seen WHERE last_lat_seen IS NOT NULL")
+
+
+def downgrade():
+    op.drop_column('terraintracker_user', 'last_fix_time')
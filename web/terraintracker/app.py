@@ -1,9 +1,13 @@
 """
 Creates the API object, attaches resources to it
 """
+import logging
+
 from flask import render_template
 from flask_restful import Api
-from terraintracker.app_init import app
+from terraintracker.app_init import app, db
+from terraintracker.constants import GUNICORN_WORKERS
+from terraintracker.models.timeout_sweeper import timeout_sweeper
 
 # Import resources after "app" so "app" is initialized
 from terraintracker.resources.admin_panel import admin_panel_renderer
@@ -20,9 +24,14 @@ from terraintracker.resources.mweb_tow_request import MWebTowRequest
 from terraintracker.resources.stripe_payments import StripeCustomerResource, StripeChargeResource
 from terraintracker.resources.user import UserResource  # pylint: disable=ungrouped-imports
 from terraintracker.resources.tow_event import TowEventResource
+from terraintracker.resources.tow_event_track import TowEventTrackResource
 from terraintracker.resources.tow_request import TowRequestResource
 from terraintracker.resources.tow_request_batch import TowRequestBatchResource
 from terraintracker.resources.tow_request_twillio import TwillioDispatcher
+from terraintracker.resources.tower_coverage import TowerCoverageResource
+from terraintracker.resources.user_positions import UserPositionsResource
+
+logger = logging.getLogger(__name__)
 
 # Set up API routes
 api = Api(app, catch_all_404s=True)  # pylint: disable=invalid-name
@@ -31,6 +40,7 @@ api.add_resource(UserResource, '/users')
 api.add_resource(TowRequestResource, '/tow_request')
 api.add_resource(TowRequestBatchResource, '/tow_request_batch')
 api.add_resource(TowEventResource, '/tow_event')
+api.add_resource(TowEventTrackResource, '/tow_event_track')
 api.add_resource(TwillioDispatcher, '/twillioDispatcher')
 api.add_resource(LoginResource, '/login')
 api.add_resource(MarinaTwilio, '/marina_twilio')
@@ -40,6 +50,27 @@ api.add_resource(StripeChargeResource, '/stripe_charge')
 api.add_resource(LiveConfigurationResource, '/live_configuration')
 api.add_resource(MWebTowRequest, '/mweb_tow_request')
 api.add_resource(OperatorPanelJSON, '/operator_panel_json')
+api.add_resource(TowerCoverageResource, '/tower_coverage')
+api.add_resource(UserPositionsResource, '/user_positions')
+
+
+@app.before_first_request
+def start_timeout_sweeper():
+    # After gunicorn forks, so each worker gets its own thread
+    timeout_sweeper.start()
+
+
+@app.before_first_request
+def check_connection_budget():
+    """ Warn if every worker's pool filled up would be more connections than Postgres allows """
+    try:
+        max_connections = int(db.session.execute('SHOW max_connections').scalar())
+        wanted = GUNICORN_WORKERS * (app.config['SQLALCHEMY_POOL_SIZE'] + app.config['SQLALCHEMY_MAX_OVERFLOW'])
+        if wanted > max_connections:
+            logger.warning("{} workers * (pool_size + max_overflow) = {} connections, but Postgres max_connections "
+                           "is {}".format(GUNICORN_WORKERS, wanted, max_connections))
+    except Exception as e:
+        logger.exception(e)
 
 
 @app.route('/')
@@ -10,6 +10,8 @@ import logging.config
 
 import os
 
+from terraintracker.constants import GUNICORN_THREADS
+
 DEBUG = os.getenv("DEBUG", False)
 PRESERVE_CONTEXT_ON_EXCEPTION = True
 
@@ -57,26 +59,74 @@ PRICE_OF_A_TOW = _config.get('SystemRuntime', 'price_of_a_tow', fallback=20000)
 APPLICATION_ROOT = _config.get('SystemRuntime', 'application_root', fallback=os.getenv('DRIFT_URL', None))
 if not APPLICATION_ROOT:
     print("Missing required config value application_root! Add it in your .ini file!")
+# 'in_process' runs models/timeout_sweeper.py in a thread in every web worker. 'cron' leaves it to
+# `python manage.py sweep_timeouts`
+TIMEOUT_SWEEPER = _config.get('SystemRuntime', 'timeout_sweeper', fallback=os.getenv('TIMEOUT_SWEEPER', 'in_process'))
+
+# Point every provider (OneSignal, Twilio, Stripe, Facebook, Google Maps) at one URL, e.g. the local stand-in from
+# `python manage.py provider_standin`. Each provider's own *_url setting still wins
+PROVIDER_STANDIN_URL = _config.get('SystemRuntime', 'provider_standin_url',
+                                   fallback=os.getenv('PROVIDER_STANDIN_URL', None))
+if PROVIDER_STANDIN_URL:
+    print("Sending provider calls to " + PROVIDER_STANDIN_URL)
+
+
+def _provider_url(section, real_url):
+    return _config.get(section, 'api_url', fallback=PROVIDER_STANDIN_URL or real_url).rstrip('/')
 
 
 # === iOS Push Notifications ===
 ONE_SIGNAL_API_KEY = _config.get('OneSignal', 'api_key', fallback=os.getenv('ONE_SIGNAL_API_KEY', ''))
 ONE_SIGNAL_APP_ID = _config.get('OneSignal', 'app_id', fallback=os.getenv('ONE_SIGNAL_APP_ID', None))
+ONE_SIGNAL_API_URL = _provider_url('OneSignal', 'https://onesignal.com')
 
 # === Stripe ===
 STRIPE_API_KEY = _config.get('Stripe', 'api_key', fallback=os.getenv('STRIPE_API_KEY',
                                                                      'sk_test_9OiCgAQZhAA0xyEWSW9efNIx'))
 if STRIPE_API_KEY == 'sk_test_9OiCgAQZhAA0xyEWSW9efNIx':
     print("Using default stripe key")
+STRIPE_API_URL = _provider_url('Stripe', 'https://api.stripe.com')
+
+# === Facebook ===
+FACEBOOK_API_URL = _provider_url('Facebook', 'https://graph.facebook.com')
 
 
 # === Twilio ===
 TWILIO_ACCOUNT_SID = _config.get('Twilio', 'account_sid', fallback=os.getenv('TWILIO_ACCOUNT_SID', None))
 TWILIO_AUTH_TOKEN = _config.get('Twilio', 'auth_token', fallback=os.getenv('TWILIO_AUTH_TOKEN', None))
 TWILIO_PHONE_NUMBER = _config.get('Twilio', 'phone_number', fallback=os.getenv('TWILIO_PHONE_NUMBER', '5619269231'))
+TWILIO_API_URL = _provider_url('Twilio', 'https://api.twilio.com')
+# Our Twilio account's sending rate. Per process, so divide it by the number of processes sending texts
+TWILIO_MESSAGES_PER_SECOND = float(_config.get('Twilio', 'messages_per_second',
+                                               fallback=os.getenv('TWILIO_MESSAGES_PER_SECOND', 10)))
 
 # === GoogleMaps ===
 GOOGLE_MAPS_KEY = _config.get('GoogleMaps', 'key', fallback=os.getenv('GOOGLE_MAPS_API_KEY', ''))
+GOOGLE_MAPS_API_URL = _provider_url('GoogleMaps', 'https://maps.googleapis.com')
+# is_water answers are cached per grid cell of this many degrees (0.0005 is ~55m), for this many days
+IS_WATER_CACHE_CELL_DEGREES = float(_config.get('GoogleMaps', 'is_water_cache_cell_degrees',
+                                                fallback=os.getenv('IS_WATER_CACHE_CELL_DEGREES', 0.0005)))
+IS_WATER_CACHE_TTL_DAYS = float(_config.get('GoogleMaps', 'is_water_cache_ttl_days',
+                                            fallback=os.getenv('IS_WATER_CACHE_TTL_DAYS', 30)))
+# 'google' asks Google (through the cache). 'water_mask' answers from the offline raster built by
+# `python manage.py build_water_mask` first, and only asks Google for points outside it
+IS_WATER_BACKEND = _config.get('GoogleMaps', 'is_water_backend', fallback=os.getenv('IS_WATER_BACKEND', 'google'))
+WATER_MASK_PATH = _config.get('GoogleMaps', 'water_mask_path',
+                              fallback=os.getenv('WATER_MASK_PATH', os.path.join(REPO_DIRECTORY, 'water_mask.bin')))
+
+# === Notifications ===
+# Pushes and texts go through the notification_outbox table (models/notification_outbox.py).
+# 'in_process' drains it from threads in every web worker. 'worker' leaves it to
+# `python manage.py deliver_notifications`
+NOTIFICATION_DELIVERY = _config.get('Notifications', 'delivery',
+                                    fallback=os.getenv('NOTIFICATION_DELIVERY', 'in_process'))
+# Most calls to each provider in flight at once, per process
+ONE_SIGNAL_DELIVERY_WORKERS = int(_config.get('Notifications', 'one_signal_workers',
+                                              fallback=os.getenv('ONE_SIGNAL_DELIVERY_WORKERS', 4)))
+# Each tow request's texts go out in order, but different captains' in parallel, so this is about how many
+# captains get texted at once
+TWILIO_DELIVERY_WORKERS = int(_config.get('Notifications', 'twilio_workers',
+                                          fallback=os.getenv('TWILIO_DELIVERY_WORKERS', 10)))
 
 
 # === Database ===
@@ -96,6 +146,14 @@ try:
 except configparser.NoOptionError:
     raise RuntimeError('{} is missing one of [host, user, pass] in [Postgresql] section'.format(config_path))
 
+# Connections per process. Enough for everything that can be using the DB at once: gunicorn's threads, the outbox
+# delivery threads, the location history flusher and the timeout sweeper. GUNICORN_WORKERS * (pool_size +
+# max_overflow) has to stay under Postgres' max_connections (100 by default) with room left for cron and psql.
+# app.py warns at startup if it doesn't
+_threads_using_db = GUNICORN_THREADS + ONE_SIGNAL_DELIVERY_WORKERS + TWILIO_DELIVERY_WORKERS + 2
+SQLALCHEMY_POOL_SIZE = int(_config.get('Database', 'pool_size', fallback=_threads_using_db))
+SQLALCHEMY_MAX_OVERFLOW = int(_config.get('Database', 'max_overflow', fallback=4))
+
 # I don't think we ever want to do this, and we get a warning in stderr if we don't explicity opt out:
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
@@ -1,3 +1,87 @@
 MAX_REQUEST_DISTANCE_METERS = 16093  # 4996090
 TOW_EVENT_TIMEOUT_MINUTES = 240
 TOW_REQUEST_BATCH_TIMEOUT_MINUTES = 10
+TIMEOUT_SWEEP_SECONDS = 15  # How often models/timeout_sweeper.py times things out and escalates quiet waves
+
+# Long polling GET /tow_request_batch (models/tow_request_batch_watcher.py)
+TOW_REQUEST_BATCH_LONG_POLL_SECONDS = 25  # Longest we hold a poll. Under the usual 30s proxy/client timeouts
+TOW_REQUEST_BATCH_RECHECK_SECONDS = 2  # How quickly a poll notices changes made by other processes
+MAX_LONG_POLLS_PER_WORKER = 8  # Past this, polls answer straight away
+
+# gunicorn (gunicorn_config.py). Each worker gets threads for ordinary requests plus one per long poll, so waiting
+# polls can never take every thread
+GUNICORN_WORKERS = 2
+GUNICORN_REQUEST_THREADS = 8
+GUNICORN_THREADS = GUNICORN_REQUEST_THREADS + MAX_LONG_POLLS_PER_WORKER
+
+# How many towers User.get_nearest_towers returns when no limit is given
+NEAREST_TOWERS_DEFAULT_LIMIT = 10
+
+# In-process tower index (lib/spatial_grid.py). ~0.1 degree cells are about 11km tall
+TOWER_INDEX_CELL_DEGREES = 0.1
+TOWER_INDEX_RECONCILE_SECONDS = 60
+
+# Availability checks (models/tower_availability.py) are cached per grid cell of this size (~500m)
+AVAILABILITY_CACHE_CELL_DEGREES = 0.005
+AVAILABILITY_CACHE_TTL_SECONDS = 30
+AVAILABILITY_CACHE_MAX_CELLS = 10000
+
+# Used to turn "distance to nearest tower" into an ETA band
+TOWER_CRUISING_SPEED_METERS_PER_SECOND = 10.3  # ~20 knots
+ETA_BAND_LIMITS_MINUTES = [15, 30, 60]
+
+# Most points POST /tower_coverage will take in one call
+MAX_COVERAGE_POINTS = 5000
+
+# Write-behind buffer for position history (models/location_history.py)
+LOCATION_HISTORY_FLUSH_SIZE = 500  # Flush once this many fixes are waiting
+LOCATION_HISTORY_FLUSH_SECONDS = 5  # ...or this often, whichever comes first
+LOCATION_HISTORY_MAX_BUFFERED = 20000  # If the DB is down, drop the oldest fixes past this
+
+# Dead-band filter in front of User.update_position (lib/position_filter.py).
+# A fix is stored if it moved at least *_MIN_METERS from the last stored fix, or *_MAX_SECONDS have passed.
+POSITION_UNDERWAY_MIN_METERS = 10  # In an active TowEvent, or moving faster than POSITION_MOVING_SPEED
+POSITION_UNDERWAY_MAX_SECONDS = 15
+POSITION_IDLE_MIN_METERS = 75  # Sitting at the dock
+POSITION_IDLE_MAX_SECONDS = 300
+POSITION_MOVING_SPEED_METERS_PER_SECOND = 1.0  # ~2 knots
+
+# location_history partition housekeeping (scripts/maintain_location_history.py)
+LOCATION_HISTORY_PARTITIONS_AHEAD = 3  # Months of empty partitions to keep ready
+LOCATION_HISTORY_DOWNSAMPLE_AFTER_DAYS = 30  # After this, keep one fix per user per...
+LOCATION_HISTORY_DOWNSAMPLE_SECONDS = 60
+LOCATION_HISTORY_RETENTION_DAYS = 365  # After this, drop (or archive) the whole partition
+
+# Batched offline position upload (POST /user_positions)
+MAX_POSITION_BATCH = 5000  # Fixes per request
+MAX_POSITION_CLOCK_SKEW_SECONDS = 300  # How far in the future a fix's timestamp can be
+
+# Tow track streaming (GET /tow_event_track)
+TRACK_DEFAULT_TOLERANCE_METERS = 10  # Douglas-Peucker tolerance when the caller doesn't give one
+TRACK_CHUNK_SIZE = 2000  # Fixes read from the DB (and simplified) at a time
+
+# In-process LRU in front of the is_water_cache table (models/is_water_cache.py)
+IS_WATER_MEMORY_CACHE_MAX_CELLS = 50000
+
+# Most points POST /geo/is_water will take in one call
+MAX_IS_WATER_POINTS = 1000
+
+# Notification outbox delivery (models/notification_outbox.py)
+NOTIFICATION_MAX_ATTEMPTS = 8  # Then it's marked failed
+NOTIFICATION_RETRY_BASE_SECONDS = 2  # Backoff doubles every attempt...
+NOTIFICATION_RETRY_MAX_SECONDS = 600  # ...up to this
+NOTIFICATION_CLAIM_BATCH = 10  # Rows a delivery thread takes at a time
+NOTIFICATION_POLL_SECONDS = 2  # How often idle delivery threads look for rows other processes added
+NOTIFICATION_CLAIM_TIMEOUT_SECONDS = 300  # A row claimed this long ago by a worker that died gets retried
+
+# Outbound HTTP to OneSignal, Facebook and Google Maps (lib/http_client.py). Per provider, per process
+HTTP_POOL_SIZE = 10  # Most open connections
+HTTP_CONNECT_TIMEOUT_SECONDS = 3.05
+HTTP_READ_TIMEOUT_SECONDS = 10
+HTTP_RETRIES = 2
+CIRCUIT_BREAKER_FAILURES = 5  # Timeouts/5xx's in a row before we stop calling...
+CIRCUIT_BREAKER_RESET_SECONDS = 30  # ...for this long
+
+# Packing texts into SMS (lib/sms_composer.py)
+MAX_SMS_SEGMENTS = 10  # Twilio's advice. Phones get flaky at reassembling more
+MAX_SMS_CHARACTERS = 1600  # Twilio's limit for one message body
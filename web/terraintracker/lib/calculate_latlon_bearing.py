@@ -1,17 +1,14 @@
-from haversine import haversine
-import math
+from terraintracker.lib.geodesy import bearing_degrees, distance_meters, FEET_PER_METER
 
 
 def get_distance_between_coords_in_feet(start, end):
-    return haversine(start, end, miles=True) * 5280
+    return float(distance_meters(start[0], start[1], end[0], end[1])) * FEET_PER_METER
 
 
 def get_bearing_between_coords(pointA, pointB):
     """
     Calculates the bearing between two points.
-    The formulae used is the following:
-        θ = atan2(sin(Δlong).cos(lat2),
-                  cos(lat1).sin(lat2) − sin(lat1).cos(lat2).cos(Δlong))
+    See terraintracker.lib.geodesy.bearing_degrees for the formula (and for doing lots of points at once)
     :Parameters:
       - `pointA: The tuple representing the latitude/longitude for the
         first point. Latitude and longitude must be in decimal degrees
@@ -25,20 +22,4 @@ def get_bearing_between_coords(pointA, pointB):
     if (type(pointA) != tuple) or (type(pointB) != tuple):
         raise TypeError("Only tuples are supported as arguments")
 
-    lat1 = math.radians(pointA[0])
-    lat2 = math.radians(pointB[0])
-
-    diffLong = math.radians(pointB[1] - pointA[1])
-
-    x = math.sin(diffLong) * math.cos(lat2)
-    y = math.cos(lat1) * math.sin(lat2) - (math.sin(lat1) * math.cos(lat2) * math.cos(diffLong))
-
-    initial_bearing = math.atan2(x, y)
-
-    # Now we have the initial bearing but math.atan2 return values
-    # from -180° to + 180° which is not what we want for a compass bearing
-    # The solution is to normalize the initial bearing as shown below
-    initial_bearing = math.degrees(initial_bearing)
-    compass_bearing = (initial_bearing + 360) % 360
-
-    return float(compass_bearing)
+    return float(bearing_degrees(pointA[0], pointA[1], pointB[0], pointB[1]))
@@ -0,0 +1,46 @@
+"""
+Vectorized great-circle math (spherical earth).
+Every function takes scalars or array-likes of decimal degrees, broadcasts them against each other
+with NumPy, and returns a NumPy array (0-d for scalar input - wrap it in float() if you want a float).
+
+Use this instead of computing pairs one at a time in a loop.
+"""
+import numpy as np
+
+# Same mean radius the `haversine` package used, so distances didn't shift when we switched
+EARTH_RADIUS_METERS = 6371000.0
+METERS_PER_MILE = 1609.344
+FEET_PER_METER = 3.28084
+
+
+def distance_meters(lat1, lon1, lat2, lon2):
+    """ Haversine distance in meters between (lat1, lon1) and (lat2, lon2) """
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2)]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def bearing_degrees(lat1, lon1, lat2, lon2):
+    """
+    Initial compass bearing in degrees [0, 360) from (lat1, lon1) to (lat2, lon2):
+        θ = atan2(sin(Δlong).cos(lat2),
+                  cos(lat1).sin(lat2) − sin(lat1).cos(lat2).cos(Δlong))
+    """
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2)]
+    d_lon = lon2 - lon1
+    x = np.sin(d_lon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(d_lon)
+    return (np.degrees(np.arctan2(x, y)) + 360) % 360
+
+
+def destination_point(lat, lon, bearing, distance):
+    """ Where you end up going `distance` meters from (lat, lon) on compass `bearing`. Returns (lats, lons) """
+    lat, lon, bearing = [np.radians(np.asarray(x, dtype=float)) for x in (lat, lon, bearing)]
+    angular_distance = np.asarray(distance, dtype=float) / EARTH_RADIUS_METERS
+
+    north = np.cos(lat) * np.sin(angular_distance) * np.cos(bearing)
+    lat2 = np.arcsin(np.sin(lat) * np.cos(angular_distance) + north)
+    lon2 = lon + np.arctan2(np.sin(bearing) * np.sin(angular_distance) * np.cos(lat),
+                            np.cos(angular_distance) - np.sin(lat) * np.sin(lat2))
+    # Normalize longitude to [-180, 180)
+    return np.degrees(lat2), (np.degrees(lon2) + 540) % 360 - 180
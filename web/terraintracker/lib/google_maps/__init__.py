@@ -1,8 +1,10 @@
 from . import helpers
-from .constants import AVERAGE_WATER_COLOR, MAXIMUM_WATER_COLOR_DISTANCE
+from .constants import AVERAGE_WATER_COLOR, MAXIMUM_WATER_COLOR_DISTANCE, TILE_SIZE, TILE_ZOOM
 
 import logging
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
 
@@ -13,3 +15,20 @@ def get_color_and_isWater(lat, lon):
     logger.debug("Color: {}, Color Distance: {}, Lat: {}, Lon: {}, is_water: {}".format(
         color, this_color_distance, lat, lon, is_water))
     return color, is_water
+
+
+def get_colors_and_isWater_in_tile(center_lat, center_lon, lats, lons, zoom=TILE_ZOOM, size=TILE_SIZE):
+    """
+    Batch version of get_color_and_isWater: fetch one tile centered on (center_lat, center_lon) and classify
+    every (lats[i], lons[i]) in it. Points have to be inside the tile (see helpers.tile_span_degrees).
+    Returns (colors as an (n, 3) array, is_water as an (n,) bool array)
+    """
+    pixels = helpers.get_tile_pixels(center_lat, center_lon, zoom, size)
+    x, y = helpers.tile_pixels(lats, lons, center_lat, center_lon, zoom, size)
+    rows = np.clip(np.floor(y).astype(int), 0, pixels.shape[0] - 1)
+    cols = np.clip(np.floor(x).astype(int), 0, pixels.shape[1] - 1)
+    colors = pixels[rows, cols]
+    is_water = helpers.color_distances(colors) < MAXIMUM_WATER_COLOR_DISTANCE
+    logger.debug("Classified {} points from one tile at ({}, {}). {} water".format(
+        len(colors), center_lat, center_lon, int(is_water.sum())))
+    return colors, is_water
@@ -1,12 +1,32 @@
-MAP_IMAGE_URL_TEMPLATE = (
-    'https://maps.googleapis.com/maps/api/staticmap?'
+from terraintracker.config import GOOGLE_MAPS_API_URL
+
+# Single point: the one pixel at (lat, lon). Same zoom and style as the batch tiles below, since both
+# write the same is_water_cache cells
+MAP_IMAGE_URL_TEMPLATE = GOOGLE_MAPS_API_URL + (
+    '/maps/api/staticmap?'
     'center={lat},{lon}&'
-    'zoom=19&'
+    'zoom={zoom}&'
     'size=1x1&'
     'maptype=roadmap&'
+    'style=feature:all|element:labels|visibility:off&'
     'key={key}'
 )
 
 # average water color is obtained with sample points and ``get_color_stats.py`` script
 AVERAGE_WATER_COLOR = (163, 204, 255)
 MAXIMUM_WATER_COLOR_DISTANCE = 5
+
+# Batch mode: one bigger tile answers every point (and every cache cell) inside it.
+# At zoom 16 a 640px tile is ~1.5km across. Labels are hidden so they don't get mistaken for land
+TILE_URL_TEMPLATE = GOOGLE_MAPS_API_URL + (
+    '/maps/api/staticmap?'
+    'center={lat},{lon}&'
+    'zoom={zoom}&'
+    'size={size}x{size}&'
+    'maptype=roadmap&'
+    'style=feature:all|element:labels|visibility:off&'
+    'key={key}'
+)
+TILE_ZOOM = 16
+TILE_SIZE = 640  # Biggest the static maps API gives out without scale=2
+TILE_MARGIN_PIXELS = 8  # Don't trust pixels this close to the edge
@@ -1,17 +1,26 @@
-from .constants import MAP_IMAGE_URL_TEMPLATE
+from .constants import AVERAGE_WATER_COLOR, MAP_IMAGE_URL_TEMPLATE, TILE_URL_TEMPLATE, TILE_ZOOM
 
 from io import BytesIO
 from PIL import Image
-from urllib.request import urlopen
+
+import numpy as np
 
 from terraintracker.config import GOOGLE_MAPS_KEY
+from terraintracker.lib.http_client import google_maps_http
+
+WORLD_TILE_PIXELS = 256  # Web Mercator world is 256px across at zoom 0
+
+
+def _fetch(url):
+    response = google_maps_http.get(url)
+    response.raise_for_status()
+    return response.content
 
 
-def get_coordinates_color(lat, lon):
+def get_coordinates_color(lat, lon, zoom=TILE_ZOOM):
     """ Get RGB color of Google static map (1x1) """
-    url = MAP_IMAGE_URL_TEMPLATE.format(lat=lat, lon=lon, key=GOOGLE_MAPS_KEY)
-    with urlopen(url) as f:
-        img = Image.open(BytesIO(f.read()))
+    url = MAP_IMAGE_URL_TEMPLATE.format(lat=lat, lon=lon, zoom=zoom, key=GOOGLE_MAPS_KEY)
+    img = Image.open(BytesIO(_fetch(url)))
     pix = img.convert('RGB').load()
     return pix[0, 0]
 
@@ -26,3 +35,37 @@ def color_distance(c1, c2):
 
 def delta(x):
     return abs(x[0] - x[1])
+
+
+def get_tile_pixels(lat, lon, zoom, size):
+    """ RGB pixels of a size x size static map centered on (lat, lon), as a (size, size, 3) uint8 array """
+    url = TILE_URL_TEMPLATE.format(lat=lat, lon=lon, zoom=zoom, size=size, key=GOOGLE_MAPS_KEY)
+    img = Image.open(BytesIO(_fetch(url)))
+    return np.asarray(img.convert('RGB'))
+
+
+def _world_pixels(lats, lons, zoom):
+    """ Web Mercator pixel coordinates at `zoom` """
+    scale = WORLD_TILE_PIXELS * 2 ** zoom
+    sin_lat = np.clip(np.sin(np.radians(np.asarray(lats, dtype=float))), -0.9999, 0.9999)
+    x = scale * (0.5 + np.asarray(lons, dtype=float) / 360.0)
+    y = scale * (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi))
+    return x, y
+
+
+def tile_pixels(lats, lons, center_lat, center_lon, zoom, size):
+    """ (x, y) pixel positions of (lats, lons) in the tile get_tile_pixels(center_lat, center_lon, ...) returns """
+    x, y = _world_pixels(lats, lons, zoom)
+    center_x, center_y = _world_pixels(center_lat, center_lon, zoom)
+    return x - center_x + size / 2.0, y - center_y + size / 2.0
+
+
+def tile_span_degrees(center_lat, zoom, size):
+    """ (lat_span, lon_span) a tile covers. lat_span is for the tile's center, which is close enough at tile scale """
+    lon_span = 360.0 * size / (WORLD_TILE_PIXELS * 2 ** zoom)
+    return lon_span * np.cos(np.radians(center_lat)), lon_span
+
+
+def color_distances(colors, reference=AVERAGE_WATER_COLOR):
+    """ Vectorized color_distance for an (..., 3) array of RGB colors """
+    return np.abs(np.asarray(colors, dtype=np.int32) - np.asarray(reference, dtype=np.int32)).sum(axis=-1)
@@ -0,0 +1,128 @@
+"""
+Outbound HTTP for every provider we call (OneSignal, Facebook, Google Maps)
+
+One HttpClient per provider, one per worker process. Each keeps a pool of keep-alive connections (so we don't pay
+for a TCP + TLS handshake on every call), caps how many connections it opens to that provider, always uses connect
+and read timeouts, and retries connection failures.
+
+Each also has a circuit breaker: after CIRCUIT_BREAKER_FAILURES timeouts/5xx's in a row, calls fail straight away
+with CircuitOpenError for CIRCUIT_BREAKER_RESET_SECONDS, then one call is let through to see if the provider's back.
+That way a provider that's down costs us a few timeouts, not a timeout per request for as long as it's down.
+"""
+import logging
+import threading
+import time
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from terraintracker.constants import (CIRCUIT_BREAKER_FAILURES, CIRCUIT_BREAKER_RESET_SECONDS,
+                                      HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_POOL_SIZE, HTTP_READ_TIMEOUT_SECONDS,
+                                      HTTP_RETRIES)
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """ The provider's been failing, so we didn't even try. A ConnectionError, so callers handle it like one """
+    pass
+
+
+class CircuitBreaker():
+
+    def __init__(self, name, failure_threshold=CIRCUIT_BREAKER_FAILURES, reset_seconds=CIRCUIT_BREAKER_RESET_SECONDS,
+                 clock=time.time):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+
+        self.num_failures = 0  # In a row
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """ Can we make a call? When open, lets one trial call through every reset_seconds """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.clock() - self.opened_at >= self.reset_seconds:
+                self.opened_at = self.clock()  # Everybody else keeps waiting while the trial call is out
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("{} is back. Closing circuit".format(self.name))
+            self.num_failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.num_failures += 1
+            if self.num_failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("{} failed {} times in a row. Opening circuit for {}s".format(
+                        self.name, self.num_failures, self.reset_seconds))
+                self.opened_at = self.clock()
+
+
+class HttpClient():
+
+    def __init__(self, name, pool_size=HTTP_POOL_SIZE, connect_timeout=HTTP_CONNECT_TIMEOUT_SECONDS,
+                 read_timeout=HTTP_READ_TIMEOUT_SECONDS, retries=HTTP_RETRIES, retry_methods=('GET',)):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = CircuitBreaker(name)
+
+        # Connection failures are always retried, since the request never got there.
+        # Read failures and 5xx's only for retry_methods, so we never send a push twice
+        retry = Retry(total=retries,
+                      connect=retries,
+                      read=retries,
+                      status=retries,
+                      status_forcelist=(502, 503, 504),
+                      method_whitelist=frozenset(retry_methods),
+                      backoff_factor=0.2,
+                      raise_on_status=False)
+        # pool_block: past pool_size connections, wait for one instead of opening (and throwing away) more
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def __repr__(self):
+        return '<HttpClient {}{}>'.format(self.name, ' (circuit open)' if self.breaker.is_open else '')
+
+    def request(self, method, url, **kwargs):
+        if not self.breaker.allow():
+            raise CircuitOpenError("{} is failing. Not calling it for a bit".format(self.name))
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+one_signal_http = HttpClient('OneSignal')
+facebook_http = HttpClient('Facebook')
+google_maps_http = HttpClient('Google Maps')
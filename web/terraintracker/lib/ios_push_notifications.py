@@ -1,50 +1,81 @@
+"""
+OneSignal pushes. The send* methods only build the payload and queue it in the notification outbox
+(models/notification_outbox.py), so it goes out after the caller's commit. deliver() is what actually calls OneSignal
+"""
 import json
 import logging
-import requests
 
-from haversine import haversine
-
-from terraintracker.config import ONE_SIGNAL_API_KEY, ONE_SIGNAL_APP_ID
+from terraintracker.config import (ONE_SIGNAL_API_KEY, ONE_SIGNAL_API_URL, ONE_SIGNAL_APP_ID,
+                                   ONE_SIGNAL_DELIVERY_WORKERS)
+from terraintracker.lib.geodesy import distance_meters, METERS_PER_MILE
+from terraintracker.lib.http_client import one_signal_http
+from terraintracker.models.notification_outbox import NotificationDeliveryError, notification_outbox
 
 logger = logging.getLogger(__name__)
 
+ONE_SIGNAL_NOTIFICATIONS_URL = ONE_SIGNAL_API_URL + "/api/v1/notifications"
+TOW_REQUEST_TEMPLATE_ID = "54ddc503-21aa-4813-aa0e-4eda27479b00"
+
 
 class OneSignalNotificationSender():
 
+    provider = 'onesignal'
+
     @property
     def headers(self):
         if not ONE_SIGNAL_API_KEY or not ONE_SIGNAL_APP_ID:
             logger.warning("You need to add your ONE_SIGNAL_API_KEY and ONE_SIGNAL_APP_ID to your .ini file")
         return {"Content-Type": "application/json; charset=utf-8", "Authorization": "Basic " + ONE_SIGNAL_API_KEY}
 
+    def send(self, payload):
+        """ Queue a payload. It's delivered once the caller's db.session commits """
+        return notification_outbox.add(self.provider, payload)
+
+    def deliver(self, payload):
+        """ Called by the outbox's delivery threads """
+        req = one_signal_http.post(ONE_SIGNAL_NOTIFICATIONS_URL,
+                                   headers=self.headers,
+                                   data=json.dumps(payload))
+        if req.status_code == 200:
+            logger.debug("OneSignal accepted notification: {}".format(req.text))
+            return
+        # Throttled or down: try again later. Anything else is our fault, and won't get better
+        permanent = req.status_code != 429 and req.status_code < 500
+        raise NotificationDeliveryError("OneSignal {} {}: {}".format(req.status_code, req.reason, req.text),
+                                        permanent=permanent)
+
     def buildTowRequestContents(sefl, requestee, requestor):
         start = (float(requestee.last_lat_seen), float(requestee.last_long_seen))
         end = (float(requestor.last_lat_seen), float(requestor.last_long_seen))
-        distance = haversine(start, end)
+        distance = float(distance_meters(start[0], start[1], end[0], end[1])) / METERS_PER_MILE
         return "{} ({:.2f}mi away) needs your help! Click here to help tow them.".format(requestor.first_name,
                                                                                          distance)
 
     def sendTowRequest(self, requestee, requestor, tow_request_id):
-        tow_request_text = self.buildTowRequestContents(requestee, requestor)
-        if requestee.one_signal_player_id is None or requestor.one_signal_player_id is None:
-            logger.error("cant send tow request because someones missing a onesignal {}->{}".format(requestee,
-                                                                                                    requestor))
+        self.sendTowRequests(requestor, [(requestee, tow_request_id)])
+
+    def sendTowRequests(self, requestor, requestees_and_tow_request_ids):
+        """
+        Queue one push per requestee. The app finds its tow request in data.tow_request_id, so they can't share.
+        The outbox's delivery threads send them in parallel
+        """
+        if requestor.one_signal_player_id is None:
+            logger.error("cant send tow requests because requestor {} is missing a onesignal id".format(requestor))
             return
-        logger.debug("One signal sending tow request")
 
-        payload = {"app_id": ONE_SIGNAL_APP_ID,
-                   "template_id": "54ddc503-21aa-4813-aa0e-4eda27479b00",
-                   "contents": {"en": tow_request_text},
-                   "include_player_ids": [requestee.one_signal_player_id, ],
-                   "data": {"tow_request_id": tow_request_id,
-                            "message_type": "incoming_tow_request"}}
+        for requestee, tow_request_id in requestees_and_tow_request_ids:
+            if requestee.one_signal_player_id is None:
+                logger.error("cant send tow request because {} is missing a onesignal id".format(requestee))
+                continue
+            payload = {"app_id": ONE_SIGNAL_APP_ID,
+                       "template_id": TOW_REQUEST_TEMPLATE_ID,
+                       "contents": {"en": self.buildTowRequestContents(requestee, requestor)},
+                       "include_player_ids": [requestee.one_signal_player_id, ],
+                       "data": {"tow_request_id": tow_request_id,
+                                "message_type": "incoming_tow_request"}}
 
-        logging.debug("sending tow request to " + requestee.one_signal_player_id)
-        req = requests.post("https://onesignal.com/api/v1/notifications",
-                            headers=self.headers,
-                            data=json.dumps(payload))
-
-        print(req.status_code, req.reason, req.text)
+            logger.debug("sending tow request to " + requestee.one_signal_player_id)
+            self.send(payload)
 
     def sentTowRequestAccepted(self, requestor, requestee, tow_event_id):
         payload = {"app_id": ONE_SIGNAL_APP_ID,
@@ -57,11 +88,7 @@ class OneSignalNotificationSender():
                             "tow_event_id": tow_event_id}}
 
         logging.debug("Sending tow request accepted\n{}".format(payload))
-        req = requests.post("https://onesignal.com/api/v1/notifications",
-                            headers=self.headers,
-                            data=json.dumps(payload))
-
-        print(req.status_code, req.reason)
+        self.send(payload)
 
     def sendNoDriftTowersInYourArea(self, requestee_one_signal_player_id):
 
@@ -71,11 +98,7 @@ class OneSignalNotificationSender():
                    "contents": {"en": "No Drift towers are in your area"}}
 
         logging.debug("sending no drifters in your area to " + requestee_one_signal_player_id)
-        req = requests.post("https://onesignal.com/api/v1/notifications",
-                            headers=self.headers,
-                            data=json.dumps(payload))
-
-        print(req.status_code, req.reason)
+        self.send(payload)
 
     def sendNoOneIsComingBecauseYouGotRejected(self, requestee_one_signal_player_id):
 
@@ -85,11 +108,7 @@ class OneSignalNotificationSender():
                    "contents": {"en": "No one is available to tow you at this time"}}
 
         logging.debug("sending tow request to " + requestee_one_signal_player_id)
-        req = requests.post("https://onesignal.com/api/v1/notifications",
-                            headers=self.headers,
-                            data=json.dumps(payload))
-
-        print(req.status_code, req.reason)
+        self.send(payload)
 
     def sendTowEventCompleted(self, user_sending_message, user_receiving_message):
         payload = {"app_id": ONE_SIGNAL_APP_ID,
@@ -98,9 +117,7 @@ class OneSignalNotificationSender():
                    "contents": {"en": "{} has marked the tow complete. Thank you for using Drift!".format(user_sending_message.id)}}
 
         logging.debug("sending tow event complete to {}".format(user_receiving_message))
-        req = requests.post("https://onesignal.com/api/v1/notifications",
-                            headers=self.headers,
-                            data=json.dumps(payload))
+        self.send(payload)
 
     def sendTowEventCancelled(self, user_sending_message, user_receiving_message):
         payload = {"app_id": ONE_SIGNAL_APP_ID,
@@ -109,11 +126,9 @@ class OneSignalNotificationSender():
                    "contents": {"en": "{} has marked the tow cancelled. Thank you for using Drift!".format(user_sending_message.id, 'XXX-XXX-XXXX')}}
 
         logging.debug("sending tow event cancelled to ".format(user_receiving_message))
-        req = requests.post("https://onesignal.com/api/v1/notifications",
-                            headers=self.headers,
-                            data=json.dumps(payload))
-
-        print(req.status_code, req.reason)
+        self.send(payload)
 
 
 one_signal_notification_sender = OneSignalNotificationSender()
+notification_outbox.register_provider(OneSignalNotificationSender.provider, one_signal_notification_sender.deliver,
+                                      ONE_SIGNAL_DELIVERY_WORKERS)
@@ -0,0 +1,88 @@
+"""
+Decides whether a position fix is worth storing
+
+Captain apps ping constantly, even tied up at the dock. A fix is only stored if it moved far enough from
+the last stored fix, or enough time has passed that we want a heartbeat anyway. The thresholds are tight
+while underway (serving/receiving a tow, or moving) and loose while sitting still.
+
+Everything is compared against the last *stored* fix (the user's last_lat_seen/last_long_seen/last_fix_time
+columns), so there's no per-user state here and it works the same in every worker. The only shared state is the
+counters, which are behind a lock since request threads all use the one position_filter.
+"""
+import logging
+import threading
+
+from terraintracker.constants import (POSITION_IDLE_MAX_SECONDS,
+                                      POSITION_IDLE_MIN_METERS,
+                                      POSITION_MOVING_SPEED_METERS_PER_SECOND,
+                                      POSITION_UNDERWAY_MAX_SECONDS,
+                                      POSITION_UNDERWAY_MIN_METERS)
+from terraintracker.lib.geodesy import distance_meters
+
+logger = logging.getLogger(__name__)
+
+REPORT_EVERY = 1000  # Log the counters every this many fixes
+
+
+class PositionFilter():
+
+    def __init__(self,
+                 underway_min_meters=POSITION_UNDERWAY_MIN_METERS,
+                 underway_max_seconds=POSITION_UNDERWAY_MAX_SECONDS,
+                 idle_min_meters=POSITION_IDLE_MIN_METERS,
+                 idle_max_seconds=POSITION_IDLE_MAX_SECONDS,
+                 moving_speed=POSITION_MOVING_SPEED_METERS_PER_SECOND):
+        self.underway_min_meters = underway_min_meters
+        self.underway_max_seconds = underway_max_seconds
+        self.idle_min_meters = idle_min_meters
+        self.idle_max_seconds = idle_max_seconds
+        self.moving_speed = moving_speed
+
+        self.num_seen = 0
+        self.num_suppressed = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<PositionFilter suppressed {} of {} fixes>'.format(self.num_suppressed, self.num_seen)
+
+    def should_store(self, last_fix, new_fix, underway=False):
+        """
+        :param last_fix: (lat, lon, datetime) of the last stored fix, or None if there isn't one
+        :param new_fix: (lat, lon, datetime) we just got
+        :param underway: True if the user is in an active TowEvent
+        """
+        store = self._should_store(last_fix, new_fix, underway)
+        with self._lock:
+            self.num_seen += 1
+            if not store:
+                self.num_suppressed += 1
+            report = self.num_seen % REPORT_EVERY == 0
+        if report:
+            logger.info(self)
+        return store
+
+    def _should_store(self, last_fix, new_fix, underway):
+        if last_fix is None or None in last_fix:
+            return True
+        try:
+            last_lat, last_lon, last_time = float(last_fix[0]), float(last_fix[1]), last_fix[2]
+        except (TypeError, ValueError):
+            # Garbage in the last_*_seen columns. Overwrite it.
+            return True
+
+        lat, lon, now = new_fix
+        elapsed = (now - last_time).total_seconds()
+        if elapsed < 0:
+            # Clock went backwards (or the last fix came from the future). Don't trust it.
+            return True
+        moved = float(distance_meters(last_lat, last_lon, float(lat), float(lon)))
+
+        if not underway and elapsed > 0:
+            underway = moved / elapsed >= self.moving_speed
+
+        if underway:
+            return moved >= self.underway_min_meters or elapsed >= self.underway_max_seconds
+        return moved >= self.idle_min_meters or elapsed >= self.idle_max_seconds
+
+
+position_filter = PositionFilter()
@@ -0,0 +1,47 @@
+"""
+Token bucket, for staying under a provider's rate limit from several threads at once
+"""
+import threading
+import time
+
+
+class TokenBucket():
+    """ `rate` tokens a second, and up to `capacity` saved up for bursts. acquire() blocks until there's one """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.clock = clock
+        self.sleep = sleep
+
+        self.tokens = self.capacity
+        self.last_refill = clock()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<TokenBucket {}/s, {:.1f}/{:.0f} tokens>'.format(self.rate, self.tokens, self.capacity)
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def try_acquire(self, tokens=1):
+        with self._lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """ Take `tokens`, waiting for them if we have to. Returns how long we waited """
+        with self._lock:
+            self._refill()
+            # Take them now and go into debt. Later callers see the debt and wait behind us, so everybody gets a
+            # slot in the order they asked, and one sleep is enough
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            self.sleep(wait)
+        return wait
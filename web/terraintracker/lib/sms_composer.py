@@ -0,0 +1,65 @@
+"""
+Packs texts into as few SMS as we can
+
+An SMS is GSM-7 (160 characters, or 153 per segment once it has to be split) unless it has anything outside the
+GSM alphabet, e.g. an emoji or a curly quote, in which case the whole thing is UCS-2 (70, or 67 per segment).
+Twilio bills and rate limits per segment, and every separate message costs at least one, so joining a few short
+texts into one message is usually free. compose() does that whenever it doesn't cost any extra segments.
+"""
+import math
+
+from collections import namedtuple
+
+from terraintracker.constants import MAX_SMS_CHARACTERS, MAX_SMS_SEGMENTS
+
+GSM7_BASIC = set("@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+                 "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà")
+GSM7_EXTENDED = set("^{}\\[~]|€\f")  # Take two septets each
+
+GSM7_SINGLE, GSM7_MULTIPART = 160, 153
+UCS2_SINGLE, UCS2_MULTIPART = 70, 67
+
+ComposedSms = namedtuple('ComposedSms', ['body', 'encoding', 'segments'])
+
+
+def encoding(text):
+    return 'GSM-7' if all(c in GSM7_BASIC or c in GSM7_EXTENDED for c in text) else 'UCS-2'
+
+
+def segments(text):
+    """ How many segments Twilio will send `text` as """
+    if encoding(text) == 'GSM-7':
+        length = sum(2 if c in GSM7_EXTENDED else 1 for c in text)
+        single, multipart = GSM7_SINGLE, GSM7_MULTIPART
+    else:
+        length = len(text.encode('utf-16-le')) // 2  # Emoji etc. take two
+        single, multipart = UCS2_SINGLE, UCS2_MULTIPART
+    if length <= single:
+        return 1
+    return int(math.ceil(length / float(multipart)))
+
+
+def describe(text):
+    return ComposedSms(text, encoding(text), segments(text))
+
+
+def compose(texts, separator='\n', max_segments=MAX_SMS_SEGMENTS):
+    """
+    Join `texts`, in order, into as few messages as possible without using more segments than sending them
+    separately would. Returns [ComposedSms, ...]
+    """
+    messages = []
+    current = None
+    for text in texts:
+        if current is not None:
+            joined = current + separator + text
+            joined_segments = segments(joined)
+            fits = joined_segments <= max_segments and len(joined) <= MAX_SMS_CHARACTERS
+            if fits and joined_segments <= segments(current) + segments(text):
+                current = joined
+                continue
+            messages.append(describe(current))
+        current = text
+    if current is not None:
+        messages.append(describe(current))
+    return messages
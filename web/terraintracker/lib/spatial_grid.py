@@ -0,0 +1,141 @@
+"""
+In-process grid index of point positions (we use it for active towers)
+
+Each worker process keeps its own copy:
+ - Writes made in this worker update it incrementally (upsert/remove)
+ - Writes made by other workers show up on the next reconcile, which reloads everything from `loader`
+   at most once every `reconcile_interval` seconds (same idea as live_config's CONFIG_UPDATE_INTERVAL)
+"""
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+from terraintracker.lib.geodesy import distance_meters
+
+logger = logging.getLogger(__name__)
+
+METERS_PER_DEGREE_LAT = 111320.0
+
+
+class SpatialGridIndex():
+    """ Fixed-cell lat/lon grid. Cells are `cell_degrees` on a side """
+
+    def __init__(self, cell_degrees, reconcile_interval, loader=None):
+        self.cell_degrees = float(cell_degrees)
+        self.reconcile_interval = reconcile_interval
+
+        # loader() returns an iterable of (id, lat, lon). Used to rebuild the index from the DB
+        self.loader = loader
+        self.last_reconciled = 0
+
+        self._positions = {}  # id -> (lat, lon)
+        self._cells = {}  # (row, col) -> set of ids
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, _id):
+        return _id in self._positions
+
+    def __repr__(self):
+        return '<SpatialGridIndex {} points in {} cells>'.format(len(self._positions), len(self._cells))
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees))
+
+    def upsert(self, _id, lat, lon):
+        lat, lon = float(lat), float(lon)
+        with self._lock:
+            self._remove(_id)
+            self._positions[_id] = (lat, lon)
+            self._cells.setdefault(self._cell(lat, lon), set()).add(_id)
+
+    def remove(self, _id):
+        with self._lock:
+            self._remove(_id)
+
+    def _remove(self, _id):
+        old = self._positions.pop(_id, None)
+        if old is None:
+            return
+        cell = self._cell(*old)
+        ids = self._cells.get(cell)
+        if ids is not None:
+            ids.discard(_id)
+            if not ids:
+                del self._cells[cell]
+
+    def reconcile(self):
+        """ Throw away everything we know and reload it from `loader` """
+        if self.loader is None:
+            return
+        positions = {}
+        cells = {}
+        for _id, lat, lon in self.loader():
+            try:
+                lat, lon = float(lat), float(lon)
+            except (TypeError, ValueError):
+                continue
+            positions[_id] = (lat, lon)
+            cells.setdefault(self._cell(lat, lon), set()).add(_id)
+
+        with self._lock:
+            self._positions = positions
+            self._cells = cells
+            self.last_reconciled = time.time()
+        logger.debug("Reconciled {}".format(self))
+
+    def reconcile_if_stale(self):
+        if time.time() - self.last_reconciled > self.reconcile_interval:
+            try:
+                self.reconcile()
+            except Exception as e:
+                # Keep answering from what we've got. We'll try again next time.
+                logger.warning("Failed to reconcile {}: {}".format(self, e))
+
+    def _candidate_ids(self, lat, lon, radius_meters):
+        """ Ids in every cell that overlaps the bounding box of the search circle """
+        dlat = radius_meters / METERS_PER_DEGREE_LAT
+        dlon = radius_meters / (METERS_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+        min_row, min_col = self._cell(lat - dlat, lon - dlon)
+        max_row, max_col = self._cell(lat + dlat, lon + dlon)
+
+        candidates = []
+        num_cells_in_box = (max_row - min_row + 1) * (max_col - min_col + 1)
+        if num_cells_in_box > len(self._cells):
+            # Huge radius. Cheaper to walk the occupied cells than the whole box
+            for (row, col), ids in self._cells.items():
+                if min_row <= row <= max_row and min_col <= col <= max_col:
+                    candidates.extend(ids)
+        else:
+            for row in range(min_row, max_row + 1):
+                for col in range(min_col, max_col + 1):
+                    candidates.extend(self._cells.get((row, col), ()))
+        return candidates
+
+    def query_radius(self, lat, lon, radius_meters, exclude_ids=None, limit=None):
+        """
+        Return [(id, distance_in_meters), ...] for everything within `radius_meters` of (lat, lon),
+        nearest first.
+        """
+        lat, lon = float(lat), float(lon)
+        exclude_ids = set(exclude_ids or [])
+        with self._lock:
+            candidates = [(_id, self._positions[_id]) for _id in self._candidate_ids(lat, lon, radius_meters)
+                          if _id not in exclude_ids]
+
+        if not candidates:
+            return []
+        ids = [c[0] for c in candidates]
+        positions = np.array([c[1] for c in candidates], dtype=float)
+        distances = distance_meters(lat, lon, positions[:, 0], positions[:, 1])
+
+        in_range = np.flatnonzero(distances <= radius_meters)
+        nearest_first = in_range[np.argsort(distances[in_range], kind='stable')]
+        if limit:
+            nearest_first = nearest_first[:limit]
+        return [(ids[i], float(distances[i])) for i in nearest_first]
@@ -1,7 +1,7 @@
 import logging
 import stripe
 
-from terraintracker.config import STRIPE_API_KEY
+from terraintracker.config import STRIPE_API_KEY, STRIPE_API_URL
 
 logger = logging.getLogger(__name__)
 
@@ -10,6 +10,7 @@ logger = logging.getLogger(__name__)
 def initialize_stripe_customer(description):
     logger.debug("Adding stripe info")
     stripe.api_key = STRIPE_API_KEY
+    stripe.api_base = STRIPE_API_URL
     stripe_customer_object = stripe.Customer.create(
         description=description
     )
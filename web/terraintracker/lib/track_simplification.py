@@ -0,0 +1,80 @@
+"""
+Douglas-Peucker simplification for GPS tracks
+
+Tracks are simplified a chunk at a time (simplify_stream) so a long tow never has to be in memory all at once.
+Consecutive chunks share their boundary fix, so the output is still one connected path, and every dropped fix
+is within `tolerance_meters` of the simplified path.
+"""
+import numpy as np
+
+from terraintracker.constants import TRACK_CHUNK_SIZE
+from terraintracker.lib.geodesy import EARTH_RADIUS_METERS
+
+
+def _project(lats, lons):
+    """ Equirectangular x/y in meters, around the middle of the track. Plenty accurate over a tow's distances """
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lons = np.radians(np.asarray(lons, dtype=float))
+    mid_lat = (lats.min() + lats.max()) / 2
+    return lons * EARTH_RADIUS_METERS * np.cos(mid_lat), lats * EARTH_RADIUS_METERS
+
+
+def douglas_peucker(lats, lons, tolerance_meters):
+    """ Indices of the fixes to keep, in order. Always keeps the first and last one """
+    num_points = len(lats)
+    if num_points < 3 or tolerance_meters <= 0:
+        return np.arange(num_points)
+
+    x, y = _project(lats, lons)
+    keep = np.zeros(num_points, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    # Iterative, so long straight-ish tracks can't blow the recursion limit
+    stack = [(0, num_points - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+
+        # Distance to the segment (not the infinite line), since boats double back on themselves
+        length_squared = dx * dx + dy * dy
+        if length_squared == 0:
+            along = np.zeros_like(px)
+        else:
+            along = np.clip((px * dx + py * dy) / length_squared, 0.0, 1.0)
+        distances = np.hypot(px - along * dx, py - along * dy)
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_meters:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return np.flatnonzero(keep)
+
+
+def simplify(fixes, tolerance_meters):
+    """ [(lat, lon, ...), ...] -> the fixes Douglas-Peucker keeps """
+    if len(fixes) < 3:
+        return list(fixes)
+    lats = [f[0] for f in fixes]
+    lons = [f[1] for f in fixes]
+    return [fixes[i] for i in douglas_peucker(lats, lons, tolerance_meters)]
+
+
+def simplify_stream(fixes, tolerance_meters, chunk_size=TRACK_CHUNK_SIZE):
+    """ Generator version of simplify() for an iterable of fixes. Holds at most `chunk_size` fixes at once """
+    chunk = []
+    for fix in fixes:
+        chunk.append(fix)
+        if len(chunk) >= chunk_size:
+            kept = simplify(chunk, tolerance_meters)
+            for kept_fix in kept[:-1]:
+                yield kept_fix
+            # The last fix is kept by definition. It starts the next chunk
+            chunk = [kept[-1]]
+    for kept_fix in simplify(chunk, tolerance_meters):
+        yield kept_fix
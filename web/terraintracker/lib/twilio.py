@@ -1,82 +1,108 @@
 """
 Keep Twilio initialization in one central place so we don't have to keep re-initializing
+
+Texts are queued in the notification outbox (models/notification_outbox.py) and go out after the caller's commit.
+Texts to the same phone from one call are queued together, so they arrive in order
 """
 import logging
 import re
+import threading
 import urllib
 
 from flask import url_for
+from twilio import TwilioRestException
 from twilio.rest import TwilioRestClient
 
-from terraintracker.config import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER, APPLICATION_ROOT
+from terraintracker.config import (TWILIO_ACCOUNT_SID, TWILIO_API_URL, TWILIO_AUTH_TOKEN, TWILIO_DELIVERY_WORKERS,
+                                   TWILIO_MESSAGES_PER_SECOND, TWILIO_PHONE_NUMBER, APPLICATION_ROOT)
+from terraintracker.constants import HTTP_READ_TIMEOUT_SECONDS
+from terraintracker.lib import sms_composer
+from terraintracker.lib.rate_limiter import TokenBucket
+from terraintracker.models.notification_outbox import NotificationDeliveryError, notification_outbox
 
 logger = logging.getLogger(__name__)
 
 
 class TwilioMessageSender():
 
+    provider = 'twilio'
     twilio_client = None
 
     def __init__(self):
+        self.num_messages_queued = 0
+        self.num_segments_queued = 0
+        self._counter_lock = threading.Lock()  # Request threads all queue through this one sender
+        # Shared by all the delivery threads, so together they stay under the account's rate
+        self.rate_limiter = TokenBucket(TWILIO_MESSAGES_PER_SECOND)
         try:
-            self.twilio_client = TwilioRestClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+            # Twilio's client has its own HTTP stack, so it isn't in lib/http_client.py. It does take a timeout
+            self.twilio_client = TwilioRestClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, base=TWILIO_API_URL,
+                                                  timeout=HTTP_READ_TIMEOUT_SECONDS)
             logger.info("Initialized Twilio")
         except Exception:
             logger.warning("Twilio failed to initialize with auth info SID:[{}] TOKEN:[{}]".format(
                 TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN))
 
+    def send(self, to_phone, bodies):
+        """
+        Queue texts to one phone, in order. They're delivered once the caller's db.session commits.
+        They're packed into as few SMS as they fit in (lib/sms_composer.py), so they may arrive as fewer messages
+        """
+        dest_phone = "+1" + str(to_phone)
+        messages = sms_composer.compose(bodies)
+        num_segments = sum(m.segments for m in messages)
+        with self._counter_lock:
+            self.num_messages_queued += len(messages)
+            self.num_segments_queued += num_segments
+        logger.debug('Queueing {} texts as {} Twilio msgs ({} segments, {}) FROM [{}] TO [{}]'.format(
+            len(bodies), len(messages), num_segments, '/'.join(sorted(set(m.encoding for m in messages))),
+            TWILIO_PHONE_NUMBER, dest_phone))
+        return notification_outbox.add(self.provider, {'to': dest_phone, 'bodies': [m.body for m in messages]})
+
+    def deliver(self, payload):
+        """ Called by the outbox's delivery threads """
+        if self.twilio_client is None:
+            raise NotificationDeliveryError("Twilio isn't initialized")
+        bodies = payload['bodies']
+        for i, body in enumerate(bodies):
+            # Twilio's rate limit counts segments, not messages
+            self.rate_limiter.acquire(sms_composer.segments(body))
+            try:
+                self.twilio_client.messages.create(body=body,
+                                                   to=payload['to'],
+                                                   from_=TWILIO_PHONE_NUMBER)
+            except TwilioRestException as e:
+                # 4xx (other than throttling) is a bad number or a bad message. Retrying won't help
+                permanent = e.status != 429 and 400 <= e.status < 500
+                raise NotificationDeliveryError("Twilio {}: {}".format(e.status, e.msg), permanent=permanent,
+                                                payload=dict(payload, bodies=bodies[i:]))
+            except Exception as e:
+                raise NotificationDeliveryError(str(e), payload=dict(payload, bodies=bodies[i:]))
+
     def send_twilio_message(self, body, to):
         if to.phone in ['', None]:
             logger.warning("Tried to send SMS to {} but they don't have a phone number".format(to))
             return ""
-        dest_phone = "+1" + str(to.phone)
-        logger.debug('Sending Twilio msg FROM [{}] TO [{}]'.format(TWILIO_PHONE_NUMBER, dest_phone))
-        try:
-            message = self.twilio_client.messages.create(body=body,
-                                                         to=dest_phone,
-                                                         from_=TWILIO_PHONE_NUMBER)
-        except Exception as e:
-            logger.exception(e)
-            return
-        return message
+        return self.send(to.phone, [body])
 
     def send_twilio_message_with_raw_phone(self, body, to_phone):
-        dest_phone = "+1" + str(to_phone)
-        logger.debug('Sending Twilio msg FROM [{}] TO [{}]'.format(TWILIO_PHONE_NUMBER, dest_phone))
-        try:
-            message = self.twilio_client.messages.create(body=body,
-                                                         to=dest_phone,
-                                                         from_=TWILIO_PHONE_NUMBER)
-        except Exception as e:
-            logger.exception(e)
-            return
-        return message
+        return self.send(to_phone, [body])
 
     def request_tow(self, tow_request, requestor, requestee):
-        msgs = []
-
-        msgs.append(
-            self.send_twilio_message(
-                body="DRIFT Tow Request: {} needs {}. Reply yes to help them.".format(
-                    requestor.name,
-                    tow_request.service_requested.string_format_for_text_message),
-                to=requestee)
-        )
-
-        msgs.append(
-            self.send_twilio_message(
-                body="Boat information: {}".format(requestor.boat),
-                to=requestee)
-        )
-
-        msgs.append(
-            self.send_twilio_message(
-                body="https://www.google.com/maps/place/{},{}".format(
-                    str(requestor.last_lat_seen).strip(),
-                    str(requestor.last_long_seen).strip()),
-                to=requestee)
-        )
-        logger.info("TWILIO FIRED TOW REQUEST {} -> {} ({}). Message: {}".format(
+        if requestee.phone in ['', None]:
+            logger.warning("Tried to send tow request to {} but they don't have a phone number".format(requestee))
+            return
+        msgs = [
+            "DRIFT Tow Request: {} needs {}. Reply yes to help them.".format(
+                requestor.name,
+                tow_request.service_requested.string_format_for_text_message),
+            "Boat information: {}".format(requestor.boat),
+            "https://www.google.com/maps/place/{},{}".format(
+                str(requestor.last_lat_seen).strip(),
+                str(requestor.last_long_seen).strip()),
+        ]
+        self.send(requestee.phone, msgs)
+        logger.info("TWILIO QUEUED TOW REQUEST {} -> {} ({}). Message: {}".format(
             requestor.id, requestee.id, requestee.phone, msgs))
 
     def tell_requestee_that_requestor_has_paid(self, requestor, requestee):
@@ -97,14 +123,15 @@ class TwilioMessageSender():
     def send_mweb_drift_request_text(self, phone):
         sanitized_phone_number = re.sub('[^0-9]', '', phone)
         logger.info("Sending mweb form to: " + sanitized_phone_number)
-        self.send_twilio_message_with_raw_phone(body="Thanks for contacting Drift."
-                                                " Please click this link and fill out your information"
-                                                " and we will call you back shortly.",
-                                                to_phone=sanitized_phone_number)
         mweb_form_url = urllib.parse.urljoin(APPLICATION_ROOT, '/user_panel/md_tow_request?phone=' + sanitized_phone_number)
         logger.info(mweb_form_url)
-        self.send_twilio_message_with_raw_phone(body="{}".format(mweb_form_url),
-                                                to_phone=sanitized_phone_number)
+        self.send(sanitized_phone_number, ["Thanks for contacting Drift."
+                                           " Please click this link and fill out your information"
+                                           " and we will call you back shortly.",
+                                           "{}".format(mweb_form_url)])
 
 
 twilio_message_sender = TwilioMessageSender()
+# One row (one captain's texts) per claim, so a wave's captains are texted in parallel
+notification_outbox.register_provider(TwilioMessageSender.provider, twilio_message_sender.deliver,
+                                      TWILIO_DELIVERY_WORKERS, claim_batch=1)
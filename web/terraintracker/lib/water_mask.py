@@ -0,0 +1,110 @@
+"""
+Offline land/water raster, for answering is_water without calling Google
+
+The mask is one file: a fixed-size header, then one bit per grid cell (1 = water), row-major, starting from
+the south-west corner. It's memory-mapped read-only, so a lookup is a couple of arithmetic ops and a byte read,
+and every worker shares the same pages through the OS page cache.
+
+Build one with `python manage.py build_water_mask` (see scripts/build_water_mask.py).
+"""
+import logging
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from terraintracker.config import IS_WATER_BACKEND, WATER_MASK_PATH
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'TTWMASK1'
+HEADER = struct.Struct('<8sdddII')  # magic, min_lat, min_lon, cell_degrees, rows, cols
+HEADER_SIZE = 64  # HEADER, padded so the bits start on a nice boundary
+
+
+class WaterMaskError(Exception):
+    pass
+
+
+class WaterMask():
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.min_lat, self.min_lon, self.cell_degrees, self.rows, self.cols = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise WaterMaskError("{} isn't a water mask".format(path))
+        if len(self._mmap) < HEADER_SIZE + (self.rows * self.cols + 7) // 8:
+            raise WaterMaskError("{} is truncated".format(path))
+        self.max_lat = self.min_lat + self.rows * self.cell_degrees
+        self.max_lon = self.min_lon + self.cols * self.cell_degrees
+        self._bits = np.frombuffer(self._mmap, dtype=np.uint8, offset=HEADER_SIZE)
+
+    def __repr__(self):
+        return '<WaterMask {} {}x{} cells of {} deg from ({}, {})>'.format(
+            self.path, self.rows, self.cols, self.cell_degrees, self.min_lat, self.min_lon)
+
+    def covers(self, lat, lon):
+        return self.min_lat <= lat < self.max_lat and self.min_lon <= lon < self.max_lon
+
+    def is_water(self, lat, lon):
+        """ True/False, or None if (lat, lon) is outside the mask """
+        lat, lon = float(lat), float(lon)
+        if not self.covers(lat, lon):
+            return None
+        row = min(int((lat - self.min_lat) / self.cell_degrees), self.rows - 1)
+        col = min(int((lon - self.min_lon) / self.cell_degrees), self.cols - 1)
+        index = row * self.cols + col
+        return bool((self._mmap[HEADER_SIZE + index // 8] >> (7 - index % 8)) & 1)
+
+    def is_water_many(self, lats, lons):
+        """ Vectorized is_water. Returns (is_water bool array, covered bool array) """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        covered = (lats >= self.min_lat) & (lats < self.max_lat) & (lons >= self.min_lon) & (lons < self.max_lon)
+        rows = np.clip(((lats - self.min_lat) / self.cell_degrees).astype(np.int64), 0, self.rows - 1)
+        cols = np.clip(((lons - self.min_lon) / self.cell_degrees).astype(np.int64), 0, self.cols - 1)
+        index = rows * self.cols + cols
+        water = ((self._bits[index // 8] >> (7 - index % 8)) & 1).astype(bool)
+        return water & covered, covered
+
+
+def write_water_mask(path, min_lat, min_lon, cell_degrees, rows, cols, row_classifier):
+    """
+    Build a mask a row at a time. row_classifier(lats, lons) gets the cell centers of one row
+    (south to north) and returns a bool array, True for water.
+    The file is written next to `path` and renamed over it. Workers only load the mask at startup, so they keep
+    using the old one until they're restarted (`kill -HUP` gunicorn).
+    """
+    if cols % 8:
+        raise WaterMaskError("cols must be a multiple of 8 so rows pack into whole bytes")
+    lons = min_lon + (np.arange(cols) + 0.5) * cell_degrees
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, min_lat, min_lon, cell_degrees, rows, cols).ljust(HEADER_SIZE, b'\0'))
+        for row in range(rows):
+            lats = np.full(cols, min_lat + (row + 0.5) * cell_degrees)
+            water = np.asarray(row_classifier(lats, lons), dtype=bool)
+            f.write(np.packbits(water).tobytes())
+    os.replace(tmp_path, path)
+
+
+def load_configured_water_mask():
+    if IS_WATER_BACKEND != 'water_mask':
+        return None
+    try:
+        mask = WaterMask(WATER_MASK_PATH)
+    except (OSError, WaterMaskError) as e:
+        logger.warning("is_water_backend is water_mask, but couldn't load {}: {}. Using Google".format(
+            WATER_MASK_PATH, e))
+        return None
+    logger.info("Loaded {}".format(mask))
+    return mask
+
+
+# None unless is_water_backend = water_mask
+water_mask = load_configured_water_mask()
@@ -0,0 +1,252 @@
+"""
+Cache of "is this spot water?" answers from the Google static map, per grid cell
+
+Lookups go: in-process LRU -> is_water_cache table -> Google. Everything in a cell gets the answer for the
+cell's center, so the same few harbor cells only ever cost one Google call per IS_WATER_CACHE_TTL_DAYS.
+Cell size and TTL are in the [GoogleMaps] section of the .ini.
+
+get_many() is the batch version. Its misses are answered a static-map tile at a time, and every cell in each
+tile it fetches gets cached, not just the ones that were asked for.
+
+If Google can't be reached (including lib/http_client.py's circuit breaker being open), both raise
+IsWaterLookupError and nothing is cached for the cells it couldn't answer.
+"""
+import logging
+import math
+import threading
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from requests.exceptions import RequestException
+from sqlalchemy import Boolean, Column, DateTime, String
+from sqlalchemy.exc import IntegrityError
+
+import numpy as np
+
+from terraintracker.app_init import db
+from terraintracker.config import IS_WATER_CACHE_CELL_DEGREES, IS_WATER_CACHE_TTL_DAYS
+from terraintracker.constants import IS_WATER_MEMORY_CACHE_MAX_CELLS
+from terraintracker.lib.google_maps import get_color_and_isWater, get_colors_and_isWater_in_tile
+from terraintracker.lib.google_maps.constants import TILE_MARGIN_PIXELS, TILE_SIZE, TILE_ZOOM
+from terraintracker.lib.google_maps.helpers import tile_span_degrees
+
+logger = logging.getLogger(__name__)
+
+
+class IsWaterLookupError(Exception):
+    pass
+
+
+class IsWaterCacheEntry(db.Model):
+    """ One grid cell's answer. cell_key includes the cell size, so changing it just starts a fresh set of keys """
+    __tablename__ = 'is_water_cache'
+    cell_key = Column(String(length=64), primary_key=True)
+    is_water = Column(Boolean)
+    color_google = Column(String(length=36))
+    checked_time = Column(DateTime)
+
+
+class IsWaterCache():
+
+    def __init__(self, cell_degrees=IS_WATER_CACHE_CELL_DEGREES,
+                 ttl=timedelta(days=IS_WATER_CACHE_TTL_DAYS),
+                 max_cells=IS_WATER_MEMORY_CACHE_MAX_CELLS,
+                 lookup=get_color_and_isWater,
+                 tile_lookup=get_colors_and_isWater_in_tile):
+        self.cell_degrees = cell_degrees
+        self.ttl = ttl
+        self.max_cells = max_cells
+        self.lookup = lookup  # (lat, lon) -> (color, is_water). Only called on a miss
+        self.tile_lookup = tile_lookup  # (center_lat, center_lon, lats, lons) -> (colors, is_waters). For get_many
+
+        self.num_memory_hits = 0
+        self.num_db_hits = 0
+        self.num_misses = 0
+        self.num_tiles_fetched = 0
+
+        self._memory = OrderedDict()  # cell_key -> (checked_time, color, is_water). Least recently used first
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<IsWaterCache {} cells in memory. {} memory hits, {} db hits, {} misses>'.format(
+            len(self._memory), self.num_memory_hits, self.num_db_hits, self.num_misses)
+
+    def cell_key(self, lat, lon):
+        row = int(math.floor(float(lat) / self.cell_degrees))
+        col = int(math.floor(float(lon) / self.cell_degrees))
+        return '{}:{}:{}'.format(self.cell_degrees, row, col)
+
+    def cell_center(self, cell_key):
+        _, row, col = cell_key.split(':')
+        return (int(row) + 0.5) * self.cell_degrees, (int(col) + 0.5) * self.cell_degrees
+
+    def _from_memory(self, key, now):
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None and cached[0] + self.ttl > now:
+                self._memory.move_to_end(key)
+                self.num_memory_hits += 1
+                return cached[1], cached[2]
+        return None
+
+    def get(self, lat, lon):
+        """ (color, is_water) for the cell (lat, lon) is in """
+        key = self.cell_key(lat, lon)
+        now = datetime.now()
+
+        cached = self._from_memory(key, now)
+        if cached is not None:
+            return cached
+
+        entry = self._load(key)
+        if entry is not None and entry.checked_time + self.ttl > now:
+            self.num_db_hits += 1
+            self._remember(key, entry.checked_time, entry.color_google, entry.is_water)
+            return entry.color_google, entry.is_water
+
+        self.num_misses += 1
+        center_lat, center_lon = self.cell_center(key)
+        try:
+            color, is_water = self.lookup(center_lat, center_lon)
+        except (RequestException, OSError) as e:
+            # OSError: PIL couldn't read what came back
+            logger.warning("is_water lookup for ({}, {}) failed: {}".format(center_lat, center_lon, e))
+            raise IsWaterLookupError(str(e))
+        self.put(key, str(color), is_water, now)
+        return str(color), is_water
+
+    def get_many(self, points):
+        """ get() for a list of (lat, lon). Returns [(color, is_water), ...] in the same order """
+        now = datetime.now()
+        answers = {}  # cell_key -> (color, is_water)
+        keys = [self.cell_key(lat, lon) for lat, lon in points]
+
+        for key in set(keys):
+            cached = self._from_memory(key, now)
+            if cached is not None:
+                answers[key] = cached
+
+        missing = set(keys) - set(answers)
+        if missing:
+            for entry in self._load_many(missing):
+                if entry.checked_time + self.ttl > now:
+                    self.num_db_hits += 1
+                    self._remember(entry.cell_key, entry.checked_time, entry.color_google, entry.is_water)
+                    answers[entry.cell_key] = (entry.color_google, entry.is_water)
+
+        missing = set(keys) - set(answers)
+        if missing:
+            self.num_misses += len(missing)
+            answers.update(self._fill_tiles(missing, now))
+        return [answers[key] for key in keys]
+
+    def _fill_tiles(self, missing_keys, now):
+        """ Fetch tiles until every key in missing_keys is answered. Caches every cell in each tile """
+        answers = {}
+        remaining = set(missing_keys)
+        while remaining:
+            # Center a tile on any missing cell, and take every cell whose center is safely inside it
+            seed = min(remaining)
+            center_lat, center_lon = self.cell_center(seed)
+            lat_span, lon_span = tile_span_degrees(center_lat, TILE_ZOOM, TILE_SIZE)
+            usable = (TILE_SIZE - 2.0 * TILE_MARGIN_PIXELS) / TILE_SIZE
+            half_lat, half_lon = lat_span * usable / 2, lon_span * usable / 2
+
+            center_row, center_col = [int(x) for x in seed.split(':')[1:]]
+            row_reach = int(half_lat / self.cell_degrees)
+            col_reach = int(half_lon / self.cell_degrees)
+            rows, cols = np.meshgrid(np.arange(center_row - row_reach, center_row + row_reach + 1),
+                                     np.arange(center_col - col_reach, center_col + col_reach + 1), indexing='ij')
+            rows, cols = rows.ravel(), cols.ravel()
+            lats = (rows + 0.5) * self.cell_degrees
+            lons = (cols + 0.5) * self.cell_degrees
+
+            try:
+                colors, is_waters = self.tile_lookup(center_lat, center_lon, lats, lons)
+            except (RequestException, OSError) as e:
+                # Tiles we already fetched stay cached. This one and the rest aren't
+                logger.warning("is_water tile at ({}, {}) failed: {}".format(center_lat, center_lon, e))
+                raise IsWaterLookupError(str(e))
+            self.num_tiles_fetched += 1
+
+            tile_answers = {}
+            for row, col, color, is_water in zip(rows, cols, colors, is_waters):
+                key = '{}:{}:{}'.format(self.cell_degrees, row, col)
+                tile_answers[key] = (str(tuple(int(c) for c in color)), bool(is_water))
+            for key, (color, is_water) in tile_answers.items():
+                self._remember(key, now, color, is_water)
+            self._store_many(tile_answers, now)
+
+            answers.update(tile_answers)
+            remaining -= set(tile_answers)
+        return answers
+
+    def put(self, cell_key, color, is_water, checked_time=None):
+        """ Save an answer to memory and the DB """
+        checked_time = checked_time or datetime.now()
+        self._remember(cell_key, checked_time, color, is_water)
+        self._store(cell_key, checked_time, color, is_water)
+
+    def _remember(self, key, checked_time, color, is_water):
+        with self._lock:
+            self._memory[key] = (checked_time, color, is_water)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_cells:
+                self._memory.popitem(last=False)
+
+    def _load(self, key):
+        try:
+            with db.engine.connect() as connection:
+                return connection.execute(IsWaterCacheEntry.__table__.select()
+                                          .where(IsWaterCacheEntry.cell_key == key)).first()
+        except Exception as e:
+            logger.warning("Couldn't read is_water_cache: {}".format(e))
+            return None
+
+    def _load_many(self, keys):
+        try:
+            with db.engine.connect() as connection:
+                return connection.execute(IsWaterCacheEntry.__table__.select()
+                                          .where(IsWaterCacheEntry.cell_key.in_(list(keys)))).fetchall()
+        except Exception as e:
+            logger.warning("Couldn't read is_water_cache: {}".format(e))
+            return []
+
+    def _store(self, key, checked_time, color, is_water):
+        # Own connection + transaction, so we never commit (or roll back) the caller's db.session.
+        # No ON CONFLICT on 9.4: try the update, then the insert. Losing an insert race is fine
+        table = IsWaterCacheEntry.__table__
+        values = {'is_water': is_water, 'color_google': color, 'checked_time': checked_time}
+        try:
+            with db.engine.begin() as connection:
+                updated = connection.execute(table.update().where(table.c.cell_key == key).values(**values))
+                if updated.rowcount == 0:
+                    connection.execute(table.insert().values(cell_key=key, **values))
+        except IntegrityError:
+            logger.debug("Another worker cached {} first".format(key))
+        except Exception as e:
+            logger.warning("Couldn't write is_water_cache: {}".format(e))
+
+    def _store_many(self, answers, checked_time):
+        """ Replace a whole tile's worth of cells in one transaction """
+        table = IsWaterCacheEntry.__table__
+        rows = [{'cell_key': key, 'is_water': is_water, 'color_google': color, 'checked_time': checked_time}
+                for key, (color, is_water) in answers.items()]
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(table.delete().where(table.c.cell_key.in_(list(answers))))
+                connection.execute(table.insert(), rows)
+        except IntegrityError:
+            # Another worker wrote some of these in the meantime. Do them one at a time
+            for row in rows:
+                self._store(row['cell_key'], checked_time, row['color_google'], row['is_water'])
+        except Exception as e:
+            logger.warning("Couldn't write is_water_cache: {}".format(e))
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+
+is_water_cache = IsWaterCache()
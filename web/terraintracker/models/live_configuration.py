@@ -110,7 +110,9 @@ class LiveConfiguration(db.Model):
 
     # Update this every time you add a new value
     LIVE_PROPERTIES = [
-        '_tow_radius'
+        '_tow_radius',
+        '_dispatch_wave_size',
+        '_dispatch_wave_wait_seconds',
     ]
 
     _tow_radius = db.Column('tow_radius', db.Integer())
@@ -126,6 +128,32 @@ class LiveConfiguration(db.Model):
         self.modification_time = datetime.now()
         self._tow_radius = tow_radius
 
+    # Tow requests go out in waves of this many towers, nearest first. 0/None sends to everybody at once
+    _dispatch_wave_size = db.Column('dispatch_wave_size', db.Integer())
+
+    @property
+    def dispatch_wave_size(self):
+        self.reload_if_stale()
+        return self._dispatch_wave_size
+
+    @dispatch_wave_size.setter
+    def dispatch_wave_size(self, dispatch_wave_size):
+        self.modification_time = datetime.now()
+        self._dispatch_wave_size = dispatch_wave_size
+
+    # How long to wait on a wave before asking the next ring of towers
+    _dispatch_wave_wait_seconds = db.Column('dispatch_wave_wait_seconds', db.Integer())
+
+    @property
+    def dispatch_wave_wait_seconds(self):
+        self.reload_if_stale()
+        return self._dispatch_wave_wait_seconds
+
+    @dispatch_wave_wait_seconds.setter
+    def dispatch_wave_wait_seconds(self, dispatch_wave_wait_seconds):
+        self.modification_time = datetime.now()
+        self._dispatch_wave_wait_seconds = dispatch_wave_wait_seconds
+
 
 try:
     live_config = LiveConfiguration()
@@ -3,8 +3,11 @@ Holds details about a specific location
 """
 from datetime import datetime
 
+import numpy as np
+
 from terraintracker.app_init import db
-from terraintracker.lib.google_maps import get_color_and_isWater
+from terraintracker.lib.water_mask import water_mask
+from terraintracker.models.is_water_cache import is_water_cache
 from geoalchemy2 import Geometry
 import uuid
 
@@ -36,9 +39,33 @@ class Location(db.Model):
         return self.is_water
 
     def _getIsWaterFromGoogle(self):
-        color_google, is_water = get_color_and_isWater(self.lat, self.lon)
+        # Offline mask first, if we're configured to use one and it covers this spot
+        if water_mask is not None:
+            is_water = water_mask.is_water(self.lat, self.lon)
+            if is_water is not None:
+                self.color_google = None
+                self.is_water = is_water
+                return
+
+        # Only actually asks Google when nobody's asked about this cell lately
+        color_google, is_water = is_water_cache.get(self.lat, self.lon)
         self.color_google = str(color_google)
         self.is_water = is_water
 
+    @staticmethod
+    def areWater(points):
+        """ isWater for a list of (lat, lon). Misses are answered a map tile at a time. Returns a list of bools """
+        answers = [None] * len(points)
+        if water_mask is not None and points:
+            mask_water, covered = water_mask.is_water_many([p[0] for p in points], [p[1] for p in points])
+            for i in np.flatnonzero(covered):
+                answers[i] = bool(mask_water[i])
+
+        uncovered = [i for i, answer in enumerate(answers) if answer is None]
+        if uncovered:
+            for i, (_, is_water) in zip(uncovered, is_water_cache.get_many([points[i] for i in uncovered])):
+                answers[i] = is_water
+        return answers
+
     def getNearbyUsers(self):
         pass
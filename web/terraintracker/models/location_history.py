@@ -1,14 +1,192 @@
 """
 Keeps track of where users have been
+
+Position pings are our highest-volume write, so history rows don't go through db.session.
+They're queued in location_history_buffer and written in bulk (one multi-row INSERT)
+when LOCATION_HISTORY_FLUSH_SIZE fixes are waiting, every LOCATION_HISTORY_FLUSH_SECONDS,
+and when the process exits. Fixes that go with a user row update are queued with add_on_commit(),
+so they only reach the buffer if that update commits.
+
+The location_history table is partitioned by month (see the aa7fbb64642f migration). An insert trigger routes
+each row into location_history_yYYYYmMM, so:
+ - Always filter on timestamp when reading it, so Postgres only looks at the partitions it needs
+ - Insert with Core (like the buffer does), not db.session.add(). The trigger eats the RETURNING id the ORM wants
+ - scripts/maintain_location_history.py creates future partitions and drops/downsamples old ones
 """
-from sqlalchemy import Column, DateTime, String
+import atexit
+import logging
+import threading
+
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Float, Index, String, and_, event, or_
 
 from terraintracker.app_init import db
+from terraintracker.constants import (LOCATION_HISTORY_FLUSH_SECONDS,
+                                      LOCATION_HISTORY_FLUSH_SIZE,
+                                      LOCATION_HISTORY_MAX_BUFFERED,
+                                      TRACK_CHUNK_SIZE)
+from terraintracker.models.location import Location
+
+logger = logging.getLogger(__name__)
 
 
 class LocationHistory(db.Model):
     """ Keeps track of where users have been """
+    __table_args__ = (
+        Index('ix_location_history_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    location_id = Column(String(length=64))
+    location_id = Column(String(length=64))  # Only set when we saved a Location too (e.g. IsWater)
     user_id = Column(String(length=32))
     timestamp = Column(DateTime)
+    lat = Column(Float)
+    lon = Column(Float)
+
+    @classmethod
+    def iter_track(cls, user_id, start, end, batch_size=TRACK_CHUNK_SIZE):
+        """
+        Generates (lat, lon, timestamp) for everywhere `user_id` was between `start` and `end`, oldest first.
+        Reads `batch_size` rows at a time (keyset paging on (timestamp, id)), so it never loads the whole track.
+        """
+        last_timestamp, last_id = None, None
+        while True:
+            query = db.session.query(cls.id, cls.lat, cls.lon, cls.timestamp) \
+                .filter(cls.user_id == user_id) \
+                .filter(cls.timestamp >= start, cls.timestamp <= end) \
+                .filter(cls.lat.isnot(None), cls.lon.isnot(None))
+            if last_timestamp is not None:
+                query = query.filter(or_(cls.timestamp > last_timestamp,
+                                         and_(cls.timestamp == last_timestamp, cls.id > last_id)))
+            rows = query.order_by(cls.timestamp, cls.id).limit(batch_size).all()
+
+            for _id, lat, lon, timestamp in rows:
+                yield lat, lon, timestamp
+            if len(rows) < batch_size:
+                return
+            last_id, last_timestamp = rows[-1][0], rows[-1][3]
+
+
+class LocationHistoryBuffer():
+    """ Write-behind queue of LocationHistory rows (and sometimes Locations). One per worker process """
+
+    def __init__(self, flush_size=LOCATION_HISTORY_FLUSH_SIZE,
+                 flush_interval=LOCATION_HISTORY_FLUSH_SECONDS,
+                 max_buffered=LOCATION_HISTORY_MAX_BUFFERED):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+
+        self.num_flushed = 0
+        self.num_dropped = 0
+
+        self._pending = []  # [(location_row or None, history_row), ...] oldest first
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, user_id, lat, lon, timestamp=None, location=None):
+        """ Queue a history row. Pass `location` (not added to db.session) to save it too and point at it """
+        location_row = None
+        if location is not None:
+            location_row = {'id': location.id,
+                            'lat': location.lat,
+                            'lon': location.lon,
+                            'is_water': location.is_water,
+                            'color_google': location.color_google,
+                            'last_seen': location.last_seen}
+        history_row = {'location_id': location.id if location is not None else None,
+                       'user_id': user_id,
+                       'timestamp': timestamp or datetime.now(),
+                       'lat': float(lat),
+                       'lon': float(lon)}
+        with self._lock:
+            self._pending.append((location_row, history_row))
+            self._drop_overflow()
+            should_flush = len(self._pending) >= self.flush_size
+
+        self._start_flusher()
+        if should_flush:
+            self.flush()
+
+    def add_on_commit(self, user_id, lat, lon, timestamp=None):
+        """ add(), once db.session commits. Dropped if it rolls back """
+        pending = db.session.info.setdefault('location_history_pending', [])
+        pending.append((user_id, lat, lon, timestamp or datetime.now()))
+
+    def _drop_overflow(self):
+        overflow = len(self._pending) - self.max_buffered
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.num_dropped += overflow
+            logger.warning("Location history buffer full. Dropped {} oldest fixes ({} total)".format(
+                overflow, self.num_dropped))
+
+    def flush(self):
+        """ Write everything that's queued. Returns how many fixes were written """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+
+            try:
+                # Separate connection + transaction from db.session, so we never commit (or roll back)
+                # somebody's half-finished request
+                location_rows = [r[0] for r in rows if r[0] is not None]
+                with db.engine.begin() as connection:
+                    if location_rows:
+                        connection.execute(Location.__table__.insert(), location_rows)
+                    connection.execute(LocationHistory.__table__.insert(), [r[1] for r in rows])
+            except Exception as e:
+                logger.warning("Failed to flush {} location history rows. Will retry: {}".format(len(rows), e))
+                with self._lock:
+                    self._pending = rows + self._pending
+                    self._drop_overflow()
+                return 0
+
+            self.num_flushed += len(rows)
+            logger.debug("Flushed {} location history rows".format(len(rows)))
+            return len(rows)
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            # Started lazily so it's created after gunicorn forks the worker
+            self._flusher = threading.Thread(target=self._flush_periodically, name='location-history-flusher')
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def stop(self):
+        """ Stops the flusher thread. Whatever's still queued is written at exit """
+        self._stop.set()
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(e)
+
+
+location_history_buffer = LocationHistoryBuffer()
+atexit.register(location_history_buffer.flush)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _queue_committed_history(session):
+    for user_id, lat, lon, timestamp in session.info.pop('location_history_pending', []):
+        location_history_buffer.add(user_id, lat, lon, timestamp)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_rolled_back_history(session):
+    session.info.pop('location_history_pending', None)
@@ -0,0 +1,260 @@
+"""
+Outbox for pushes and texts
+
+Senders (lib/ios_push_notifications.py, lib/twilio.py) don't call OneSignal/Twilio themselves anymore. They build
+the payload and add() a row to db.session, so it commits (or rolls back) with whatever state change it's about.
+Request handlers are done as soon as the teardown commit is.
+
+Delivery threads, a few per provider, claim due rows with a conditional UPDATE (no SKIP LOCKED on 9.4), call the
+provider's deliver(payload), and mark them sent, or back off and retry, or give up after NOTIFICATION_MAX_ATTEMPTS.
+They run in every web worker, or only in `python manage.py deliver_notifications` if [Notifications] delivery
+= worker. A commit with new rows in it wakes the local threads straight away. Everything else is picked up by
+polling.
+
+Delivery is at-least-once: if a worker dies mid-send, the row is retried after NOTIFICATION_CLAIM_TIMEOUT_SECONDS.
+"""
+import json
+import logging
+import random
+import threading
+import time
+
+from datetime import datetime, timedelta
+from enum import Enum
+
+from sqlalchemy import Column, DateTime, Index, Integer, String, Text, event, select
+
+from terraintracker.app_init import db
+from terraintracker.config import NOTIFICATION_DELIVERY
+from terraintracker.constants import (NOTIFICATION_CLAIM_BATCH, NOTIFICATION_CLAIM_TIMEOUT_SECONDS,
+                                      NOTIFICATION_MAX_ATTEMPTS, NOTIFICATION_POLL_SECONDS,
+                                      NOTIFICATION_RETRY_BASE_SECONDS, NOTIFICATION_RETRY_MAX_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationDeliveryError(Exception):
+    """
+    Raised by a provider's deliver(). `permanent` means don't bother retrying (bad number, bad player id...).
+    `payload` is what's left to send, if some of it already went out.
+    Any other exception is retried.
+    """
+    def __init__(self, message, permanent=False, payload=None):
+        super().__init__(message)
+        self.permanent = permanent
+        self.payload = payload
+
+
+class OutboxNotification(db.Model):
+    __tablename__ = 'notification_outbox'
+
+    class Status(Enum):
+        pending = 0
+        sending = 1
+        sent = 2
+        failed = 3
+
+    id = Column(Integer, primary_key=True)
+    provider = Column(String(length=16))  # 'onesignal' or 'twilio'
+    payload = Column(Text)  # JSON, as the provider's deliver() wants it
+    status = Column(Integer, default=Status.pending.value)
+    attempts = Column(Integer, default=0)
+    last_error = Column(String(length=255))
+    created_time = Column(DateTime)
+    next_attempt_time = Column(DateTime)
+    claimed_time = Column(DateTime)
+    sent_time = Column(DateTime)
+
+    __table_args__ = (Index('ix_notification_outbox_status_provider_next_attempt_time',
+                            'status', 'provider', 'next_attempt_time'),)
+
+    def __init__(self, provider, payload):
+        super(db.Model, self).__init__()
+        self.provider = provider
+        self.payload = json.dumps(payload)
+        self.status = OutboxNotification.Status.pending.value
+        self.attempts = 0
+        self.created_time = datetime.now()
+        self.next_attempt_time = self.created_time
+
+    def __repr__(self):
+        return '<OutboxNotification {} {} {}>'.format(self.id, self.provider,
+                                                      OutboxNotification.Status(self.status).name)
+
+
+def retry_delay_seconds(attempts):
+    """ Exponential backoff with jitter, after `attempts` failed tries """
+    delay = min(NOTIFICATION_RETRY_MAX_SECONDS, NOTIFICATION_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class NotificationOutbox():
+
+    def __init__(self, delivery=NOTIFICATION_DELIVERY):
+        self.delivery = delivery
+        self.providers = {}  # name -> (deliver, num_workers, claim_batch)
+
+        self.num_sent = 0
+        self.num_retried = 0
+        self.num_failed = 0
+
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._last_release = 0
+
+    def __repr__(self):
+        return '<NotificationOutbox {} sent, {} retried, {} failed>'.format(self.num_sent, self.num_retried,
+                                                                            self.num_failed)
+
+    def register_provider(self, name, deliver, num_workers, claim_batch=NOTIFICATION_CLAIM_BATCH):
+        """
+        deliver(payload) sends one payload, raising if it didn't go.
+        Each thread claims up to claim_batch rows at a time. Keep it small for slow deliveries, so a burst of
+        rows spreads out over all the threads instead of queueing up behind the first one
+        """
+        self.providers[name] = (deliver, num_workers, claim_batch)
+
+    def add(self, provider, payload):
+        """ Queue a notification in db.session. It goes out once the session commits """
+        notification = OutboxNotification(provider, payload)
+        db.session.add(notification)
+        db.session.info['notification_outbox_pending'] = True
+        logger.debug("Queued {} notification".format(provider))
+        if self.delivery == 'in_process':
+            self.start()
+        return notification
+
+    def wake(self):
+        self._wake.set()
+
+    def start(self):
+        """ Start the delivery threads. Started lazily so they're created after gunicorn forks the worker """
+        if self._workers:
+            return
+        with self._lock:
+            if self._workers:
+                return
+            for name, (_, num_workers, _) in self.providers.items():
+                for i in range(num_workers):
+                    worker = threading.Thread(target=self._deliver_forever, args=(name,),
+                                              name='notification-{}-{}'.format(name, i))
+                    worker.daemon = True
+                    worker.start()
+                    self._workers.append(worker)
+            logger.info("Started {} notification delivery threads".format(len(self._workers)))
+
+    def run_forever(self):
+        """ For `python manage.py deliver_notifications` """
+        self.start()
+        for worker in self._workers:
+            worker.join()
+
+    def _deliver_forever(self, provider):
+        while True:
+            try:
+                if time.time() - self._last_release > NOTIFICATION_CLAIM_TIMEOUT_SECONDS / 10.0:
+                    self._last_release = time.time()
+                    self.release_stale_claims()
+                delivered = self.deliver_due(provider)
+            except Exception as e:
+                logger.exception(e)
+                delivered = 0
+            if not delivered:
+                self._wake.wait(NOTIFICATION_POLL_SECONDS)
+                self._wake.clear()
+
+    def claim(self, provider, limit=NOTIFICATION_CLAIM_BATCH, now=None):
+        """
+        Mark up to `limit` due rows as ours. Returns [(id, payload, attempts), ...].
+        If another thread gets to a row first, it fails our `status == pending` check and we just don't get it
+        """
+        now = now or datetime.now()
+        table = OutboxNotification.__table__
+        pending = OutboxNotification.Status.pending.value
+        due = (select([table.c.id])
+               .where(table.c.status == pending)
+               .where(table.c.provider == provider)
+               .where(table.c.next_attempt_time <= now)
+               .order_by(table.c.id)
+               .limit(limit))
+        claim = (table.update()
+                 .where(table.c.id.in_(due))
+                 .where(table.c.status == pending)
+                 .values(status=OutboxNotification.Status.sending.value,
+                         claimed_time=now,
+                         attempts=table.c.attempts + 1)
+                 .returning(table.c.id, table.c.payload, table.c.attempts))
+        with db.engine.begin() as connection:
+            return [(row[0], json.loads(row[1]), row[2]) for row in connection.execute(claim)]
+
+    def deliver_due(self, provider):
+        """ Claim and send one batch of `provider`'s due rows. Returns how many were claimed """
+        deliver, _, claim_batch = self.providers[provider]
+        claimed = self.claim(provider, limit=claim_batch)
+        for notification_id, payload, attempts in claimed:
+            try:
+                deliver(payload)
+            except Exception as e:
+                self._failed(notification_id, attempts, e)
+            else:
+                self._finish(notification_id, status=OutboxNotification.Status.sent.value,
+                             sent_time=datetime.now())
+                self.num_sent += 1
+        return len(claimed)
+
+    def _failed(self, notification_id, attempts, error):
+        permanent = isinstance(error, NotificationDeliveryError) and error.permanent
+        values = {'last_error': str(error)[:255]}
+        if isinstance(error, NotificationDeliveryError) and error.payload is not None:
+            values['payload'] = json.dumps(error.payload)
+
+        if permanent or attempts >= NOTIFICATION_MAX_ATTEMPTS:
+            logger.warning("Giving up on notification {} after {} attempts: {}".format(
+                notification_id, attempts, error))
+            self._finish(notification_id, status=OutboxNotification.Status.failed.value, **values)
+            self.num_failed += 1
+        else:
+            delay = retry_delay_seconds(attempts)
+            logger.info("Notification {} failed (attempt {}). Retrying in {:.0f}s: {}".format(
+                notification_id, attempts, delay, error))
+            self._finish(notification_id, status=OutboxNotification.Status.pending.value,
+                         next_attempt_time=datetime.now() + timedelta(seconds=delay), **values)
+            self.num_retried += 1
+
+    def _finish(self, notification_id, **values):
+        table = OutboxNotification.__table__
+        with db.engine.begin() as connection:
+            connection.execute(table.update()
+                               .where(table.c.id == notification_id)
+                               .where(table.c.status == OutboxNotification.Status.sending.value)
+                               .values(**values))
+
+    def release_stale_claims(self, now=None):
+        """ Put rows claimed by workers that died back in line """
+        now = now or datetime.now()
+        table = OutboxNotification.__table__
+        with db.engine.begin() as connection:
+            stale = now - timedelta(seconds=NOTIFICATION_CLAIM_TIMEOUT_SECONDS)
+            released = connection.execute(table.update()
+                                          .where(table.c.status == OutboxNotification.Status.sending.value)
+                                          .where(table.c.claimed_time < stale)
+                                          .values(status=OutboxNotification.Status.pending.value,
+                                                  next_attempt_time=now)).rowcount
+        if released:
+            logger.warning("Released {} stale notification claims".format(released))
+        return released
+
+
+notification_outbox = NotificationOutbox()
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_delivery_threads(session):
+    if session.info.pop('notification_outbox_pending', False):
+        notification_outbox.wake()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_pending_notifications(session):
+    session.info.pop('notification_outbox_pending', None)
@@ -0,0 +1,142 @@
+"""
+Times out TowRequestBatches and TowEvents, and sends the next dispatch wave when one's been quiet too long
+
+The status getters don't write anything (they just read as timed_out once a row has expired), so this is what
+actually moves rows to timed_out: two set-based UPDATEs, on the (_status, time_sent) indexes, every
+TIMEOUT_SWEEP_SECONDS. It runs in a daemon thread in every web worker, or from cron with
+`python manage.py sweep_timeouts` if [SystemRuntime] timeout_sweeper = cron. Running it in several places at once
+is fine: the UPDATEs don't care who gets there first, and each wave is claimed with a conditional UPDATE in the
+same transaction that sends it.
+"""
+import logging
+import threading
+
+from datetime import datetime, timedelta
+
+from terraintracker.app_init import db
+from terraintracker.config import TIMEOUT_SWEEPER
+from terraintracker.constants import (TIMEOUT_SWEEP_SECONDS, TOW_EVENT_TIMEOUT_MINUTES,
+                                      TOW_REQUEST_BATCH_TIMEOUT_MINUTES)
+from terraintracker.models.live_configuration import live_config
+from terraintracker.models.tow_event import TowEvent, TowEventStatus
+from terraintracker.models.tow_request import TowRequestBatch
+from terraintracker.models.tow_request_batch_watcher import tow_request_batch_watcher
+from terraintracker.models.user import User
+
+logger = logging.getLogger(__name__)
+
+
+class TimeoutSweeper():
+
+    def __init__(self, interval=TIMEOUT_SWEEP_SECONDS, mode=TIMEOUT_SWEEPER):
+        self.interval = interval
+        self.mode = mode
+
+        self.num_batches_timed_out = 0
+        self.num_events_timed_out = 0
+        self.num_escalations = 0
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper = None
+
+    def __repr__(self):
+        return '<TimeoutSweeper {} batches, {} events timed out. {} escalations>'.format(
+            self.num_batches_timed_out, self.num_events_timed_out, self.num_escalations)
+
+    def sweep(self, now=None):
+        """ One pass. Returns (batches timed out, events timed out, waves escalated) """
+        now = now or datetime.now()
+        batches = self.time_out_batches(now)
+        events = self.time_out_events(now)
+        escalations = self.escalate_quiet_waves(now)
+        if batches or events or escalations:
+            logger.info("Timed out {} tow request batches and {} tow events. Escalated {} waves".format(
+                batches, events, escalations))
+        return batches, events, escalations
+
+    def time_out_batches(self, now):
+        table = TowRequestBatch.__table__
+        with db.engine.begin() as connection:
+            timed_out = [row[0] for row in connection.execute(
+                table.update()
+                     .where(table.c._status == TowRequestBatch.Status.active.value)
+                     .where(table.c.time_sent < now - timedelta(minutes=TOW_REQUEST_BATCH_TIMEOUT_MINUTES))
+                     .values(_status=TowRequestBatch.Status.timed_out.value, version=table.c.version + 1,
+                             last_update=now)
+                     .returning(table.c.id))]
+        tow_request_batch_watcher.notify(timed_out)
+        self.num_batches_timed_out += len(timed_out)
+        return len(timed_out)
+
+    def time_out_events(self, now):
+        table = TowEvent.__table__
+        with db.engine.begin() as connection:
+            timed_out = connection.execute(
+                table.update()
+                     .where(table.c.status.in_(TowEvent.UNFINISHED_STATUSES))
+                     .where(table.c.time_sent < now - timedelta(minutes=TOW_EVENT_TIMEOUT_MINUTES))
+                     .values(status=TowEventStatus.timed_out.value)).rowcount
+        self.num_events_timed_out += timed_out
+        return timed_out
+
+    def escalate_quiet_waves(self, now):
+        """ Send the next wave for every active batch whose current wave has been out dispatch_wave_wait_seconds """
+        wait_seconds = live_config.dispatch_wave_wait_seconds if live_config else None
+        if not wait_seconds:
+            return 0
+        table = TowRequestBatch.__table__
+        quiet_since = now - timedelta(seconds=wait_seconds)
+        with db.engine.connect() as connection:
+            due = connection.execute(
+                db.select([table.c.id, table.c.last_wave_time])
+                  .where(table.c._status == TowRequestBatch.Status.active.value)
+                  .where(table.c.time_sent >= now - timedelta(minutes=TOW_REQUEST_BATCH_TIMEOUT_MINUTES))
+                  .where(table.c.wave_size > 0)
+                  .where(table.c.last_wave_time < quiet_since)).fetchall()
+
+        escalated = 0
+        for batch_id, last_wave_time in due:
+            try:
+                batch = TowRequestBatch.query.get(batch_id)
+                if batch.last_wave_time != last_wave_time:
+                    continue  # Somebody sent a wave since we looked
+                # _send_wave claims the wave (a conditional UPDATE on last_wave_time) in the same transaction that
+                # sends it, so only one of us sends it, and a failure leaves it due for the next sweep
+                num_waves = batch.num_waves
+                if batch.escalate(User.query.get(batch.requestor_id)) and batch.num_waves != num_waves:
+                    escalated += 1
+            except Exception as e:
+                logger.exception(e)
+                db.session.rollback()
+        self.num_escalations += escalated
+        return escalated
+
+    def start(self):
+        """ Started lazily (first request), so it's created after gunicorn forks the worker """
+        if self.mode != 'in_process' or self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_periodically, name='timeout-sweeper')
+            self._sweeper.daemon = True
+            self._sweeper.start()
+
+    def stop(self):
+        """ Stops the sweeper thread after its current pass """
+        self._stop.set()
+
+    def _sweep_periodically(self):
+        from terraintracker.app_init import app
+
+        while not self._stop.wait(self.interval):
+            try:
+                # escalate() uses db.session and sends notifications, which want an app context
+                with app.app_context():
+                    self.sweep()
+            except Exception as e:
+                logger.exception(e)
+
+
+timeout_sweeper = TimeoutSweeper()
@@ -7,7 +7,7 @@ from datetime import datetime, timedelta
 from enum import Enum
 
 
-from sqlalchemy import Column, DateTime, String, Integer
+from sqlalchemy import Column, DateTime, Index, String, Integer
 
 from terraintracker.app_init import db
 from terraintracker.constants import TOW_EVENT_TIMEOUT_MINUTES
@@ -57,14 +57,19 @@ class TowEvent(db.Model):
     # requestee = relationship("User", foreign_keys=[requestee_id], back_populates="active_tow_event_serving",uselist=False)
 
     _status = Column(Integer, name="status", default=TowEventStatus.waiting_for_payment.value)
+    UNFINISHED_STATUSES = (TowEventStatus.waiting_for_payment.value, TowEventStatus.in_progress.value)
+
+    # For timeout_sweeper. Column objects, since _status's column is named 'status'
+    __table_args__ = (Index('ix_tow_event_status_time_sent', _status, time_sent),)
 
     @property
     def status(self):
-        # Check timeout if status is in progress or waiting for confirmation
-        if (self._status == TowEventStatus.in_progress.value) or \
-           (self._status == TowEventStatus.waiting_for_payment.value):
-            if self.time_sent + timedelta(minutes=TOW_EVENT_TIMEOUT_MINUTES) < datetime.now():
-                self.time_out()
+        """
+        Doesn't write anything. timeout_sweeper moves expired events to timed_out in the DB. Until it gets to
+        this one, it reads as timed_out anyway
+        """
+        if self._status in TowEvent.UNFINISHED_STATUSES and self.is_expired():
+            return TowEventStatus.timed_out.value
         return self._status
 
     @status.setter
@@ -75,6 +80,16 @@ class TowEvent(db.Model):
     def status_string(self):
         return TowEventStatus(self.status).name
 
+    def is_expired(self, now=None):
+        return self.time_sent + timedelta(minutes=TOW_EVENT_TIMEOUT_MINUTES) < (now or datetime.now())
+
+    @property
+    def track_window(self):
+        """ (start, end) of the stretch of position history that belongs to this tow. Still going? Ends now """
+        start = self.accepted_time or self.time_sent
+        end = self.completed_time or self.cancelled_time or datetime.now()
+        return start, end
+
     def cancel(self):
         if self.status == TowEventStatus.in_progress.value or self.status == TowEventStatus.waiting_for_payment.value:
             self._status = TowEventStatus.cancelled.value
@@ -7,10 +7,12 @@ from datetime import datetime, timedelta
 from enum import Enum
 
 from sqlalchemy.orm import relationship
-from sqlalchemy import Column, DateTime, String, ForeignKey, Integer
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import Column, DateTime, String, ForeignKey, Index, Integer, func
 
 from terraintracker.app_init import db
 from terraintracker.constants import TOW_REQUEST_BATCH_TIMEOUT_MINUTES
+from terraintracker.models.live_configuration import live_config
 from terraintracker.models.tow_event import TowEvent
 from terraintracker.lib.ios_push_notifications import one_signal_notification_sender
 from terraintracker.lib.twilio import twilio_message_sender
@@ -68,6 +70,16 @@ class TowRequestBatch(db.Model):
     num_rejections = Column(Integer, default=0)
     last_update = Column(DateTime)
 
+    # Wave dispatch: requests go to the nearest `wave_size` towers first, then the next ring, and so on.
+    # wave_size of 0/None means everybody in range got a request in the first (only) wave.
+    # num_requests is the running total across all waves sent so far.
+    wave_size = Column(Integer, default=0)
+    num_waves = Column(Integer, default=0)
+    last_wave_time = Column(DateTime)
+
+    # Goes up every time anything a requestor can see changes. Long polls (tow_request_batch_watcher) wait on it
+    version = Column(Integer, default=0)
+
     _service_requested = Column(Integer, default=TowServiceTypes.tow.value)
 
     @property
@@ -95,24 +107,32 @@ class TowRequestBatch(db.Model):
 
     _status = Column(Integer, default=Status.active.value)
 
+    __table_args__ = (Index('ix_tow_request_batch_status_time_sent', '_status', 'time_sent'),)
+
     @property
     def status(self):
-        # Check timeout if status is in progress or waiting for confirmation
-        self.update_status()
+        """
+        Doesn't write anything. timeout_sweeper moves expired batches to timed_out in the DB. Until it gets to
+        this one, it reads as timed_out anyway
+        """
+        if self._status == TowRequestBatch.Status.active.value and self.is_expired():
+            return TowRequestBatch.Status.timed_out.value
         return self._status
 
     @property
     def status_string(self):
-        return TowRequestBatch.Status(self._status).name
-
-    def update_status(self):
-        # Timeout if needed
-        if self._status == TowRequestBatch.Status.active.value:
-            logger.debug("active")
-            if self.time_sent + timedelta(minutes=TOW_REQUEST_BATCH_TIMEOUT_MINUTES) < datetime.now():
-                logger.debug("timed out")
-                self._status = TowRequestBatch.Status.timed_out.value
-        self.last_update = datetime.now()
+        return TowRequestBatch.Status(self.status).name
+
+    def is_expired(self, now=None):
+        return self.time_sent + timedelta(minutes=TOW_REQUEST_BATCH_TIMEOUT_MINUTES) < (now or datetime.now())
+
+    def seconds_until_expired(self, now=None):
+        expiry = self.time_sent + timedelta(minutes=TOW_REQUEST_BATCH_TIMEOUT_MINUTES)
+        return max(0.0, (expiry - (now or datetime.now())).total_seconds())
+
+    def _changed(self):
+        """ Wakes anybody long polling this batch once the session commits """
+        db.session.info.setdefault('tow_request_batches_changed', set()).add(self.id)
 
     def get_responses(self):
         # Get responses from all TowRequests
@@ -133,21 +153,8 @@ class TowRequestBatch(db.Model):
     def fire(self, requestor):
         requestees = requestor.get_possible_requestees()
 
-        self.num_requests = len(requestees)
-
-        # Make requests
-        for requestee in requestees:
-            try:
-                tr = TowRequest(self, requestee, requestor, self.service_requested)
-                logger.info("New TowRequest[{}]: [{}]->[{}]".format(tr.id, requestor, requestee))
-                tr.fire(requestor, requestee)
-                db.session.add(tr)
-                requestee.requestee_tow_request_id = tr.id
-                db.session.merge(requestee)
-            except Exception as e:
-                logger.exception(e)
-
-        db.session.commit()
+        self.wave_size = (live_config.dispatch_wave_size or 0) if live_config else 0
+        self._send_wave(requestor, requestees)
 
         if len(requestees) == 0:
             logger.info("No requests found for requestor: [{}]".format(requestor.id))
@@ -159,42 +166,165 @@ class TowRequestBatch(db.Model):
 
         logger.info("New TowRequestBatch {}. {} requestees".format(self.id, self.num_requests))
 
+    def _send_wave(self, requestor, candidates):
+        """
+        Send TowRequests to the next wave of `candidates` (nearest first).
+        Returns False, and sends nothing, if somebody else sent a wave since this batch was loaded
+        """
+        requestees = candidates[:self.wave_size] if self.wave_size else candidates
+
+        # Claim the wave: it's only ours if last_wave_time is still what we loaded. The rejection that emptied the
+        # last wave and the timeout sweeper can both try to send the next one. The counts go up in SQL, so waves and
+        # rejections never lose each other's updates
+        db.session.flush()  # So nothing pending gets written over these later
+        now = datetime.now()
+        table = TowRequestBatch.__table__
+        if self.last_wave_time is None:
+            same_wave = table.c.last_wave_time.is_(None)
+        else:
+            same_wave = table.c.last_wave_time == self.last_wave_time
+        claimed = db.session.execute(
+            table.update()
+                 .where(table.c.id == self.id)
+                 .where(same_wave)
+                 .values(num_requests=func.coalesce(table.c.num_requests, 0) + len(requestees),
+                         num_waves=func.coalesce(table.c.num_waves, 0) + 1,
+                         version=table.c.version + 1,
+                         last_wave_time=now,
+                         last_update=now)
+                 .returning(table.c.num_requests, table.c.num_waves)).first()
+        if claimed is None:
+            logger.info("TowRequestBatch {} already sent its next wave".format(self.id))
+            return False
+        for key, value in (('num_requests', claimed[0]), ('num_waves', claimed[1]),
+                           ('last_wave_time', now), ('last_update', now)):
+            set_committed_value(self, key, value)
+        self._changed()
+
+        # Make requests, all in one INSERT, and point each requestee at theirs in one UPDATE. Going around the
+        # unit of work saves a SELECT per merge()d requestee, which added up at 30+ towers.
+        # Android gets texts one by one, iOS pushes get queued together below. Both are only queued in the
+        # outbox here and go out once this commits, so the tow requests exist by then
+        requestor_location = requestor.readable_location
+        tow_requests = []
+        push_requests = []
+        for requestee in requestees:
+            try:
+                tr = TowRequest(self, requestee, requestor, self.service_requested,
+                                requestor_location=requestor_location)
+                logger.info("New TowRequest[{}]: [{}]->[{}]".format(tr.id, requestor, requestee))
+                if requestee.is_android:
+                    tr.fire(requestor, requestee)
+                else:
+                    push_requests.append((requestee, tr.id))
+                tow_requests.append((requestee, tr))
+            except Exception as e:
+                logger.exception(e)
+
+        if push_requests:
+            try:
+                one_signal_notification_sender.sendTowRequests(requestor, push_requests)
+            except Exception as e:
+                logger.exception(e)
+
+        if tow_requests:
+            from terraintracker.models.user import User  # user.py imports this module
+            db.session.bulk_save_objects([tr for _, tr in tow_requests])
+            db.session.bulk_update_mappings(User, [{'id': requestee.id, 'requestee_tow_request_id': tr.id}
+                                                   for requestee, tr in tow_requests])
+            for requestee, tr in tow_requests:
+                # Already in the DB. Don't let the session write it again
+                set_committed_value(requestee, 'requestee_tow_request_id', tr.id)
+        db.session.commit()
+
+        if self.wave_size:
+            logger.info("TowRequestBatch {} wave {}: {} requestees".format(self.id, self.num_waves, len(requestees)))
+        return True
+
+    def escalate(self, requestor):
+        """
+        Send the next wave to the nearest towers that haven't been asked yet.
+        Returns False if we're not dispatching in waves or there's nobody left to ask. True if a new wave is out,
+        even if somebody else beat us to sending it
+        """
+        if not self.wave_size:
+            return False
+        already_asked = set(r.requestee_id for r in
+                            db.session.query(TowRequest.requestee_id).filter_by(tow_request_batch_id=self.id))
+        candidates = [r for r in requestor.get_possible_requestees() if r.id not in already_asked]
+        if not candidates:
+            logger.info("TowRequestBatch {} has no towers left to escalate to".format(self.id))
+            return False
+        self._send_wave(requestor, candidates)
+        return True
+
     def handle_rejection(self, requestor):
-        # Add rejections to tow_request_batch and set status
-        self.update_status()
-        if self._status == TowRequestBatch.Status.timed_out.value:
+        """
+        Counts the rejection in the DB (num_rejections = num_rejections + 1), so simultaneous no's all count, and
+        exactly one of them sees the count catch up with num_requests
+        """
+        if self.status == TowRequestBatch.Status.timed_out.value:
             logger.info("TowRequestBatch [{}] is too old to be accepted".format(self.id))
             raise TowRequestTimedOutError
 
-        self.num_rejections = self.num_rejections + 1
-        if self.num_rejections == self.num_requests:
-            self._status = TowRequestBatch.Status.all_rejected.value
-            logger.info("TowRequestBatch [{}] has been rejected by all {} users".format(self.id, self.num_requests))
-            one_signal_notification_sender.sendNoOneIsComingBecauseYouGotRejected(requestor.one_signal_player_id)
+        now = datetime.now()
+        table = TowRequestBatch.__table__
+        num_rejections, num_requests = db.session.execute(
+            table.update()
+                 .where(table.c.id == self.id)
+                 .values(num_rejections=table.c.num_rejections + 1, version=table.c.version + 1, last_update=now)
+                 .returning(table.c.num_rejections, table.c.num_requests)).first()
+        set_committed_value(self, 'num_rejections', num_rejections)
+        set_committed_value(self, 'num_requests', num_requests)
+        set_committed_value(self, 'last_update', now)
+        self._changed()
+
+        # Everybody asked so far said no. Try the next ring before giving up
+        if num_rejections >= num_requests and not self.escalate(requestor):
+            # Unless somebody accepted (or it was cancelled) in the meantime
+            gave_up = db.session.execute(
+                table.update()
+                     .where(table.c.id == self.id)
+                     .where(table.c._status == TowRequestBatch.Status.active.value)
+                     .values(_status=TowRequestBatch.Status.all_rejected.value,
+                             version=table.c.version + 1)).rowcount
+            if gave_up:
+                set_committed_value(self, '_status', TowRequestBatch.Status.all_rejected.value)
+                logger.info("TowRequestBatch [{}] has been rejected by all {} users".format(self.id, num_requests))
+                one_signal_notification_sender.sendNoOneIsComingBecauseYouGotRejected(requestor.one_signal_player_id)
         else:
             logger.info("Rejected TowRequestBatch")
-        self.last_update = datetime.now()
         db.session.commit()
-        logger.info("TowBatch {} is at {}/{} rejections".format(self.id, self.num_rejections, self.num_requests))
+        logger.info("TowBatch {} is at {}/{} rejections".format(self.id, num_rejections, num_requests))
 
     def handle_acceptance(self, requestor, requestee):
-        self.update_status()
-
-        if self._status == TowRequestBatch.Status.cancelled.value:
-            logger.info("TowRequestBatch [{}] was already cancelled".format(self.id))
-            raise TowRequestCancelledError
-
-        if self._status == TowRequestBatch.Status.accepted.value:
-            logger.info("TowRequestBatch [{}] was already accepted".format(self.id))
+        """
+        Claims the batch for `requestee` and adds its TowEvent to the session. Doesn't commit, the caller does.
+        The claim is one conditional UPDATE, so when two captains say yes at once, the second waits on the first's
+        row lock, then matches nothing and gets TowRequestAlreadyAcceptedError
+        """
+        self._check_acceptable()
+
+        now = datetime.now()
+        expired_before = now - timedelta(minutes=TOW_REQUEST_BATCH_TIMEOUT_MINUTES)
+        table = TowRequestBatch.__table__
+        claimed = db.session.execute(
+            table.update()
+                 .where(table.c.id == self.id)
+                 .where(db.or_(db.and_(table.c._status == TowRequestBatch.Status.active.value,
+                                       table.c.time_sent >= expired_before),
+                               table.c._status == TowRequestBatch.Status.all_rejected.value))
+                 .values(_status=TowRequestBatch.Status.accepted.value, version=table.c.version + 1,
+                         last_update=now)).rowcount
+        if not claimed:
+            # Somebody beat us to it (or cancelled). Find out which
+            db.session.refresh(self)
+            self._check_acceptable()
             raise TowRequestAlreadyAcceptedError
-
-        if self._status == TowRequestBatch.Status.timed_out.value:
-            logger.info("TowRequestBatch [{}] is too old to be accepted".format(self.id))
-            raise TowRequestTimedOutError
-
-        self._status = TowRequestBatch.Status.accepted.value
-        self.last_update = datetime.now()
-        db.session.commit()
+        # The UPDATE went around the ORM. Tell it, so it doesn't write them again
+        set_committed_value(self, '_status', TowRequestBatch.Status.accepted.value)
+        set_committed_value(self, 'last_update', now)
+        self._changed()
         logger.info("TowRequestBatch [{}] has been accepted".format(self.id))
 
         te = TowEvent({'requestor_id': requestor.id,
@@ -203,11 +333,27 @@ class TowRequestBatch(db.Model):
         one_signal_notification_sender.sentTowRequestAccepted(requestor,
                                                               requestee, te.id)
         db.session.add(te)
-        db.session.commit()
         return te
 
+    def _check_acceptable(self):
+        status = self.status
+
+        if status == TowRequestBatch.Status.cancelled.value:
+            logger.info("TowRequestBatch [{}] was already cancelled".format(self.id))
+            raise TowRequestCancelledError
+
+        if status == TowRequestBatch.Status.accepted.value:
+            logger.info("TowRequestBatch [{}] was already accepted".format(self.id))
+            raise TowRequestAlreadyAcceptedError
+
+        if status == TowRequestBatch.Status.timed_out.value:
+            logger.info("TowRequestBatch [{}] is too old to be accepted".format(self.id))
+            raise TowRequestTimedOutError
+
     def cancel(self):
         self._status = TowRequestBatch.Status.cancelled.value
+        self.version = TowRequestBatch.version + 1
+        self._changed()
         db.session.commit()
 
 
@@ -264,7 +410,8 @@ class TowRequest(db.Model):
         else:
             logger.warning("invalid service_requested setter: {}".format(service))
 
-    def __init__(self, tow_request_batch, requestee, requestor, service_requested):
+    def __init__(self, tow_request_batch, requestee, requestor, service_requested, requestor_location=None):
+        """ Pass requestor_location when making a lot of these for the same requestor """
         super(db.Model, self).__init__()
         self.id = uuid.uuid4().hex
         self.time_sent = datetime.now()
@@ -273,7 +420,7 @@ class TowRequest(db.Model):
         self.requestor_name = requestor.name
         self.requestee_id = requestee.id
         self.requestee_name = requestee.name
-        self.requestor_location = requestor.readable_location
+        self.requestor_location = requestor_location or requestor.readable_location
         self.requestee_location = requestee.readable_location
         self.status = TowRequest.Status.active.value
         self.service_requested = service_requested
@@ -0,0 +1,110 @@
+"""
+Long polling for TowRequestBatch changes, so requestors waiting on a captain don't have to hammer
+GET /tow_request_batch
+
+Every change a requestor can see bumps TowRequestBatch.version. A poll that passes the version it last saw waits
+here until the version moves. Changes committed in this process wake it straight away (after_commit, below).
+Changes from other workers or the sweeper get noticed within TOW_REQUEST_BATCH_RECHECK_SECONDS, by re-reading the
+version. At most MAX_LONG_POLLS_PER_WORKER wait at once per process, so they can't tie up all of gunicorn's threads.
+"""
+import logging
+import threading
+import time
+
+from collections import Counter
+
+from sqlalchemy import event
+
+from terraintracker.app_init import db
+from terraintracker.constants import MAX_LONG_POLLS_PER_WORKER, TOW_REQUEST_BATCH_RECHECK_SECONDS
+from terraintracker.models.tow_request import TowRequestBatch
+
+logger = logging.getLogger(__name__)
+
+
+class TooManyWaitersError(Exception):
+    pass
+
+
+class TowRequestBatchWatcher():
+
+    def __init__(self, max_waiters=MAX_LONG_POLLS_PER_WORKER, recheck_seconds=TOW_REQUEST_BATCH_RECHECK_SECONDS):
+        self.max_waiters = max_waiters
+        self.recheck_seconds = recheck_seconds
+
+        self.num_waiting = 0
+        self.num_turned_away = 0
+
+        self._waiters = threading.BoundedSemaphore(max_waiters)
+        self._changed = threading.Condition()
+        self._watching = Counter()  # batch id -> polls waiting on it
+        self._generations = {}  # batch id -> changes seen in this process, for batches somebody's waiting on
+
+    def __repr__(self):
+        return '<TowRequestBatchWatcher {}/{} waiting, {} turned away>'.format(
+            self.num_waiting, self.max_waiters, self.num_turned_away)
+
+    def notify(self, batch_ids):
+        with self._changed:
+            woke = False
+            for batch_id in batch_ids:
+                if batch_id in self._generations:
+                    self._generations[batch_id] += 1
+                    woke = True
+            if woke:
+                self._changed.notify_all()
+
+    def current_version(self, batch_id):
+        # Straight off the engine, so we only hold a connection for the SELECT
+        table = TowRequestBatch.__table__
+        with db.engine.connect() as connection:
+            return connection.execute(db.select([table.c.version]).where(table.c.id == batch_id)).scalar()
+
+    def wait(self, batch_id, version, timeout):
+        """
+        Block until batch_id's version isn't `version`, or for `timeout` seconds. Returns the version.
+        Raises TooManyWaitersError if this process already has max_waiters polls waiting
+        """
+        if not self._waiters.acquire(blocking=False):
+            with self._changed:
+                self.num_turned_away += 1
+            raise TooManyWaitersError
+        deadline = time.time() + timeout
+        with self._changed:
+            self.num_waiting += 1
+            self._watching[batch_id] += 1
+            self._generations.setdefault(batch_id, 0)
+        try:
+            while True:
+                with self._changed:
+                    generation = self._generations[batch_id]
+                current = self.current_version(batch_id)
+                remaining = deadline - time.time()
+                if current != version or remaining <= 0:
+                    return current
+                with self._changed:
+                    self._changed.wait_for(lambda: self._generations[batch_id] != generation,
+                                           min(remaining, self.recheck_seconds))
+        finally:
+            with self._changed:
+                self.num_waiting -= 1
+                self._watching[batch_id] -= 1
+                if not self._watching[batch_id]:
+                    del self._watching[batch_id]
+                    del self._generations[batch_id]
+            self._waiters.release()
+
+
+tow_request_batch_watcher = TowRequestBatchWatcher()
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_waiters(session):
+    changed = session.info.pop('tow_request_batches_changed', None)
+    if changed:
+        tow_request_batch_watcher.notify(changed)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('tow_request_batches_changed', None)
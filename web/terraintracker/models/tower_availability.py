@@ -0,0 +1,136 @@
+"""
+Read-only "are there towers near this point?" checks.
+Used by the mweb form, which asks on every page load. Nothing in here writes to the DB.
+
+Single-point answers come from the in-process tower_index and are cached per grid cell
+for AVAILABILITY_CACHE_TTL_SECONDS, so repeat checks from the same harbor are dict lookups.
+Bulk answers (check_many) come from one set-based PostGIS query.
+"""
+import logging
+import math
+import threading
+import time
+
+from sqlalchemy import text
+
+from terraintracker.app_init import db
+from terraintracker.constants import (AVAILABILITY_CACHE_CELL_DEGREES,
+                                      AVAILABILITY_CACHE_MAX_CELLS,
+                                      AVAILABILITY_CACHE_TTL_SECONDS,
+                                      ETA_BAND_LIMITS_MINUTES,
+                                      TOWER_CRUISING_SPEED_METERS_PER_SECOND)
+from terraintracker.models.live_configuration import live_config
+from terraintracker.models.user import tower_index
+
+logger = logging.getLogger(__name__)
+
+# One row per input point, in input order. Points are built (lat lon) like User.update_position does.
+# The active/role filters match the partial index ix_terraintracker_user_active_tower_geo
+COVERAGE_QUERY = text("""
+    WITH points AS (
+        SELECT p.idx, ST_SetSRID(ST_MakePoint(p.lat, p.lon), 4326)::geography AS geog
+        FROM unnest(CAST(:lats AS float8[]), CAST(:lons AS float8[])) WITH ORDINALITY AS p(lat, lon, idx)
+    )
+    SELECT points.idx,
+           count(u.id) AS num_found,
+           min(ST_Distance(u.last_geo_point_seen, points.geog, false)) AS nearest_meters
+    FROM points
+    LEFT JOIN terraintracker_user u
+        ON u.active = true AND u.role = 2
+        AND ST_DWithin(u.last_geo_point_seen, points.geog, :radius, false)
+    GROUP BY points.idx
+    ORDER BY points.idx
+""")
+
+
+def eta_band(distance_meters):
+    """ e.g. 'under_15_min', '15_to_30_min', 'over_60_min'. None if there's no tower """
+    if distance_meters is None:
+        return None
+    minutes = distance_meters / TOWER_CRUISING_SPEED_METERS_PER_SECOND / 60
+    lower = None
+    for limit in ETA_BAND_LIMITS_MINUTES:
+        if minutes < limit:
+            return 'under_{}_min'.format(limit) if lower is None else '{}_to_{}_min'.format(lower, limit)
+        lower = limit
+    return 'over_{}_min'.format(lower)
+
+
+class TowerAvailability():
+
+    def __init__(self, cell_degrees=AVAILABILITY_CACHE_CELL_DEGREES,
+                 ttl=AVAILABILITY_CACHE_TTL_SECONDS,
+                 max_cells=AVAILABILITY_CACHE_MAX_CELLS):
+        self.cell_degrees = cell_degrees
+        self.ttl = ttl
+        self.max_cells = max_cells
+        self._cache = {}  # (row, col) -> (expires_at, result)
+        self._lock = threading.Lock()
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees))
+
+    def _cell_center(self, cell):
+        return (cell[0] + 0.5) * self.cell_degrees, (cell[1] + 0.5) * self.cell_degrees
+
+    def check(self, lat, lon):
+        """
+        Return {'num_found': <int>, 'nearest_meters': <float|None>, 'eta_band': <str|None>}
+        for towers within live_config.tow_radius of (lat, lon)
+        """
+        cell = self._cell(float(lat), float(lon))
+        now = time.time()
+        cached = self._cache.get(cell)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        # Everybody in the cell gets the answer for the cell's center
+        center_lat, center_lon = self._cell_center(cell)
+        tower_index.reconcile_if_stale()
+        nearby = tower_index.query_radius(center_lat, center_lon, live_config.tow_radius)
+        nearest_meters = nearby[0][1] if nearby else None
+        result = {
+            'num_found': len(nearby),
+            'nearest_meters': nearest_meters,
+            'eta_band': eta_band(nearest_meters),
+        }
+
+        with self._lock:
+            if len(self._cache) >= self.max_cells:
+                self._evict_expired(now)
+            self._cache[cell] = (now + self.ttl, result)
+        return result
+
+    def check_many(self, points):
+        """
+        Bulk version of check() for lists of (lat, lon).
+        Returns one {'lat', 'lon', 'num_found', 'nearest_meters'} dict per point, in the same order.
+        """
+        if not points:
+            return []
+        # Floats only, so formatting them into array literals is safe
+        lats = '{' + ','.join(repr(float(lat)) for lat, _ in points) + '}'
+        lons = '{' + ','.join(repr(float(lon)) for _, lon in points) + '}'
+        rows = db.session.execute(COVERAGE_QUERY, {'lats': lats,
+                                                   'lons': lons,
+                                                   'radius': live_config.tow_radius}).fetchall()
+        return [{'lat': float(lat),
+                 'lon': float(lon),
+                 'num_found': int(row.num_found),
+                 'nearest_meters': float(row.nearest_meters) if row.nearest_meters is not None else None}
+                for (lat, lon), row in zip(points, rows)]
+
+    def _evict_expired(self, now):
+        expired = [cell for cell, (expires_at, _) in self._cache.items() if expires_at <= now]
+        for cell in expired:
+            del self._cache[cell]
+        if len(self._cache) >= self.max_cells:
+            # Everything is fresh and we're still full. Just start over
+            self._cache.clear()
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+tower_availability = TowerAvailability()
@@ -7,18 +7,21 @@ import uuid
 from datetime import datetime
 from enum import Enum
 from geoalchemy2 import func, Geography
-from haversine import haversine
-from sqlalchemy import Column, DateTime, String, Boolean, ForeignKey, Integer
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, DateTime, String, Boolean, ForeignKey, Index, Integer, event, literal_column, text, true
+from sqlalchemy.orm import joinedload, relationship
 from werkzeug.security import generate_password_hash
 
 from terraintracker.app_init import db
+from terraintracker.constants import (NEAREST_TOWERS_DEFAULT_LIMIT,
+                                      TOWER_INDEX_CELL_DEGREES,
+                                      TOWER_INDEX_RECONCILE_SECONDS)
 from terraintracker.models.live_configuration import live_config
-from terraintracker.models.location import Location
-from terraintracker.models.location_history import LocationHistory
+from terraintracker.models.location_history import LocationHistory, location_history_buffer
 from terraintracker.models.tow_event import TowEventStatus
 from terraintracker.models.tow_request import TowRequestBatch, TowRequest
-from terraintracker.lib.calculate_latlon_bearing import get_bearing_between_coords
+from terraintracker.lib.geodesy import bearing_degrees, distance_meters
+from terraintracker.lib.position_filter import position_filter
+from terraintracker.lib.spatial_grid import SpatialGridIndex
 from terraintracker.lib.stripe_integration import initialize_stripe_customer
 from terraintracker.lib.twilio import twilio_message_sender
 
@@ -41,6 +44,12 @@ class TowEventNotFoundError(Exception):
 class User(db.Model):
     """ User model """
     __tablename__ = 'terraintracker_user'
+    __table_args__ = (
+        # Partial GiST index backing the tower searches below. See _active_towers_query
+        Index('ix_terraintracker_user_active_tower_geo', 'last_geo_point_seen',
+              postgresql_using='gist',
+              postgresql_where=text('active = true AND role = 2')),
+    )
 
     id = Column(String(length=32), primary_key=True)
     active = Column(Boolean, default=True)
@@ -114,7 +123,8 @@ class User(db.Model):
     def coords(self):
         return (float(self.last_lat_seen), float(self.last_long_seen))
 
-    last_time_seen = Column(DateTime, default=datetime.now())
+    last_time_seen = Column(DateTime, default=datetime.now())  # Last time they sent us a position at all
+    last_fix_time = Column(DateTime)  # When the fix in last_lat_seen/last_long_seen was taken
 
     @property
     def readable_location(self):
@@ -226,23 +236,69 @@ class User(db.Model):
         logger.info("Created new user: {}".format(self))
 
     @staticmethod
-    def get_requestees_in_geo(lat, lon):
+    def _active_towers_query(point, radius):
+        """
+        Active towers within `radius` meters of `point`, nearest first.
+        The active/role filters are rendered as literals (not bound params) so the planner can match
+        them against the partial index ix_terraintracker_user_active_tower_geo.
+        """
         return User.query.filter(
-            func.ST_DWithin(
-                User.last_geo_point_seen,
-                'POINT({} {})'.format(str(lat), str(lon)),
-                live_config.tow_radius,
-                False)
-        ).filter_by(active=True).filter_by(role=User.Role.tower.value).all()
+            User.active == true()
+        ).filter(
+            User.role == literal_column(str(User.Role.tower.value))
+        ).filter(
+            func.ST_DWithin(User.last_geo_point_seen, point, radius, False)
+        ).order_by(
+            # KNN operator. Lets PostGIS walk the GiST index in distance order instead of sorting
+            User.last_geo_point_seen.op('<->')(point)
+        )
+
+    @staticmethod
+    def _point(lat, lon):
+        # Same (lat lon) ordering as update_position writes into last_geo_point_seen
+        return func.ST_GeogFromText('SRID=4326;POINT({} {})'.format(float(lat), float(lon)))
+
+    @staticmethod
+    def get_requestees_in_geo(lat, lon):
+        return User._active_towers_query(User._point(lat, lon), live_config.tow_radius).all()
+
+    @staticmethod
+    def get_nearest_towers(lat, lon, limit=NEAREST_TOWERS_DEFAULT_LIMIT, radius=None, exclude_ids=None):
+        """
+        Return up to `limit` active towers within `radius` meters (defaults to live_config.tow_radius)
+        of (lat, lon), ordered nearest first.
+        """
+        query = User._active_towers_query(User._point(lat, lon),
+                                          radius if radius is not None else live_config.tow_radius)
+        if exclude_ids:
+            query = query.filter(~User.id.in_(list(exclude_ids)))
+        return query.limit(limit).all()
 
     def get_possible_requestees(self):
+        """
+        Active towers within live_config.tow_radius of this user, nearest first.
+        Answered from the in-process tower_index, so the only DB hit is a primary key lookup.
+        """
         # Need to add time_seen to this
-        possible_requestees = User.query.filter(
-            func.ST_DWithin(User.last_geo_point_seen, self.last_geo_point_seen, live_config.tow_radius, False)
-        ).filter_by(active=True).filter_by(role=self.Role.tower.value).all()
-
-        # Grab everybody but self
-        requestees = [r for r in possible_requestees if r.id != self.id]
+        try:
+            lat, lon = self.coords
+        except (TypeError, ValueError):
+            logger.warning("{} has no position. Can't look for requestees".format(self))
+            return []
+
+        tower_index.reconcile_if_stale()
+        nearby = tower_index.query_radius(lat, lon, live_config.tow_radius, exclude_ids=[self.id])
+        nearby_ids = [_id for _id, _ in nearby]
+        if not nearby_ids:
+            logger.debug("Found 0 requestees")
+            return []
+
+        # Re-check active/role in case another worker changed them since our last reconcile
+        towers = User.query.filter(User.id.in_(nearby_ids)) \
+                           .filter_by(active=True) \
+                           .filter_by(role=self.Role.tower.value).all()
+        towers_by_id = dict((u.id, u) for u in towers)
+        requestees = [towers_by_id[_id] for _id in nearby_ids if _id in towers_by_id]
 
         logger.debug("Found {} requestees".format(len(requestees)))
 
@@ -251,25 +307,71 @@ class User(db.Model):
         return requestees
 
     def update_position(self, lat, lon):
+        """ Returns True if the fix was stored, False if the dead-band filter dropped it """
         try:
             logger.debug("{}->[{:.9f},{:.9f}]".format(self.id, float(lat), float(lon)))
         except Exception:
             logger.warning("update_position got insane data: '{}' '{}'".format(lat, lon))
 
-        loc = Location(float(lat), float(lon))
-        db.session.merge(loc)
+        # They're still around, whether or not we keep the fix
+        now = datetime.now()
+        self.last_time_seen = now
 
-        lh = LocationHistory(user_id=self.id, location_id=loc.id)
-        db.session.add(lh)
+        # Drop fixes inside the dead-band of the last stored one (see lib/position_filter.py)
+        underway = bool(self.active_tow_event_serving_id or self.active_tow_event_receiving_id)
+        last_fix = (self.last_lat_seen, self.last_long_seen, self.last_fix_time)
+        stored = position_filter.should_store(last_fix, (lat, lon, now), underway=underway)
+        if stored:
+            # History is write-behind (see models/location_history.py), and only once the user row commits
+            location_history_buffer.add_on_commit(self.id, float(lat), float(lon), now)
 
-        self.last_time_seen = datetime.now()
-        self.last_lat_seen = str(lat)
-        self.last_long_seen = str(lon)
-        self.last_geo_point_seen = 'POINT({} {})'.format(lat, lon)
+            self.last_fix_time = now
+            self.last_lat_seen = str(lat)
+            self.last_long_seen = str(lon)
+            self.last_geo_point_seen = 'POINT({} {})'.format(lat, lon)
+            _sync_tower_index(self)
 
         db.session.merge(self)
         db.session.commit()
-        return loc
+        return stored
+
+    def record_positions(self, fixes):
+        """
+        Store a backlog of (lat, lon, timestamp) fixes, oldest first, with one bulk insert and one commit.
+        Fixes go through the same dead-band filter as update_position, against the previous stored fix (starting
+        with the one we already have).
+        Only the newest fix moves last_*_seen, and only if it's newer than what we already have.
+        Returns how many fixes were stored.
+        """
+        if not fixes:
+            return 0
+
+        underway = bool(self.active_tow_event_serving_id or self.active_tow_event_receiving_id)
+        rows = []
+        last_kept = (self.last_lat_seen, self.last_long_seen, self.last_fix_time)
+        for lat, lon, timestamp in fixes:
+            if position_filter.should_store(last_kept, (lat, lon, timestamp), underway=underway):
+                rows.append({'location_id': None, 'user_id': self.id, 'timestamp': timestamp, 'lat': lat, 'lon': lon})
+                last_kept = (lat, lon, timestamp)
+
+        if rows:
+            # Same transaction as the user update below. Core insert, since location_history is partitioned
+            db.session.execute(LocationHistory.__table__.insert(), rows)
+
+        lat, lon, timestamp = fixes[-1]
+        if self.last_fix_time is None or timestamp > self.last_fix_time:
+            self.last_fix_time = timestamp
+            self.last_lat_seen = str(lat)
+            self.last_long_seen = str(lon)
+            self.last_geo_point_seen = 'POINT({} {})'.format(lat, lon)
+            _sync_tower_index(self)
+        if self.last_time_seen is None or timestamp > self.last_time_seen:
+            self.last_time_seen = timestamp
+
+        db.session.merge(self)
+        db.session.commit()
+        logger.debug("{} uploaded {} fixes. Stored {}".format(self.id, len(fixes), len(rows)))
+        return len(rows)
 
     def request_tow(self, service_requested=None):
         # Generate TowRequestBatch. Fire it.
@@ -281,14 +383,15 @@ class User(db.Model):
         return trb
 
     def accept_tow_request(self, tow_request_id):
+        """ One query for the request and its batch, one UPDATE to claim the batch, one commit for everything """
         logger.debug("{} is accepting tow_request {}".format(self.id, tow_request_id))
-        tow_request = TowRequest.query.get(tow_request_id)
+        tow_request = TowRequest.query.options(joinedload(TowRequest.tow_request_batch)).get(tow_request_id)
         if tow_request is None:
             raise TowRequestNotFoundError
-        tow_request_batch = TowRequestBatch.query.get(tow_request.tow_request_batch_id)
+        tow_request_batch = tow_request.tow_request_batch
         requestor = User.query.get(tow_request_batch.requestor_id)
 
-        # handle_acceptance creates new tow event
+        # handle_acceptance claims the batch and creates the new tow event
         tow_event = tow_request_batch.handle_acceptance(requestor, self)
         tow_request.status = TowRequest.Status.accepted.value
 
@@ -299,9 +402,7 @@ class User(db.Model):
         requestor.active_tow_event_serving = None
         tow_request.tow_event_id = tow_event.id
 
-        db.session.merge(self)
-        db.session.merge(requestor)
-        db.session.merge(tow_request)
+        db.session.add(self)
         db.session.commit()
 
         logger.debug("{} is serving tow event {}".format(self, self.active_tow_event_serving_id))
@@ -325,10 +426,10 @@ class User(db.Model):
     def get_distance_and_bearing(self, tow_event):
         requestee = User.query.get(tow_event.requestee_id)
         requestor = User.query.get(tow_event.requestor_id)
-        start = (float(requestee.last_lat_seen), float(requestee.last_long_seen))
-        end = (float(requestor.last_lat_seen), float(requestor.last_long_seen))
-        distance = haversine(start, end)
-        bearing = str(get_bearing_between_coords(start, end))
+        start = requestee.coords
+        end = requestor.coords
+        distance = float(distance_meters(start[0], start[1], end[0], end[1])) / 1000  # km
+        bearing = str(float(bearing_degrees(start[0], start[1], end[0], end[1])))
         logger.debug("User [{}]\tBearing [{}]\tDistance [{}]\ttow requestor [{}]".format(self,
                                                                                          bearing,
                                                                                          distance,
@@ -379,6 +480,82 @@ class User(db.Model):
         twilio_message_sender.send_one_message_to_multiple_recipients(User.admins(), message)
 
 
+def _load_active_tower_positions():
+    return db.session.query(User.id, User.last_lat_seen, User.last_long_seen) \
+                     .filter_by(active=True) \
+                     .filter_by(role=User.Role.tower.value).all()
+
+
+# Positions of every active tower, for dispatch and availability checks. One per worker process.
+tower_index = SpatialGridIndex(TOWER_INDEX_CELL_DEGREES,
+                               TOWER_INDEX_RECONCILE_SECONDS,
+                               loader=_load_active_tower_positions)
+
+
+def _sync_tower_index(user):
+    """ Re-index `user` once db.session commits. Other workers pick it up on their next reconcile """
+    db.session.info.setdefault('tower_index_pending', {})[user.id] = user
+
+
+def _tower_position(user):
+    """ (lat, lon) if `user` belongs in tower_index, otherwise None """
+    # active defaults to True in the DB, so None means active
+    if user.active is False or user.role != User.Role.tower.value:
+        return None
+    try:
+        return float(user.last_lat_seen), float(user.last_long_seen)
+    except (TypeError, ValueError):
+        # No position yet. update_position will add them
+        return None
+
+
+@event.listens_for(User.active, 'set')
+def _on_active_set(user, value, oldvalue, initiator):
+    _sync_tower_index(user)
+
+
+@event.listens_for(User.role, 'set')
+def _on_role_set(user, value, oldvalue, initiator):
+    _sync_tower_index(user)
+
+
+@event.listens_for(User, 'after_delete')
+def _on_user_deleted(mapper, connection, user):
+    db.session.info.setdefault('tower_index_deleted', set()).add(user.id)
+
+
+@event.listens_for(db.session, 'before_commit')
+def _snapshot_tower_index_changes(session):
+    # 'set' fires before the new value lands, so read the users here, while we still can
+    pending = session.info.pop('tower_index_pending', None)
+    if not pending:
+        return
+    updates = session.info.setdefault('tower_index_updates', {})
+    for user_id, user in pending.items():
+        try:
+            updates[user_id] = _tower_position(user)
+        except Exception as e:
+            # Leave it to the next reconcile
+            logger.warning("Couldn't read {} for tower_index: {}".format(user_id, e))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_tower_index_changes(session):
+    for user_id, position in session.info.pop('tower_index_updates', {}).items():
+        if position is None:
+            tower_index.remove(user_id)
+        else:
+            tower_index.upsert(user_id, *position)
+    for user_id in session.info.pop('tower_index_deleted', ()):
+        tower_index.remove(user_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_tower_index_changes(session):
+    for key in ('tower_index_pending', 'tower_index_updates', 'tower_index_deleted'):
+        session.info.pop(key, None)
+
+
 class Boat(db.Model):
     __tablename__ = 'terraintracker_boat'
     id = Column(String(length=32), primary_key=True)
@@ -2,7 +2,6 @@
 Creates the functions needed by login_manager and auth
 """
 import logging
-import requests
 
 from flask import g, request, session
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth, MultiAuth
@@ -12,7 +11,8 @@ from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 
 
 from terraintracker.app_init import db
-from terraintracker.config import SECRET_KEY  # , basic_auth, token_auth, , auth
+from terraintracker.config import FACEBOOK_API_URL, SECRET_KEY  # , basic_auth, token_auth, , auth
+from terraintracker.lib.http_client import facebook_http
 from terraintracker.models.user import User
 
 logger = logging.getLogger(__name__)
@@ -67,7 +67,7 @@ def verify_auth_token(auth_token):
 
     # Verify token with FB
     try:
-        response = requests.get('https://graph.facebook.com/me?access_token=' + auth_token)
+        response = facebook_http.get(FACEBOOK_API_URL + '/me', params={'access_token': auth_token})
         data = response.json()
         if data.get('error'):
             logger.warning(data.get('error'))
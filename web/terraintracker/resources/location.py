@@ -3,11 +3,12 @@ import logging
 from flask import g, request
 from flask_restful import Resource
 
-from terraintracker.app_init import db
+from terraintracker.constants import MAX_IS_WATER_POINTS
 from terraintracker.resources.auth import multi_auth
+from terraintracker.models.is_water_cache import IsWaterLookupError
 from terraintracker.models.location import Location
-from terraintracker.models.location_history import LocationHistory
-from terraintracker.resources.response_templates import bad_request
+from terraintracker.models.location_history import location_history_buffer
+from terraintracker.resources.response_templates import bad_request, service_unavailable
 
 logger = logging.getLogger(__name__)
 
@@ -27,13 +28,12 @@ class IsWater(Resource):
             loc = Location(float(lat), float(lon))
         except ValueError:
             return bad_request("Lat and lon must be floats")
-        is_water = loc.isWater()
-        db.session.merge(loc)
-
-        lh = LocationHistory(user_id=user_id, location_id=loc.id)
-        db.session.merge(lh)
+        try:
+            is_water = loc.isWater()
+        except IsWaterLookupError:
+            return service_unavailable("Couldn't check is_water right now")
+        location_history_buffer.add(user_id, loc.lat, loc.lon, location=loc)
 
-        db.session.commit()
         data = {
             'lat': lat,
             'lon': lon,
@@ -41,3 +41,27 @@ class IsWater(Resource):
         }
 
         return data, 200
+
+    def post(self):
+        """
+        Batch is_water: {"points": [{"lat": <float>, "lon": <float>}, ...]}.
+        Returns {"points": [{"lat", "lon", "is_water"}, ...]} in the same order.
+        Cache misses are answered a map tile at a time, so one Google call covers hundreds of nearby points.
+        """
+        try:
+            points = [(float(p['lat']), float(p['lon'])) for p in request.get_json()['points']]
+        except Exception:
+            return bad_request('points must be a list of {"lat": <float>, "lon": <float>}')
+        if len(points) > MAX_IS_WATER_POINTS:
+            return bad_request("too many points. max is {}".format(MAX_IS_WATER_POINTS))
+        for lat, lon in points:
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                return bad_request("invalid point ({}, {})".format(lat, lon))
+
+        try:
+            answers = Location.areWater(points)
+        except IsWaterLookupError:
+            return service_unavailable("Couldn't check is_water right now")
+        logger.info("{} checked is_water for {} points".format(g.user.id, len(points)))
+        return {'points': [{'lat': lat, 'lon': lon, 'is_water': is_water}
+                           for (lat, lon), is_water in zip(points, answers)]}, 200
@@ -48,13 +48,11 @@ class MarinaTwilio(Resource):
             logging.exception(e)
             return twilio_response_templates.invalid_marina_flow()
 
-        twilio_message_sender.send_twilio_message_with_raw_phone(
+        twilio_message_sender.send(phone, [
             ("Captain {} from Freedom Boat Club is on their way to help you out. "
              "If you require further assistance "
-             "please call Freedom Boat Club at (855) 373-3366").format(this_user.name), phone)
-
-        twilio_message_sender.send_twilio_message_with_raw_phone(
+             "please call Freedom Boat Club at (855) 373-3366").format(this_user.name),
             "To see live updates of Captain {}'s progress, please click this link: {}. ".format(
-                this_user.name, config.APPLICATION_ROOT + '/marina_user/live_map'), phone)
+                this_user.name, config.APPLICATION_ROOT + '/marina_user/live_map')])
 
         return twilio_response_templates.marina_flow_started(name, phone)
@@ -2,15 +2,14 @@
 Handles towing CRUD
 """
 import logging
-import random
 
 from flask import request, g
 from flask_restful import Resource
 
-from terraintracker.app_init import db
 from terraintracker.resources.decorators import log_request
 from terraintracker.models.user import User, Boat
 from terraintracker.models.tow_request import NoRequesteesFound
+from terraintracker.models.tower_availability import tower_availability
 
 
 logger = logging.getLogger(__name__)
@@ -59,23 +58,24 @@ class MWebTowRequest(Resource):
         return {"status": "success"}
 
     def get(self):
+        """
+        How many towers are in range of a point? Read-only - doesn't create or touch any users.
+
+        .. :quickref: MWeb Tow Request; Count towers in range of a lat/lon.
+
+        :query lat: latitude
+        :query lon: longitude
+        :>json string num_found: number of active towers within the tow radius
+        :>json string eta_band: rough ETA of the nearest tower. e.g. "under_15_min". null if none found
+        """
         logger.info(request.args)
         try:
-            lat = str(request.args['lat'])[:10].strip()
-            lon = str(request.args['lon'])[:10].strip()
+            lat = float(str(request.args['lat'])[:10].strip())
+            lon = float(str(request.args['lon'])[:10].strip())
             logger.info("{}, {}".format(lat, lon))
-
-            # This is an ugly way to test availability but for some reason
-            # I have to create a user to run that Geo DB Query
-            user_id = ("internal_avail_checker{}").format(random.randint(0, 10))
-            u = User.query.get(user_id)
-            if not u:
-                u = User(_id=user_id, name=user_id)
-            u.update_position(lat, lon)
-            db.session.merge(u)
-            requestees = u.get_possible_requestees()
+            availability = tower_availability.check(lat, lon)
         except Exception as e:
             logger.exception(e)
-            db.session.rollback()
             return {'status': 'error'}
-        return {"num_found": "{}".format(len(requestees))}
+        return {"num_found": "{}".format(availability['num_found']),
+                "eta_band": availability['eta_band']}
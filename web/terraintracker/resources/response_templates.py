@@ -26,3 +26,12 @@ def resp404(obj_they_wanted_to_see="The object you're looking for"):
     })
     resp.status_code = 404
     return resp
+
+
+def service_unavailable(message=None):
+    resp = jsonify({
+        'status': 'Service Unavailable',
+        'message': message if message else 'Try again in a bit',
+    })
+    resp.status_code = 503
+    return resp
@@ -8,13 +8,14 @@ from terraintracker.models.tow_event import TowEvent
 from terraintracker.models.user import User
 from terraintracker.resources.decorators import log_request
 from terraintracker.resources.auth import multi_auth
-from terraintracker.config import STRIPE_API_KEY, PRICE_OF_A_TOW
+from terraintracker.config import STRIPE_API_KEY, STRIPE_API_URL, PRICE_OF_A_TOW
 
 from terraintracker.lib.twilio import twilio_message_sender
 
 logger = logging.getLogger(__name__)
 
 stripe.api_key = STRIPE_API_KEY
+stripe.api_base = STRIPE_API_URL
 
 
 class StripeCustomerResource(Resource):
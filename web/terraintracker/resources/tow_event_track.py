@@ -0,0 +1,111 @@
+"""
+Streams the GPS path of a tow (the captain's by default) for operators and the marina live map
+"""
+import json
+import logging
+
+from flask import Response, g, request, stream_with_context
+from flask_restful import Resource
+
+from terraintracker.constants import TRACK_DEFAULT_TOLERANCE_METERS
+from terraintracker.lib.track_simplification import simplify_stream
+from terraintracker.models.location_history import LocationHistory
+from terraintracker.models.tow_event import TowEvent
+from terraintracker.resources.auth import multi_auth
+from terraintracker.resources.decorators import log_request
+from terraintracker.resources.response_templates import bad_request, resp404, unauthorized
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'geojson': 'application/geo+json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def geojson_lines(tow_event, user_id, fixes):
+    """ One GeoJSON Feature with a LineString, written a coordinate at a time """
+    properties = json.dumps({'tow_event_id': tow_event.id, 'user_id': user_id})
+    yield '{"type": "Feature", "properties": ' + properties + ', "geometry": {"type": "LineString", "coordinates": ['
+    separator = ''
+    for lat, lon, _ in fixes:
+        # GeoJSON is [lon, lat]
+        yield '{}[{}, {}]'.format(separator, lon, lat)
+        separator = ', '
+    yield ']}}\n'
+
+
+def ndjson_lines(fixes):
+    for lat, lon, timestamp in fixes:
+        yield json.dumps({'lat': lat, 'lon': lon, 'timestamp': timestamp.isoformat()}) + '\n'
+
+
+class TowEventTrackResource(Resource):
+
+    decorators = [log_request, multi_auth.login_required]
+
+    def get(self):
+        """
+        Path of a tow between its accepted_time and completed_time (or now, if it's still going)
+
+        .. :quickref: Tow Event Track; Stream a tow's simplified GPS path.
+
+        **Example request**:
+
+        .. sourcecode:: http
+
+          GET /tow_event_track?tow_event_id=1a2b3c&tolerance=25&format=ndjson HTTP/1.1
+          Host: example.com
+          Authorization: Token <facebook_access_token>
+
+        **Example response**:
+
+        .. sourcecode:: http
+
+          HTTP/1.1 200 OK
+          Content-Type: application/x-ndjson
+
+          {"lat": 31.252527, "lon": -81.333583, "timestamp": "2018-06-18T04:20:26"}
+          {"lat": 31.252911, "lon": -81.331002, "timestamp": "2018-06-18T04:21:02"}
+
+        :query tow_event_id: TowEvent to get the path for
+        :query who: `requestee` (the captain, default) or `requestor`
+        :query tolerance: Douglas-Peucker tolerance in meters. 0 for every stored fix. Default 10
+        :query format: `geojson` (one LineString Feature, default) or `ndjson` (one fix per line, with timestamps)
+        :status 200: success
+        :status 403: bad params, or you're not part of this tow (and not an admin)
+        :status 404: no such tow event
+        """
+        tow_event_id = request.args.get('tow_event_id')
+        who = request.args.get('who', 'requestee')
+        output_format = request.args.get('format', 'geojson')
+        try:
+            tolerance = float(request.args.get('tolerance', TRACK_DEFAULT_TOLERANCE_METERS))
+        except ValueError:
+            return bad_request("tolerance must be a number of meters")
+
+        if not tow_event_id:
+            return bad_request("Missing required 'tow_event_id' argument")
+        if who not in ('requestee', 'requestor'):
+            return bad_request("who must be 'requestee' or 'requestor'")
+        if output_format not in FORMATS:
+            return bad_request("format must be one of {}".format(', '.join(sorted(FORMATS))))
+        if tolerance < 0:
+            return bad_request("tolerance can't be negative")
+
+        te = TowEvent.query.get(tow_event_id)
+        if te is None:
+            return resp404("Tow Event")
+        if g.user.id not in (te.requestor_id, te.requestee_id) and not g.user.is_admin:
+            return unauthorized()
+
+        user_id = te.requestee_id if who == 'requestee' else te.requestor_id
+        start, end = te.track_window
+        logger.info("{} streaming {} track of TowEvent:{} ({} - {})".format(g.user, who, te.id, start, end))
+
+        fixes = simplify_stream(LocationHistory.iter_track(user_id, start, end), tolerance)
+        if output_format == 'geojson':
+            lines = geojson_lines(te, user_id, fixes)
+        else:
+            lines = ndjson_lines(fixes)
+        return Response(stream_with_context(lines), mimetype=FORMATS[output_format])
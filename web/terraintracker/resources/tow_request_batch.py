@@ -2,14 +2,18 @@
 Handles towing CRUD
 """
 import logging
+import math
 
 from flask import request, g
 from flask_restful import Resource
 
+from terraintracker.app_init import db
+from terraintracker.constants import TOW_REQUEST_BATCH_LONG_POLL_SECONDS
 from terraintracker.resources.auth import multi_auth
 from terraintracker.resources.decorators import log_request
 from terraintracker.models.tow_event import TowEvent
 from terraintracker.models.tow_request import NoRequesteesFound, TowRequestBatch
+from terraintracker.models.tow_request_batch_watcher import TooManyWaitersError, tow_request_batch_watcher
 from terraintracker.lib.ios_push_notifications import one_signal_notification_sender
 
 
@@ -166,6 +170,9 @@ class TowRequestBatchResource(Resource):
         .. :quickref: Tow Request Batch; Current user gets the status of their outgoing Tow Request Batch
 
         :<json string tow_request_batch_id: UUID of the TowRequestBatch they want the status of
+        :<json int version: [optional] `version` from the last response. Long polls: doesn't answer until something
+                            changes, or `wait` seconds
+        :<json int wait: [optional] Most seconds to wait for a change. Default/max 25
 
         :>json string num_requests: number of users that have received the tow request
         :>json string num_rejections: number of users that have rejected the tow request
@@ -173,6 +180,7 @@ class TowRequestBatchResource(Resource):
         :>json string status: status of the Tow Request Batch. One of: [timed_out, rejected, active, accepted]
         :>json string tow_event_id: [optional] ID of a tow_event that resulted
                                     from this batch if batch status is accepted
+        :>json int version: pass it back as `version` to wait for the next change
 
         :status 200: Success
         :status 400: Bad request - probably due to missing *tow_request_batch_id* param
@@ -198,7 +206,28 @@ class TowRequestBatchResource(Resource):
             logger.warning("User tried to access someone elses tow request")
             return {'status': "can't get someone else's tow request batch"}, 403
 
-        trb.update_status()
+        if request.args.get('version') is not None:
+            try:
+                version = int(request.args['version'])
+                wait = min(float(request.args.get('wait', TOW_REQUEST_BATCH_LONG_POLL_SECONDS)),
+                           TOW_REQUEST_BATCH_LONG_POLL_SECONDS)
+            except ValueError:
+                return {'status': 'version and wait must be numbers'}, 400
+            if not math.isfinite(wait) or wait < 0:
+                return {'status': 'wait must be a number of seconds'}, 400
+            # Only active batches have anything left to wait for
+            if trb.version == version and trb.status == TowRequestBatch.Status.active.value:
+                # Wakes up when it times out, too
+                wait = min(wait, trb.seconds_until_expired())
+                # Don't sit on a DB connection while we wait
+                db.session.commit()
+                try:
+                    tow_request_batch_watcher.wait(tow_request_batch_id, version, wait)
+                except TooManyWaitersError:
+                    # Answer now. Clients just poll again
+                    logger.warning("Too many long polls waiting. {}".format(tow_request_batch_watcher))
+                db.session.refresh(trb)
+
         tow_event_id = None
         try:
             tow_event = TowEvent.query.filter_by(tow_request_batch_id=tow_request_batch_id).first()
@@ -210,7 +239,8 @@ class TowRequestBatchResource(Resource):
             'num_rejections': trb.num_rejections,
             'last_update': str(trb.last_update),
             'status': trb.status_string,
-            'tow_event_id': tow_event_id
+            'tow_event_id': tow_event_id,
+            'version': trb.version
         }
         logger.debug(res)
 
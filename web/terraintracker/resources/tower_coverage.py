@@ -0,0 +1,82 @@
+"""
+Bulk tower coverage checks (marina slips, planned routes, fleets)
+"""
+import logging
+
+from flask import request
+from flask_restful import Resource
+
+from terraintracker.constants import MAX_COVERAGE_POINTS
+from terraintracker.resources.auth import multi_auth
+from terraintracker.resources.decorators import log_request
+from terraintracker.models.tower_availability import tower_availability
+
+
+logger = logging.getLogger(__name__)
+
+
+class TowerCoverageResource(Resource):
+
+    decorators = [log_request, multi_auth.login_required]
+
+    def post(self):
+        """
+        Tower coverage for a whole list of points in one call
+
+        .. :quickref: Tower Coverage; Count towers in range of many points at once.
+
+        **Example request**:
+
+        .. sourcecode:: http
+
+          POST /tower_coverage HTTP/1.1
+          Host: example.com
+          Content-Type: application/json
+          Accept: application/json
+          Authorization: Token <facebook_access_token>
+          Data: {"points": [{"lat": 31.252527, "lon": -81.333583},
+                            {"lat": 31.242464, "lon": -81.120793}]}
+
+        **Example response**:
+
+        .. sourcecode:: http
+
+          HTTP/1.1 200 OK
+          Vary: Accept
+          Content-Type: application/json
+
+          {
+            "points": [
+              {"lat": 31.252527, "lon": -81.333583, "num_found": 4, "nearest_meters": 7512.2},
+              {"lat": 31.242464, "lon": -81.120793, "num_found": 0, "nearest_meters": null}
+            ]
+          }
+
+        :<json list points: list of {"lat": float, "lon": float}. At most MAX_COVERAGE_POINTS
+        :>json list points: one entry per input point, in the same order
+        :status 200: success
+        :status 400: missing/invalid points, or too many of them
+        :status 401: authorization failed
+        """
+        try:
+            args = request.get_json()
+            points = [(float(p['lat']), float(p['lon'])) for p in args['points']]
+        except Exception as e:
+            logger.info("Bad tower_coverage request: {}".format(e))
+            return {'status': 'points must be a list of {"lat": <float>, "lon": <float>}'}, 400
+
+        if len(points) > MAX_COVERAGE_POINTS:
+            return {'status': 'too many points. max is {}'.format(MAX_COVERAGE_POINTS)}, 400
+
+        for lat, lon in points:
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                return {'status': 'invalid point ({}, {})'.format(lat, lon)}, 400
+
+        try:
+            coverage = tower_availability.check_many(points)
+        except Exception as e:
+            logger.exception(e)
+            return {'status': 'error'}, 500
+
+        logger.info("Checked tower coverage for {} points".format(len(points)))
+        return {'points': coverage}, 200
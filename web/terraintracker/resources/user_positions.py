@@ -0,0 +1,94 @@
+"""
+Batched position upload for captain apps coming back into coverage with a backlog of fixes
+"""
+import logging
+
+from datetime import datetime, timedelta
+
+from flask import g, request
+from flask_restful import Resource
+
+from terraintracker.constants import MAX_POSITION_BATCH, MAX_POSITION_CLOCK_SKEW_SECONDS
+from terraintracker.resources.auth import multi_auth
+from terraintracker.resources.decorators import log_request
+from terraintracker.resources.response_templates import bad_request
+
+logger = logging.getLogger(__name__)
+
+
+def parse_fixes(raw_fixes):
+    """ Validate [{"lat", "lon", "timestamp"}, ...]. Returns ([(lat, lon, datetime), ...] oldest first, error) """
+    if not isinstance(raw_fixes, list) or not raw_fixes:
+        return None, "fixes must be a non-empty list of {\"lat\": <float>, \"lon\": <float>, \"timestamp\": <float>}"
+    if len(raw_fixes) > MAX_POSITION_BATCH:
+        return None, "too many fixes. max is {}".format(MAX_POSITION_BATCH)
+
+    latest_allowed = datetime.now() + timedelta(seconds=MAX_POSITION_CLOCK_SKEW_SECONDS)
+    fixes = []
+    for i, raw_fix in enumerate(raw_fixes):
+        try:
+            lat, lon = float(raw_fix['lat']), float(raw_fix['lon'])
+            timestamp = datetime.fromtimestamp(float(raw_fix['timestamp']))
+        except (KeyError, TypeError, ValueError, OverflowError, OSError):
+            return None, "fix {} must have float lat, lon and timestamp (unix seconds)".format(i)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return None, "fix {} has an invalid position ({}, {})".format(i, lat, lon)
+        if timestamp > latest_allowed:
+            return None, "fix {} is from the future".format(i)
+        fixes.append((lat, lon, timestamp))
+
+    # Apps should send them in order, but don't rely on it. sort() is stable, so ties keep their order
+    fixes.sort(key=lambda fix: fix[2])
+    return fixes, None
+
+
+class UserPositionsResource(Resource):
+
+    decorators = [log_request, multi_auth.login_required]
+
+    def post(self):
+        """
+        Upload a backlog of timestamped fixes in one call
+
+        .. :quickref: User Positions; Store many position fixes at once.
+
+        **Example request**:
+
+        .. sourcecode:: http
+
+          POST /user_positions HTTP/1.1
+          Host: example.com
+          Content-Type: application/json
+          Accept: application/json
+          Authorization: Token <facebook_access_token>
+          Data: {"fixes": [{"lat": 31.252527, "lon": -81.333583, "timestamp": 1529300000.0},
+                           {"lat": 31.252911, "lon": -81.331002, "timestamp": 1529300015.5}]}
+
+        **Example response**:
+
+        .. sourcecode:: http
+
+          HTTP/1.1 200 OK
+          Vary: Accept
+          Content-Type: application/json
+
+          {
+            "num_received": 2,
+            "num_stored": 2
+          }
+
+        :<json list fixes: list of {"lat": float, "lon": float, "timestamp": unix seconds}. At most MAX_POSITION_BATCH
+        :>json int num_received: how many fixes we got
+        :>json int num_stored: how many made it past the dead-band filter
+        :status 200: success
+        :status 403: missing/invalid fixes, or too many of them
+        :status 401: authorization failed
+        """
+        args = request.get_json(silent=True) or {}
+        fixes, error = parse_fixes(args.get('fixes'))
+        if error:
+            logger.info("Bad user_positions request from {}: {}".format(g.user.id, error))
+            return bad_request(error)
+
+        num_stored = g.user.record_positions(fixes)
+        return {'num_received': len(fixes), 'num_stored': num_stored}, 200
@@ -0,0 +1,88 @@
+"""
+Builds the offline water mask (lib/water_mask.py) for a lat/lon box
+
+    python manage.py build_water_mask --min-lat 30.9 --min-lon -81.6 --max-lat 31.5 --max-lon -81.0 \
+        --source shapefile --shapefile water_polygons.shp
+
+Sources:
+ - shapefile: polygons of water (or of land, with --land). Needs pyshp (`pip install pyshp`), which we only need here
+ - google: samples every cell center through is_water_cache.get_many, so uncached areas cost one static-map tile
+   per few hundred cells. Fine for a few harbors. Use a shapefile for a coastline.
+"""
+import numpy as np
+
+from terraintracker.config import IS_WATER_CACHE_CELL_DEGREES, WATER_MASK_PATH
+from terraintracker.lib.water_mask import write_water_mask
+
+
+def shapefile_classifier(shapefile_path, land=False):
+    """ Scanline even-odd fill of every ring in the shapefile. Overlapping polygons cancel out, so don't have any """
+    import shapefile  # pyshp. Optional, so imported here
+
+    reader = shapefile.Reader(shapefile_path)
+    if reader.shapeType not in (shapefile.POLYGON, shapefile.POLYGONZ, shapefile.POLYGONM):
+        raise ValueError("{} isn't a polygon shapefile (shape type {})".format(shapefile_path, reader.shapeType))
+
+    x1, y1, x2, y2 = [], [], [], []
+    for shape in reader.shapes():
+        starts = list(shape.parts) + [len(shape.points)]
+        for start, end in zip(starts[:-1], starts[1:]):
+            ring = np.asarray(shape.points[start:end], dtype=float)  # (lon, lat)
+            if len(ring) < 3:
+                continue
+            closed = np.vstack([ring, ring[:1]])
+            x1.append(closed[:-1, 0])
+            y1.append(closed[:-1, 1])
+            x2.append(closed[1:, 0])
+            y2.append(closed[1:, 1])
+    if not x1:
+        raise ValueError("{} has no polygons in it".format(shapefile_path))
+    x1, y1, x2, y2 = [np.concatenate(a) for a in (x1, y1, x2, y2)]
+
+    def classify(lats, lons):
+        lat = lats[0]  # Whole row has the same lat
+        crosses = (y1 > lat) != (y2 > lat)
+        slope = (x2[crosses] - x1[crosses]) / (y2[crosses] - y1[crosses])
+        crossings = np.sort(x1[crosses] + (lat - y1[crosses]) * slope)
+        # Inside if there's an odd number of edge crossings to the east
+        inside = (len(crossings) - np.searchsorted(crossings, lons, side='right')) % 2 == 1
+        return ~inside if land else inside
+
+    return classify
+
+
+def google_classifier():
+    from terraintracker.models.is_water_cache import is_water_cache
+
+    def classify(lats, lons):
+        return np.array([is_water for _, is_water in is_water_cache.get_many(list(zip(lats, lons)))], dtype=bool)
+
+    return classify
+
+
+def run(min_lat, min_lon, max_lat, max_lon, source='google', shapefile_path=None, land=False,
+        cell_degrees=IS_WATER_CACHE_CELL_DEGREES, path=WATER_MASK_PATH):
+    min_lat, min_lon, max_lat, max_lon, cell_degrees = [float(x) for x in
+                                                        (min_lat, min_lon, max_lat, max_lon, cell_degrees)]
+    if source == 'shapefile':
+        if not shapefile_path:
+            raise ValueError("--shapefile is required with --source shapefile")
+        classify = shapefile_classifier(shapefile_path, land)
+    elif source == 'google':
+        classify = google_classifier()
+    else:
+        raise ValueError("source must be shapefile or google")
+
+    rows = int(np.ceil((max_lat - min_lat) / cell_degrees))
+    # Round columns up to whole bytes. The extra cells just hang off the east edge
+    cols = int(np.ceil((max_lon - min_lon) / cell_degrees / 8.0)) * 8
+    print("Building {}x{} water mask ({} cells) from {}".format(rows, cols, rows * cols, source))
+
+    def classify_with_progress(lats, lons):
+        row = int(round((lats[0] - min_lat) / cell_degrees - 0.5))
+        if row % 100 == 0:
+            print("  row {}/{}".format(row, rows))
+        return classify(lats, lons)
+
+    write_water_mask(path, min_lat, min_lon, cell_degrees, rows, cols, classify_with_progress)
+    print("Wrote {}".format(path))
@@ -13,6 +13,9 @@ def run():
     initialLiveConf.modification_time = datetime.now()
     #  10 miles
     initialLiveConf._tow_radius = 1609300  # noqa pylint: disable=protected-access
+    # Send every tow request to everybody in range at once. Set a wave size to dispatch nearest-first
+    initialLiveConf._dispatch_wave_size = 0  # noqa pylint: disable=protected-access
+    initialLiveConf._dispatch_wave_wait_seconds = 120  # noqa pylint: disable=protected-access
     db.session.add(initialLiveConf)
     db.session.commit()
     db.session.close_all()
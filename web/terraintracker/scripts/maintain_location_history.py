@@ -0,0 +1,123 @@
+"""
+Housekeeping for the monthly location_history partitions. Run it daily:
+
+    python manage.py maintain_location_history [--archive]
+
+ - Creates partitions for this month and the next LOCATION_HISTORY_PARTITIONS_AHEAD
+ - Moves rows that landed in the parent (because their partition didn't exist yet) into partitions
+ - Downsamples partitions older than LOCATION_HISTORY_DOWNSAMPLE_AFTER_DAYS to one fix per user
+   per LOCATION_HISTORY_DOWNSAMPLE_SECONDS
+ - Drops partitions older than LOCATION_HISTORY_RETENTION_DAYS. With --archive they're detached
+   and renamed to archived_location_history_yYYYYmMM instead, so they can be dumped and dropped by hand
+"""
+import re
+
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from terraintracker.app_init import db
+from terraintracker.constants import (LOCATION_HISTORY_DOWNSAMPLE_AFTER_DAYS,
+                                      LOCATION_HISTORY_DOWNSAMPLE_SECONDS,
+                                      LOCATION_HISTORY_PARTITIONS_AHEAD,
+                                      LOCATION_HISTORY_RETENTION_DAYS)
+
+PARTITION_NAME = re.compile(r'^location_history_y(\d{4})m(\d{2})$')
+DOWNSAMPLED_COMMENT = 'downsampled'
+
+
+def add_months(day, months):
+    """ First day of the month `months` after the one `day` is in """
+    month_index = day.month - 1 + months
+    return date(day.year + month_index // 12, month_index % 12 + 1, 1)
+
+
+def list_partitions(connection):
+    """ [(first day of month, table name, comment), ...] oldest first """
+    rows = connection.execute(text("""
+        SELECT c.relname, obj_description(c.oid, 'pg_class')
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'location_history'::regclass
+    """))
+    partitions = []
+    for name, comment in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((date(int(match.group(1)), int(match.group(2)), 1), name, comment))
+    return sorted(partitions)
+
+
+def create_partitions(connection, today, months_ahead=LOCATION_HISTORY_PARTITIONS_AHEAD):
+    created = []
+    for months in range(months_ahead + 1):
+        created.append(connection.execute(text("SELECT location_history_create_partition(:month)"),
+                                          month=add_months(today, months)).scalar())
+    return created
+
+
+def move_rows_out_of_parent(connection):
+    """ Rows only end up in the parent when their partition was missing. Make it and re-insert them """
+    connection.execute(text("""
+        SELECT location_history_create_partition(month::date)
+        FROM (SELECT DISTINCT date_trunc('month', "timestamp") AS month
+              FROM ONLY location_history WHERE "timestamp" IS NOT NULL) months
+    """))
+    # The trigger swallows the re-inserted rows, so count what we deleted instead
+    return connection.execute(text("""
+        WITH moved AS (DELETE FROM ONLY location_history WHERE "timestamp" IS NOT NULL RETURNING *),
+             reinserted AS (INSERT INTO location_history SELECT * FROM moved)
+        SELECT count(*) FROM moved
+    """)).scalar()
+
+
+def downsample(connection, partition, bucket_seconds=LOCATION_HISTORY_DOWNSAMPLE_SECONDS):
+    """ Keep the first fix each user sent in every `bucket_seconds` window. Returns how many rows were deleted """
+    result = connection.execute(text("""
+        DELETE FROM {partition} lh
+        USING (
+            SELECT id, row_number() OVER (
+                PARTITION BY user_id, floor(extract(epoch FROM "timestamp") / :bucket_seconds)
+                ORDER BY "timestamp", id) AS nth_in_bucket
+            FROM {partition}
+        ) ranked
+        WHERE lh.id = ranked.id AND ranked.nth_in_bucket > 1
+    """.format(partition=partition)), bucket_seconds=bucket_seconds)
+    connection.execute(text("COMMENT ON TABLE {} IS '{}'".format(partition, DOWNSAMPLED_COMMENT)))
+    return result.rowcount
+
+
+def expire(connection, partition, archive=False):
+    if archive:
+        connection.execute(text("ALTER TABLE {} NO INHERIT location_history".format(partition)))
+        connection.execute(text("ALTER TABLE {0} RENAME TO archived_{0}".format(partition)))
+    else:
+        connection.execute(text("DROP TABLE {}".format(partition)))
+
+
+def run(archive=False, today=None):
+    today = today or date.today()
+    downsample_before = today - timedelta(days=LOCATION_HISTORY_DOWNSAMPLE_AFTER_DAYS)
+    expire_before = today - timedelta(days=LOCATION_HISTORY_RETENTION_DAYS)
+
+    # Every step is its own transaction, so one bad partition doesn't undo the rest
+    with db.engine.begin() as connection:
+        created = create_partitions(connection, today)
+    with db.engine.begin() as connection:
+        moved = move_rows_out_of_parent(connection)
+        partitions = list_partitions(connection)
+    print("Partitions ready through {}. Moved {} rows out of the parent".format(created[-1], moved))
+
+    for month, partition, comment in partitions:
+        month_end = add_months(month, 1)
+        if month_end <= expire_before:
+            with db.engine.begin() as connection:
+                expire(connection, partition, archive)
+            print("{} {}".format('Archived' if archive else 'Dropped', partition))
+        elif month_end <= downsample_before and comment != DOWNSAMPLED_COMMENT:
+            with db.engine.begin() as connection:
+                deleted = downsample(connection, partition)
+            print("Downsampled {}. Deleted {} rows".format(partition, deleted))
+
+
+if __name__ == "__main__":
+    run()
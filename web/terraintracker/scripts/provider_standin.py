@@ -0,0 +1,178 @@
+"""
+Local stand-in for the providers we call (OneSignal, Twilio, Stripe, Facebook, Google static maps), for load testing
+with no network and no bill
+
+    python manage.py provider_standin --port 5050 --latency-ms 150 --jitter-ms 100 --error-rate 0.02 \
+        --rate-limit onesignal=50 --rate-limit twilio=10
+
+and point the app at it with provider_standin_url = http://localhost:5050 in [SystemRuntime] (or
+$PROVIDER_STANDIN_URL).
+
+It answers the same paths as the real thing with just enough of the real responses for our clients to be happy.
+Every call sleeps latency +/- jitter, fails with a 500 error_rate of the time, and gets a 429 past the provider's
+--rate-limit (requests/second). Facebook tokens that are all digits log you in as that user id.
+GET /_stats has call counts per provider. POST /_stats/reset zeroes them.
+"""
+import random
+import threading
+import time
+import uuid
+
+from collections import Counter
+from io import BytesIO
+
+from flask import Flask, Response, jsonify, request
+from PIL import Image
+
+from terraintracker.lib.google_maps.constants import AVERAGE_WATER_COLOR
+from terraintracker.lib.rate_limiter import TokenBucket
+
+LAND_COLOR = (242, 239, 233)
+
+
+class Standin():
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, rate_limits=None, land=False):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.error_rate = error_rate
+        self.buckets = dict((provider, TokenBucket(rate)) for provider, rate in (rate_limits or {}).items())
+        self.color = LAND_COLOR if land else AVERAGE_WATER_COLOR
+
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def misbehave(self, provider):
+        """ Sleep, and maybe fail. Returns an error response, or None to carry on """
+        self.count(provider + '.calls')
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        bucket = self.buckets.get(provider)
+        if bucket is not None and not bucket.try_acquire():
+            self.count(provider + '.429')
+            return error_response(provider, 429, "Too many requests")
+        if random.random() < self.error_rate:
+            self.count(provider + '.500')
+            return error_response(provider, 500, "Stand-in failure")
+        self.count(provider + '.ok')
+        return None
+
+
+def error_response(provider, status, message):
+    # Roughly each provider's error shape, so their clients raise the right thing
+    if provider == 'twilio':
+        body = {'status': status, 'message': message, 'code': 20429 if status == 429 else 20500}
+    elif provider in ('stripe', 'facebook'):
+        body = {'error': {'type': 'api_error', 'message': message}}
+    else:
+        body = {'errors': [message]}
+    response = jsonify(body)
+    response.status_code = status
+    return response
+
+
+def create_app(standin):
+    app = Flask(__name__)
+
+    @app.route('/api/v1/notifications', methods=['POST'])
+    def onesignal_notification():
+        error = standin.misbehave('onesignal')
+        if error:
+            return error
+        payload = request.get_json(force=True, silent=True) or {}
+        return jsonify({'id': str(uuid.uuid4()), 'recipients': len(payload.get('include_player_ids', []))})
+
+    @app.route('/<version>/Accounts/<account_sid>/Messages.json', methods=['POST'])
+    def twilio_message(version, account_sid):
+        error = standin.misbehave('twilio')
+        if error:
+            return error
+        sid = 'SM' + uuid.uuid4().hex
+        response = jsonify({'sid': sid, 'account_sid': account_sid, 'to': request.form.get('To'),
+                            'from': request.form.get('From'), 'body': request.form.get('Body'), 'status': 'queued',
+                            'num_segments': '1', 'direction': 'outbound-api', 'api_version': version,
+                            'uri': '/{}/Accounts/{}/Messages/{}.json'.format(version, account_sid, sid)})
+        response.status_code = 201
+        return response
+
+    @app.route('/v1/customers', methods=['POST'])
+    def stripe_customer():
+        error = standin.misbehave('stripe')
+        if error:
+            return error
+        return jsonify({'id': 'cus_' + uuid.uuid4().hex[:14], 'object': 'customer',
+                        'description': request.form.get('description'), 'livemode': False})
+
+    @app.route('/v1/charges', methods=['POST'])
+    def stripe_charge():
+        error = standin.misbehave('stripe')
+        if error:
+            return error
+        return jsonify({'id': 'ch_' + uuid.uuid4().hex[:24], 'object': 'charge',
+                        'amount': int(request.form.get('amount', 0)), 'currency': request.form.get('currency'),
+                        'customer': request.form.get('customer'), 'paid': True, 'status': 'succeeded',
+                        'livemode': False})
+
+    @app.route('/v1/ephemeral_keys', methods=['POST'])
+    def stripe_ephemeral_key():
+        error = standin.misbehave('stripe')
+        if error:
+            return error
+        return jsonify({'id': 'ephkey_' + uuid.uuid4().hex[:24], 'object': 'ephemeral_key',
+                        'secret': 'ek_test_' + uuid.uuid4().hex, 'livemode': False,
+                        'associated_objects': [{'id': request.form.get('customer'), 'type': 'customer'}]})
+
+    @app.route('/me', methods=['GET'])
+    def facebook_me():
+        error = standin.misbehave('facebook')
+        if error:
+            return error
+        token = request.args.get('access_token', '')
+        if not token.isdigit():
+            response = jsonify({'error': {'message': 'Invalid OAuth access token.', 'type': 'OAuthException',
+                                          'code': 190}})
+            response.status_code = 400
+            return response
+        return jsonify({'id': token, 'name': 'Standin User {}'.format(token)})
+
+    @app.route('/maps/api/staticmap', methods=['GET'])
+    def google_static_map():
+        error = standin.misbehave('google_maps')
+        if error:
+            return error
+        width, height = [int(x) for x in request.args.get('size', '1x1').split('x')]
+        image = BytesIO()
+        Image.new('RGB', (width, height), standin.color).save(image, format='PNG')
+        return Response(image.getvalue(), mimetype='image/png')
+
+    @app.route('/_stats', methods=['GET'])
+    def stats():
+        return jsonify(dict(standin.stats))
+
+    @app.route('/_stats/reset', methods=['POST'])
+    def reset_stats():
+        standin.stats.clear()
+        return jsonify({})
+
+    return app
+
+
+def parse_rate_limits(rate_limits):
+    """ ['onesignal=50', 'twilio=10'] -> {'onesignal': 50.0, 'twilio': 10.0} """
+    parsed = {}
+    for rate_limit in rate_limits or []:
+        provider, rate = rate_limit.split('=')
+        parsed[provider.strip()] = float(rate)
+    return parsed
+
+
+def run(host='127.0.0.1', port=5050, latency_ms=0, jitter_ms=0, error_rate=0.0, rate_limits=None, land=False):
+    standin = Standin(latency_ms=float(latency_ms), jitter_ms=float(jitter_ms), error_rate=float(error_rate),
+                      rate_limits=parse_rate_limits(rate_limits), land=land)
+    print("Provider stand-in on http://{}:{} ({}ms +/- {}ms, {:.0%} errors, rate limits {})".format(
+        host, port, latency_ms, jitter_ms, float(error_rate), parse_rate_limits(rate_limits) or 'none'))
+    create_app(standin).run(host=host, port=int(port), threaded=True, use_reloader=False)
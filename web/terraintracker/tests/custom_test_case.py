@@ -27,6 +27,8 @@ mock_live_config = mock.MagicMock(
     modification_time=datetime.utcnow(),
     modification_user='TEST_DEVELOPER',
     tow_radius=16093,  # 16093m == 10 miles
+    dispatch_wave_size=0,  # Everybody in range at once
+    dispatch_wave_wait_seconds=120,
 )
 
 
@@ -42,6 +44,12 @@ class CustomTestCase(TestCase):
         # These two lines patch live_config in models.user
         self.patch_live_config = mock.patch('terraintracker.models.user.live_config', mock_live_config)
         self.mock_live_config = self.patch_live_config.start()
+        self.patch_availability_live_config = mock.patch('terraintracker.models.tower_availability.live_config',
+                                                         mock_live_config)
+        self.patch_availability_live_config.start()
+        self.patch_tow_request_live_config = mock.patch('terraintracker.models.tow_request.live_config',
+                                                        mock_live_config)
+        self.patch_tow_request_live_config.start()
 
         # These two lines patch stripe
         self.patch_stripe = mock.patch('terraintracker.lib.stripe_integration.initialize_stripe_customer',
@@ -54,6 +62,10 @@ class CustomTestCase(TestCase):
                                                mock.MagicMock())
         self.mock_sendTowRequest = self.patch_sendTowRequest.start()
         self.mock_sendTowRequest.return_value = ("TEST_USER")
+        self.patch_sendTowRequests = mock.patch(
+            'terraintracker.lib.ios_push_notifications.one_signal_notification_sender.sendTowRequests',
+            mock.MagicMock())
+        self.mock_sendTowRequests = self.patch_sendTowRequests.start()
 
         # iOS notification patching
         self.patch_acceptTowRequest = mock.patch('terraintracker.lib.ios_push_notifications.one_signal_notification_sender.sentTowRequestAccepted',
@@ -67,13 +79,32 @@ class CustomTestCase(TestCase):
         self.mock_snc = self.patch_snc.start()
         self.mock_snc.return_value = ("TEST_USER")
 
+        # Queue notifications in the outbox like normal, but don't start the threads that send them
+        self.patch_outbox_start = mock.patch('terraintracker.models.notification_outbox.notification_outbox.start',
+                                             mock.MagicMock())
+        self.patch_outbox_start.start()
+
+        # Tests call timeout_sweeper.sweep() themselves
+        self.patch_sweeper_start = mock.patch('terraintracker.models.timeout_sweeper.timeout_sweeper.start',
+                                              mock.MagicMock())
+        self.patch_sweeper_start.start()
+        self.patch_sweeper_live_config = mock.patch('terraintracker.models.timeout_sweeper.live_config',
+                                                    mock_live_config)
+        self.patch_sweeper_live_config.start()
+
     def _patch_off(self):
         self.patch_twilio.stop()
         self.patch_live_config.stop()
+        self.patch_availability_live_config.stop()
+        self.patch_tow_request_live_config.stop()
         self.patch_stripe.stop()
         self.patch_sendTowRequest.stop()
+        self.patch_sendTowRequests.stop()
         self.patch_acceptTowRequest.stop()
         self.patch_snc.stop()
+        self.patch_outbox_start.stop()
+        self.patch_sweeper_start.stop()
+        self.patch_sweeper_live_config.stop()
 
     def run(self, *args, **kwargs):
         self.addCleanup(self.remove_test_data)
@@ -0,0 +1,42 @@
+"""
+lib.geodesy is pure NumPy, so these are plain unittest tests
+"""
+import unittest
+
+import numpy as np
+
+from terraintracker.lib import geodesy
+from terraintracker.lib.calculate_latlon_bearing import get_bearing_between_coords
+
+NYC = (40.7128, -74.0060)
+MIAMI = (25.7617, -80.1918)
+
+
+class GeodesyTest(unittest.TestCase):
+
+    def test_scalar_distance_and_bearing(self):
+        self.assertAlmostEqual(float(geodesy.distance_meters(NYC[0], NYC[1], MIAMI[0], MIAMI[1])) / 1000,
+                               1757.5, delta=1.0)
+        self.assertAlmostEqual(float(geodesy.bearing_degrees(NYC[0], NYC[1], MIAMI[0], MIAMI[1])),
+                               get_bearing_between_coords(NYC, MIAMI))
+        self.assertEqual(float(geodesy.distance_meters(NYC[0], NYC[1], NYC[0], NYC[1])), 0.0)
+
+    def test_arrays_broadcast_against_a_single_point(self):
+        lats = np.array([NYC[0], MIAMI[0], 31.25])
+        lons = np.array([NYC[1], MIAMI[1], -81.2])
+        distances = geodesy.distance_meters(NYC[0], NYC[1], lats, lons)
+        bearings = geodesy.bearing_degrees(NYC[0], NYC[1], lats, lons)
+        self.assertEqual(distances.shape, (3,))
+        for i in range(3):
+            self.assertAlmostEqual(distances[i], float(geodesy.distance_meters(NYC[0], NYC[1], lats[i], lons[i])))
+        self.assertTrue(((bearings >= 0) & (bearings < 360)).all())
+
+    def test_destination_point_round_trips(self):
+        bearings = np.array([0.0, 45.0, 90.0, 200.0])
+        lats, lons = geodesy.destination_point(NYC[0], NYC[1], bearings, 5000)
+        np.testing.assert_allclose(geodesy.distance_meters(NYC[0], NYC[1], lats, lons), 5000, rtol=1e-9)
+        np.testing.assert_allclose(geodesy.bearing_degrees(NYC[0], NYC[1], lats, lons), bearings, atol=0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
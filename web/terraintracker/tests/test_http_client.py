@@ -0,0 +1,65 @@
+"""
+Circuit breaker and HttpClient bookkeeping. The session is mocked, so these are plain unittest tests
+"""
+import unittest
+
+from unittest import mock
+
+import requests
+
+from terraintracker.lib.http_client import CircuitBreaker, CircuitOpenError, HttpClient
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_failures_in_a_row_and_lets_one_trial_through(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker('test', failure_threshold=3, reset_seconds=30, clock=clock)
+
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()  # Not in a row anymore
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        clock.now += 30
+        self.assertTrue(breaker.allow())  # The trial call
+        self.assertFalse(breaker.allow())  # Everybody else waits for it
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.is_open)
+
+
+class HttpClientTest(unittest.TestCase):
+
+    def test_timeouts_and_5xxs_trip_the_breaker(self):
+        client = HttpClient('test')
+        client.breaker.failure_threshold = 2
+        client.session = mock.MagicMock()
+
+        client.session.request.return_value = mock.MagicMock(status_code=503)
+        client.get('https://example.com')
+        client.session.request.side_effect = requests.exceptions.ReadTimeout()
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            client.get('https://example.com')
+
+        with self.assertRaises(CircuitOpenError):
+            client.get('https://example.com')
+        self.assertEqual(client.session.request.call_count, 2)
+        # Always has a timeout
+        self.assertEqual(client.session.request.call_args[1]['timeout'], client.timeout)
+
+
+if __name__ == '__main__':
+    unittest.main()
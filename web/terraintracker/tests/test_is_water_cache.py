@@ -0,0 +1,116 @@
+"""
+"""
+import unittest
+
+from datetime import datetime, timedelta
+from io import BytesIO
+from unittest import mock
+
+import numpy as np
+
+from PIL import Image
+
+from terraintracker.app_init import db
+from terraintracker.lib.google_maps import helpers
+from terraintracker.lib.http_client import CircuitOpenError
+from terraintracker.models.is_water_cache import IsWaterCache, IsWaterCacheEntry, IsWaterLookupError
+from terraintracker.tests.custom_test_case import CustomTestCase
+
+# Odd cell size so these keys never collide with real cached cells
+TEST_CELL_DEGREES = 0.00123
+WATER_COLOR = (163, 204, 255)
+
+
+class IsWaterCacheTest(CustomTestCase):
+    def setUp(self):
+        self.lookup = mock.MagicMock(return_value=(WATER_COLOR, True))
+        self.tile_lookup = mock.MagicMock(
+            side_effect=lambda center_lat, center_lon, lats, lons: (np.tile(WATER_COLOR, (len(lats), 1)),
+                                                                    np.ones(len(lats), dtype=bool)))
+        self.cache = IsWaterCache(cell_degrees=TEST_CELL_DEGREES, ttl=timedelta(days=1), max_cells=2,
+                                  lookup=self.lookup, tile_lookup=self.tile_lookup)
+
+    def tearDown(self):
+        IsWaterCacheEntry.query.filter(IsWaterCacheEntry.cell_key.like('{}:%'.format(TEST_CELL_DEGREES))).delete(
+            synchronize_session=False)
+        db.session.commit()
+
+    def test_same_cell_only_asks_google_once(self):
+        self.assertEqual(self.cache.get(31.2525, -81.3335), (str(WATER_COLOR), True))
+        self.assertEqual(self.cache.get(31.2526, -81.3336), (str(WATER_COLOR), True))
+        self.assertEqual(self.lookup.call_count, 1)
+        self.assertEqual(self.cache.num_memory_hits, 1)
+
+        # Lookup is for the cell's center, not whoever asked first
+        center = self.cache.cell_center(self.cache.cell_key(31.2525, -81.3335))
+        self.lookup.assert_called_once_with(*center)
+
+    def test_falls_back_to_db(self):
+        self.cache.get(31.2525, -81.3335)
+        self.cache.clear_memory()
+        self.assertEqual(self.cache.get(31.2525, -81.3335), (str(WATER_COLOR), True))
+        self.assertEqual(self.lookup.call_count, 1)
+        self.assertEqual(self.cache.num_db_hits, 1)
+
+    def test_expired_entries_are_looked_up_again(self):
+        key = self.cache.cell_key(31.2525, -81.3335)
+        self.cache.put(key, str((0, 0, 0)), False, checked_time=datetime.now() - timedelta(days=2))
+        self.assertEqual(self.cache.get(31.2525, -81.3335), (str(WATER_COLOR), True))
+        self.assertEqual(self.lookup.call_count, 1)
+
+    def test_memory_is_bounded(self):
+        for i in range(5):
+            self.cache.get(31.0 + i, -81.0)
+        self.assertEqual(len(self.cache._memory), 2)
+
+    def test_get_many_fetches_one_tile_for_nearby_points(self):
+        self.cache.max_cells = 10000
+        points = [(31.25 + 0.0002 * i, -81.33 + 0.0003 * i) for i in range(20)]
+        answers = self.cache.get_many(points)
+        self.assertEqual(answers, [(str(WATER_COLOR), True)] * len(points))
+        self.assertEqual(self.tile_lookup.call_count, 1)
+        self.lookup.assert_not_called()
+
+        # The whole tile got cached, not just what we asked for
+        self.assertEqual(self.cache.get(31.252, -81.327), (str(WATER_COLOR), True))
+        self.lookup.assert_not_called()
+
+        # Far away points need their own tile
+        self.cache.get_many([(31.25, -81.33), (32.5, -80.0)])
+        self.assertEqual(self.tile_lookup.call_count, 2)
+
+    def test_provider_errors_arent_cached(self):
+        self.cache.max_cells = 10000
+        self.lookup.side_effect = CircuitOpenError("google_maps is failing")
+        with self.assertRaises(IsWaterLookupError):
+            self.cache.get(31.2525, -81.3335)
+
+        self.tile_lookup.side_effect = CircuitOpenError("google_maps is failing")
+        with self.assertRaises(IsWaterLookupError):
+            self.cache.get_many([(31.25, -81.33)])
+        self.assertEqual(len(self.cache._memory), 0)
+        self.assertEqual(IsWaterCacheEntry.query.filter(
+            IsWaterCacheEntry.cell_key.like('{}:%'.format(TEST_CELL_DEGREES))).count(), 0)
+
+        # Google's back. Asked again, since nothing was cached
+        self.lookup.side_effect = None
+        self.assertEqual(self.cache.get(31.2525, -81.3335), (str(WATER_COLOR), True))
+        self.assertEqual(self.lookup.call_count, 2)
+
+
+class GoogleMapsZoomTest(unittest.TestCase):
+    """ get() and get_many() write the same cells, so they have to read the same map """
+
+    def png(self, size):
+        image = BytesIO()
+        Image.new('RGB', (size, size), WATER_COLOR).save(image, format='PNG')
+        return image.getvalue()
+
+    def test_single_point_and_tile_use_the_same_map(self):
+        with mock.patch.object(helpers, '_fetch', side_effect=lambda url: self.png(1)) as fetch:
+            helpers.get_coordinates_color(31.25, -81.33)
+            helpers.get_tile_pixels(31.25, -81.33, helpers.TILE_ZOOM, 640)
+        point_url, tile_url = [c[0][0] for c in fetch.call_args_list]
+        point_params = set(point_url.split('?', 1)[1].split('&')) - {'size=1x1'}
+        tile_params = set(tile_url.split('?', 1)[1].split('&')) - {'size=640x640'}
+        self.assertEqual(point_params, tile_params)
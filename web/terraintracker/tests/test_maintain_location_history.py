@@ -0,0 +1,130 @@
+import logging
+
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from terraintracker.app_init import db
+from terraintracker.constants import LOCATION_HISTORY_PARTITIONS_AHEAD
+from terraintracker.models.location_history import LocationHistory
+from terraintracker.scripts import maintain_location_history
+from terraintracker.scripts.maintain_location_history import DOWNSAMPLED_COMMENT, add_months
+from terraintracker.tests.custom_test_case import CustomTestCase
+
+logger = logging.getLogger(__name__)
+
+USER_ID = 'test_history_maintenance'
+
+
+def partition_name(month):
+    return 'location_history_y{:04d}m{:02d}'.format(month.year, month.month)
+
+
+class MaintainLocationHistoryTest(CustomTestCase):
+
+    def setUp(self):
+        self.today = date.today()
+        self.created = []  # Partitions this test made, dropped in tearDown
+
+    def tearDown(self):
+        with db.engine.begin() as connection:
+            for table in self.created:
+                connection.execute(text("DROP TABLE IF EXISTS {}".format(table)))
+                connection.execute(text("DROP TABLE IF EXISTS archived_{}".format(table)))
+            connection.execute(LocationHistory.__table__.delete().where(LocationHistory.user_id == USER_ID))
+
+    def create_partition(self, month):
+        with db.engine.begin() as connection:
+            connection.execute(text("SELECT location_history_create_partition(:month)"), month=month)
+        self.created.append(partition_name(month))
+
+    def insert_fixes(self, timestamps):
+        with db.engine.begin() as connection:
+            connection.execute(LocationHistory.__table__.insert(),
+                               [{'user_id': USER_ID, 'timestamp': t, 'lat': 31.25, 'lon': -81.2} for t in timestamps])
+
+    def table_exists(self, table):
+        with db.engine.connect() as connection:
+            return connection.execute(text("SELECT count(*) FROM pg_class WHERE relname = :table AND relkind = 'r'"),
+                                      table=table).scalar() == 1
+
+    def count_rows(self, table, only=False):
+        with db.engine.connect() as connection:
+            return connection.execute(text("SELECT count(*) FROM {}{} WHERE user_id = :user_id".format(
+                'ONLY ' if only else '', table)), user_id=USER_ID).scalar()
+
+    def partition_names(self):
+        with db.engine.connect() as connection:
+            return [name for _, name, _ in maintain_location_history.list_partitions(connection)]
+
+    def test_add_months(self):
+        self.assertEqual(add_months(date(2026, 10, 18), 0), date(2026, 10, 1))
+        self.assertEqual(add_months(date(2026, 11, 30), 2), date(2027, 1, 1))
+        self.assertEqual(add_months(date(2026, 1, 15), -1), date(2025, 12, 1))
+        self.assertEqual(add_months(date(2026, 3, 1), -14), date(2025, 1, 1))
+
+    def test_creates_partitions_ahead(self):
+        months = [add_months(self.today, m) for m in range(LOCATION_HISTORY_PARTITIONS_AHEAD + 1)]
+        maintain_location_history.run(today=self.today)
+
+        partitions = self.partition_names()
+        for month in months:
+            self.assertIn(partition_name(month), partitions)
+
+        # And the trigger routes this month's rows into this month's partition
+        self.insert_fixes([datetime.now()])
+        self.assertEqual(self.count_rows(partition_name(self.today)), 1)
+        self.assertEqual(self.count_rows('location_history', only=True), 0)
+
+    def test_rows_without_a_partition_are_moved_out_of_the_parent(self):
+        month = add_months(self.today, LOCATION_HISTORY_PARTITIONS_AHEAD + 2)
+        self.created.append(partition_name(month))
+        self.assertFalse(self.table_exists(partition_name(month)))
+
+        # Nowhere to route it yet, so it stays in the parent
+        self.insert_fixes([datetime(month.year, month.month, 15, 12, 0, 0)])
+        self.assertEqual(self.count_rows('location_history', only=True), 1)
+
+        maintain_location_history.run(today=self.today)
+        self.assertTrue(self.table_exists(partition_name(month)))
+        self.assertEqual(self.count_rows(partition_name(month)), 1)
+        self.assertEqual(self.count_rows('location_history', only=True), 0)
+
+    def test_old_partitions_are_dropped_and_recent_ones_downsampled(self):
+        expired = add_months(self.today, -14)
+        recent = add_months(self.today, -3)
+        self.create_partition(expired)
+        self.create_partition(recent)
+
+        self.insert_fixes([datetime(expired.year, expired.month, 10)])
+        noon = datetime(recent.year, recent.month, 10, 12, 0, 0)
+        # Five fixes in the first minute, one in the next
+        self.insert_fixes([noon + timedelta(seconds=s) for s in (0, 10, 20, 30, 40, 60)])
+
+        maintain_location_history.run(today=self.today)
+
+        self.assertFalse(self.table_exists(partition_name(expired)))
+        self.assertNotIn(partition_name(expired), self.partition_names())
+
+        self.assertEqual(self.count_rows(partition_name(recent)), 2)
+        with db.engine.connect() as connection:
+            comment = connection.execute(text("SELECT obj_description(CAST(:table AS regclass), 'pg_class')"),
+                                         table=partition_name(recent)).scalar()
+        self.assertEqual(comment, DOWNSAMPLED_COMMENT)
+
+        # Already downsampled, so a second run leaves it alone
+        self.insert_fixes([noon + timedelta(seconds=5)])
+        maintain_location_history.run(today=self.today)
+        self.assertEqual(self.count_rows(partition_name(recent)), 3)
+
+    def test_archive_keeps_expired_rows(self):
+        expired = add_months(self.today, -14)
+        self.create_partition(expired)
+        self.insert_fixes([datetime(expired.year, expired.month, 10)])
+
+        maintain_location_history.run(archive=True, today=self.today)
+
+        self.assertNotIn(partition_name(expired), self.partition_names())
+        self.assertTrue(self.table_exists('archived_' + partition_name(expired)))
+        self.assertEqual(self.count_rows('archived_' + partition_name(expired)), 1)
+        self.assertEqual(self.count_rows('location_history'), 0)
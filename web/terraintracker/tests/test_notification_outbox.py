@@ -0,0 +1,78 @@
+"""
+"""
+from unittest import mock
+
+from terraintracker.app_init import db
+from terraintracker.constants import NOTIFICATION_MAX_ATTEMPTS, NOTIFICATION_RETRY_MAX_SECONDS
+from terraintracker.models.notification_outbox import (NotificationDeliveryError, NotificationOutbox,
+                                                       OutboxNotification, retry_delay_seconds)
+from terraintracker.tests.custom_test_case import CustomTestCase
+
+# Its own provider name, so these rows never get picked up by (or pick up) real ones
+TEST_PROVIDER = 'test'
+
+
+class NotificationOutboxTest(CustomTestCase):
+    def setUp(self):
+        self.deliver = mock.MagicMock()
+        self.outbox = NotificationOutbox(delivery='worker')
+        self.outbox.register_provider(TEST_PROVIDER, self.deliver, 1)
+
+    def tearDown(self):
+        OutboxNotification.query.filter_by(provider=TEST_PROVIDER).delete(synchronize_session=False)
+        db.session.commit()
+
+    def get(self, notification):
+        return db.session.query(OutboxNotification).populate_existing().get(notification.id)
+
+    def test_nothing_goes_out_until_commit(self):
+        self.outbox.add(TEST_PROVIDER, {'to': 'a'})
+        self.assertEqual(self.outbox.deliver_due(TEST_PROVIDER), 0)
+        db.session.rollback()
+
+        notification = self.outbox.add(TEST_PROVIDER, {'to': 'b'})
+        db.session.commit()
+        self.assertEqual(self.outbox.deliver_due(TEST_PROVIDER), 1)
+        self.deliver.assert_called_once_with({'to': 'b'})
+        self.assertEqual(self.get(notification).status, OutboxNotification.Status.sent.value)
+
+        # Already sent
+        self.assertEqual(self.outbox.deliver_due(TEST_PROVIDER), 0)
+
+    def test_failures_back_off_then_give_up(self):
+        notification = self.outbox.add(TEST_PROVIDER, {'bodies': ['one', 'two']})
+        db.session.commit()
+
+        # Sent 'one' and then failed. Only 'two' is retried, and not until later
+        self.deliver.side_effect = NotificationDeliveryError("busy", payload={'bodies': ['two']})
+        self.outbox.deliver_due(TEST_PROVIDER)
+        notification = self.get(notification)
+        self.assertEqual(notification.status, OutboxNotification.Status.pending.value)
+        self.assertEqual(notification.attempts, 1)
+        self.assertGreater(notification.next_attempt_time, notification.claimed_time)
+        self.assertIn('two', notification.payload)
+        self.assertNotIn('one', notification.payload)
+        self.assertEqual(self.outbox.deliver_due(TEST_PROVIDER), 0)
+
+        notification.next_attempt_time = notification.created_time
+        db.session.commit()
+        self.deliver.side_effect = NotificationDeliveryError("bad number", permanent=True)
+        self.outbox.deliver_due(TEST_PROVIDER)
+        self.assertEqual(self.get(notification).status, OutboxNotification.Status.failed.value)
+        self.assertEqual(self.outbox.num_failed, 1)
+
+    def test_two_workers_dont_claim_the_same_row(self):
+        for i in range(3):
+            self.outbox.add(TEST_PROVIDER, {'to': i})
+        db.session.commit()
+
+        first = self.outbox.claim(TEST_PROVIDER, limit=2)
+        second = self.outbox.claim(TEST_PROVIDER, limit=2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse(set(r[0] for r in first) & set(r[0] for r in second))
+
+    def test_retry_delay(self):
+        self.assertLessEqual(retry_delay_seconds(1), 2)
+        self.assertGreater(retry_delay_seconds(3), retry_delay_seconds(1))
+        self.assertLessEqual(retry_delay_seconds(NOTIFICATION_MAX_ATTEMPTS * 10), NOTIFICATION_RETRY_MAX_SECONDS)
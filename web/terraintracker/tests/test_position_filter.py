@@ -0,0 +1,57 @@
+"""
+PositionFilter is pure logic, so these are plain unittest tests
+"""
+import unittest
+
+from datetime import datetime, timedelta
+
+from terraintracker.lib.geodesy import destination_point
+from terraintracker.lib.position_filter import PositionFilter
+
+DOCK = (38.9, -76.4)
+START = datetime(2018, 6, 1, 12, 0, 0)
+
+
+def fix_from_dock(meters, seconds):
+    lat, lon = destination_point(DOCK[0], DOCK[1], 90.0, meters)
+    return (float(lat), float(lon), START + timedelta(seconds=seconds))
+
+
+class PositionFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.filter = PositionFilter(underway_min_meters=10, underway_max_seconds=15,
+                                     idle_min_meters=75, idle_max_seconds=300, moving_speed=1.0)
+        self.last_fix = (str(DOCK[0]), str(DOCK[1]), START)
+
+    def test_first_fix_is_stored(self):
+        self.assertTrue(self.filter.should_store(None, fix_from_dock(0, 0)))
+        self.assertTrue(self.filter.should_store((None, None, None), fix_from_dock(0, 0)))
+
+    def test_idle_at_dock(self):
+        # Drifting around the slip
+        self.assertFalse(self.filter.should_store(self.last_fix, fix_from_dock(20, 60)))
+        self.assertFalse(self.filter.should_store(self.last_fix, fix_from_dock(50, 120)))
+        # Heartbeat
+        self.assertTrue(self.filter.should_store(self.last_fix, fix_from_dock(20, 301)))
+        self.assertEqual(self.filter.num_suppressed, 2)
+        self.assertEqual(self.filter.num_seen, 3)
+
+    def test_moving_uses_tight_band(self):
+        # 30m in 10s is 3 m/s. Moving, so 30m is plenty
+        self.assertTrue(self.filter.should_store(self.last_fix, fix_from_dock(30, 10)))
+        # Same fix while idle would've been dropped
+        self.assertFalse(self.filter.should_store(self.last_fix, fix_from_dock(30, 100)))
+
+    def test_underway_in_tow_event(self):
+        self.assertFalse(self.filter.should_store(self.last_fix, fix_from_dock(5, 100)))
+        self.assertTrue(self.filter.should_store(self.last_fix, fix_from_dock(5, 16), underway=True))
+        self.assertTrue(self.filter.should_store(self.last_fix, fix_from_dock(12, 100), underway=True))
+        self.assertFalse(self.filter.should_store(self.last_fix, fix_from_dock(5, 10), underway=True))
+
+    def test_clock_going_backwards_stores(self):
+        self.assertTrue(self.filter.should_store(self.last_fix, fix_from_dock(0, -5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Tow request fan-out, and how deliver() reads OneSignal's answers.
+The outbox and HTTP client are mocked, so these are plain unittest tests
+"""
+import unittest
+
+from types import SimpleNamespace
+from unittest import mock
+
+from terraintracker.lib.ios_push_notifications import OneSignalNotificationSender
+from terraintracker.models.notification_outbox import NotificationDeliveryError
+
+
+def make_user(player_id, lat, lon, first_name='Test'):
+    return SimpleNamespace(one_signal_player_id=player_id, last_lat_seen=str(lat), last_long_seen=str(lon),
+                           first_name=first_name)
+
+
+class SendTowRequestsTest(unittest.TestCase):
+
+    @mock.patch('terraintracker.lib.ios_push_notifications.notification_outbox.add')
+    def test_one_notification_per_requestee(self, mock_add):
+        requestor = make_user('requestor', 31.25, -81.33, 'Stranded')
+        nearby = [make_user('near_{}'.format(i), 31.30, -81.33) for i in range(3)]
+        no_player_id = make_user(None, 31.30, -81.33)
+        requests = [(u, 'tr_{}'.format(u.one_signal_player_id)) for u in nearby + [no_player_id]]
+
+        OneSignalNotificationSender().sendTowRequests(requestor, requests)
+        self.assertEqual(mock_add.call_count, 3)
+        self.assertEqual(set(c[0][0] for c in mock_add.call_args_list), {'onesignal'})
+
+        # Same text, but every requestee still gets its own push with its own tow_request_id
+        for call, requestee in zip(mock_add.call_args_list, nearby):
+            payload = call[0][1]
+            self.assertEqual(payload['include_player_ids'], [requestee.one_signal_player_id])
+            self.assertEqual(payload['data'], {'tow_request_id': 'tr_{}'.format(requestee.one_signal_player_id),
+                                               'message_type': 'incoming_tow_request'})
+            self.assertIn('Stranded (3.45mi away)', payload['contents']['en'])
+
+    @mock.patch('terraintracker.lib.ios_push_notifications.notification_outbox.add')
+    def test_requestor_without_player_id_sends_nothing(self, mock_add):
+        requestor = make_user(None, 31.25, -81.33)
+        OneSignalNotificationSender().sendTowRequests(requestor, [(make_user('a', 31.3, -81.33), 'tr_a')])
+        mock_add.assert_not_called()
+
+
+class DeliverTest(unittest.TestCase):
+
+    @mock.patch('terraintracker.lib.ios_push_notifications.one_signal_http.post')
+    def test_errors_are_retried_unless_theyre_our_fault(self, mock_post):
+        sender = OneSignalNotificationSender()
+
+        mock_post.return_value = mock.MagicMock(status_code=200)
+        sender.deliver({'include_player_ids': ['a']})
+
+        for status_code, permanent in ((500, False), (429, False), (400, True)):
+            mock_post.return_value = mock.MagicMock(status_code=status_code)
+            with self.assertRaises(NotificationDeliveryError) as raised:
+                sender.deliver({'include_player_ids': ['a']})
+            self.assertEqual(raised.exception.permanent, permanent)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+Token bucket, on a fake clock
+"""
+import threading
+import unittest
+
+from terraintracker.lib.rate_limiter import TokenBucket
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.now += seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_bursts_up_to_capacity_then_waits(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, clock=clock, sleep=clock.sleep)
+
+        for _ in range(10):
+            self.assertEqual(bucket.acquire(), 0)
+        self.assertFalse(bucket.try_acquire())
+        self.assertAlmostEqual(bucket.acquire(), 0.1)
+
+        # Idle time refills, but never past capacity
+        clock.now += 60
+        self.assertTrue(bucket.try_acquire(10))
+        self.assertFalse(bucket.try_acquire())
+
+    def test_threads_share_the_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=5, capacity=1, clock=clock, sleep=clock.sleep)
+        threads = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(5)]) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # 20 tokens at 5/s, one of them saved up: ~3.8s, however the threads interleaved
+        self.assertGreaterEqual(clock.now, 19 / 5.0 - 1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()
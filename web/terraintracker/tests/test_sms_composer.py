@@ -0,0 +1,54 @@
+"""
+SMS segment counting and packing
+"""
+import unittest
+
+from terraintracker.lib import sms_composer
+
+
+class SegmentsTest(unittest.TestCase):
+
+    def test_gsm7_and_ucs2_limits(self):
+        self.assertEqual(sms_composer.segments('a' * 160), 1)
+        self.assertEqual(sms_composer.segments('a' * 161), 2)
+        self.assertEqual(sms_composer.segments('a' * 306), 2)
+        self.assertEqual(sms_composer.segments('a' * 307), 3)
+        # Extension characters take two
+        self.assertEqual(sms_composer.segments('{' * 80), 1)
+        self.assertEqual(sms_composer.segments('{' * 81), 2)
+
+        self.assertEqual(sms_composer.encoding('Captain’s on the way'), 'UCS-2')  # Curly quote
+        self.assertEqual(sms_composer.segments('’' * 70), 1)
+        self.assertEqual(sms_composer.segments('’' * 71), 2)
+        self.assertEqual(sms_composer.segments('\U0001F6A4' * 35), 1)  # Emoji take two UTF-16 units
+        self.assertEqual(sms_composer.segments('\U0001F6A4' * 36), 2)
+
+
+class ComposeTest(unittest.TestCase):
+
+    def test_short_texts_share_a_message(self):
+        texts = ["DRIFT Tow Request: Stranded needs a tow (ungrounded). Reply yes to help them.",
+                 "Boat information: 22ft center console",
+                 "https://www.google.com/maps/place/31.25,-81.33"]
+        composed = sms_composer.compose(texts)
+        self.assertEqual(len(composed), 1)
+        self.assertEqual(composed[0].body, '\n'.join(texts))
+        self.assertEqual(composed[0].segments, 2)
+        self.assertEqual(composed[0].encoding, 'GSM-7')
+
+    def test_doesnt_join_when_it_costs_segments(self):
+        # One emoji would turn the whole joined message into UCS-2
+        gsm = 'a' * 150
+        composed = sms_composer.compose([gsm, 'On my way \U0001F6A4'])
+        self.assertEqual([c.segments for c in composed], [1, 1])
+
+        # Never past max_segments
+        composed = sms_composer.compose(['a' * 100] * 4, max_segments=2)
+        self.assertEqual(len(composed), 2)
+        self.assertTrue(all(c.segments <= 2 for c in composed))
+
+        self.assertEqual(sms_composer.compose([]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
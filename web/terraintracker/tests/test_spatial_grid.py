@@ -0,0 +1,55 @@
+"""
+SpatialGridIndex doesn't touch the DB, so these are plain unittest tests
+"""
+import unittest
+
+from terraintracker.lib.geodesy import distance_meters
+from terraintracker.lib.spatial_grid import SpatialGridIndex
+from terraintracker.tests.data.user_test_data import ELIGIBLE_USERS, EXPECTED_REQUESTEE_IDS_BY_REQUESTOR
+
+TOW_RADIUS_METERS = 16093
+
+
+class SpatialGridIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.positions = dict((u['id'], (float(u['last_lat_seen']), float(u['last_long_seen'])))
+                              for u in ELIGIBLE_USERS)
+        self.index = SpatialGridIndex(0.1, 60, loader=lambda: [(k, v[0], v[1]) for k, v in self.positions.items()])
+        self.index.reconcile()
+
+    def test_query_radius_matches_expected_requestees(self):
+        for _id, (lat, lon) in self.positions.items():
+            found = self.index.query_radius(lat, lon, TOW_RADIUS_METERS, exclude_ids=[_id])
+            self.assertEqual(set([f[0] for f in found]), EXPECTED_REQUESTEE_IDS_BY_REQUESTOR[_id])
+
+            distances = [f[1] for f in found]
+            self.assertEqual(distances, sorted(distances))
+
+    def test_upsert_moves_point_between_cells(self):
+        lat, lon = self.positions['test_middle']
+        self.index.upsert('test_left', 10.0, 10.0)
+        found = self.index.query_radius(lat, lon, TOW_RADIUS_METERS)
+        self.assertNotIn('test_left', [f[0] for f in found])
+
+        self.index.upsert('test_left', lat, lon)
+        found = self.index.query_radius(lat, lon, TOW_RADIUS_METERS, limit=1)
+        self.assertIn(found[0][0], ['test_left', 'test_middle'])
+        self.assertEqual(len(found), 1)
+
+    def test_remove(self):
+        self.index.remove('test_top')
+        self.index.remove('not_in_index')
+        self.assertNotIn('test_top', self.index)
+        self.assertEqual(len(self.index), len(ELIGIBLE_USERS) - 1)
+
+    def test_huge_radius_walks_occupied_cells(self):
+        lat, lon = self.positions['test_middle']
+        found = self.index.query_radius(lat, lon, 5000000)
+        self.assertEqual(len(found), len(ELIGIBLE_USERS))
+        farthest = max(float(distance_meters(lat, lon, p[0], p[1])) for p in self.positions.values())
+        self.assertAlmostEqual(found[-1][1], farthest)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import logging
+
+from datetime import datetime, timedelta
+from unittest import mock
+
+from terraintracker.app import api
+from terraintracker.app_init import db
+from terraintracker.models.timeout_sweeper import timeout_sweeper
+from terraintracker.models.tow_event import TowEvent, TowEventStatus
+from terraintracker.models.tow_request import TowRequest, TowRequestBatch
+from terraintracker.resources.tow_request_batch import TowRequestBatchResource
+from terraintracker.tests.data.user_test_data import ELIGIBLE_USERS, create_test_user
+from terraintracker.tests.custom_test_case import CustomTestCase, mock_live_config
+
+logger = logging.getLogger(__name__)
+
+
+class TimeoutSweeperTest(CustomTestCase):
+
+    def setUp(self):
+        self.eligible_users = [create_test_user(u) for u in ELIGIBLE_USERS]
+        self.requestor = [u for u in self.eligible_users if u.id == 'test_middle'][0]
+
+    def post_tow_request_batch(self):
+        res = self.make_api_post_request(api.url_for(TowRequestBatchResource), self.requestor)
+        self.assertEqual(res.status_code, 201)
+        return TowRequestBatch.query.get(res.json['tow_request_batch_id'])
+
+    def test_reading_status_doesnt_write(self):
+        trb = self.post_tow_request_batch()
+        trb.time_sent = datetime.now() - timedelta(minutes=60)
+        db.session.commit()
+
+        # Reads as timed out, but nothing to flush until the sweeper gets to it
+        self.assertEqual(trb.status, TowRequestBatch.Status.timed_out.value)
+        self.assertFalse(db.session.dirty)
+        self.assertEqual(trb._status, TowRequestBatch.Status.active.value)
+
+    def test_sweep_times_out_expired_batches_and_events(self):
+        old_trb = self.post_tow_request_batch()
+        old_trb.time_sent = datetime.now() - timedelta(minutes=60)
+        fresh_trb = self.post_tow_request_batch()
+        old_event = TowEvent({'requestor_id': self.requestor.id,
+                              'requestee_id': self.eligible_users[0].id,
+                              'tow_request_batch_id': old_trb.id})
+        old_event.time_sent = datetime.now() - timedelta(days=1)
+        db.session.add(old_event)
+        db.session.commit()
+        old_trb_id, fresh_trb_id, old_event_id = old_trb.id, fresh_trb.id, old_event.id
+
+        batches, events, _ = timeout_sweeper.sweep()
+        self.assertGreaterEqual(batches, 1)
+        self.assertGreaterEqual(events, 1)
+
+        db.session.expire_all()
+        self.assertEqual(TowRequestBatch.query.get(old_trb_id)._status, TowRequestBatch.Status.timed_out.value)
+        self.assertEqual(TowRequestBatch.query.get(fresh_trb_id)._status, TowRequestBatch.Status.active.value)
+        self.assertEqual(TowEvent.query.get(old_event_id)._status, TowEventStatus.timed_out.value)
+
+    @mock.patch.object(mock_live_config, 'dispatch_wave_size', 2)
+    def test_sweep_escalates_quiet_waves_once(self):
+        trb = self.post_tow_request_batch()
+        self.assertEqual(trb.num_requests, 2)
+        trb.last_wave_time = datetime.now() - timedelta(seconds=mock_live_config.dispatch_wave_wait_seconds + 1)
+        db.session.commit()
+        trb_id = trb.id
+
+        timeout_sweeper.sweep()
+        # The wave just went out, so a second pass leaves it alone
+        timeout_sweeper.sweep()
+
+        db.session.expire_all()
+        trb = TowRequestBatch.query.get(trb_id)
+        self.assertEqual(trb.num_waves, 2)
+        self.assertEqual(TowRequest.get_tow_requests_in_batch(trb_id).count(), trb.num_requests)
+
+    @mock.patch.object(mock_live_config, 'dispatch_wave_size', 2)
+    def test_failed_wave_rolls_back_and_stays_due(self):
+        trb = self.post_tow_request_batch()
+        quiet_since = datetime.now() - timedelta(seconds=mock_live_config.dispatch_wave_wait_seconds + 1)
+        trb.last_wave_time = quiet_since
+        db.session.commit()
+        trb_id = trb.id
+
+        # Fails after _send_wave has claimed the wave, while it's writing the tow requests
+        with mock.patch.object(db.session, 'bulk_save_objects', side_effect=RuntimeError("DB went away")):
+            self.assertEqual(timeout_sweeper.sweep()[2], 0)
+
+        # The claim rolled back with the rest of the wave, so it's still due
+        db.session.expire_all()
+        trb = TowRequestBatch.query.get(trb_id)
+        self.assertEqual(trb.last_wave_time, quiet_since)
+        self.assertEqual(trb.num_waves, 1)
+        self.assertEqual(trb.num_requests, 2)
+        self.assertEqual(TowRequest.get_tow_requests_in_batch(trb_id).count(), 2)
+
+        # And the next sweep sends it
+        self.assertEqual(timeout_sweeper.sweep()[2], 1)
+        db.session.expire_all()
+        trb = TowRequestBatch.query.get(trb_id)
+        self.assertEqual(trb.num_waves, 2)
+        self.assertEqual(TowRequest.get_tow_requests_in_batch(trb_id).count(), trb.num_requests)
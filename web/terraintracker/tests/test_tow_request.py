@@ -1,13 +1,17 @@
 from random import randint
 
 import logging
+import threading
 
 from datetime import datetime, timedelta
+from unittest import mock
+
+from sqlalchemy.orm.attributes import set_committed_value
 
 from terraintracker.app import api
 from terraintracker.app_init import db
 
-from terraintracker.models.tow_request import TowRequest, TowRequestBatch
+from terraintracker.models.tow_request import TowRequest, TowRequestAlreadyAcceptedError, TowRequestBatch
 from terraintracker.models.tow_event import TowEvent, TowEventStatus
 from terraintracker.models.user import User
 from terraintracker.resources.tow_request import TowRequestResource
@@ -17,7 +21,7 @@ from terraintracker.tests.data.user_test_data import (ELIGIBLE_USERS,
                                                       EXPECTED_REQUESTEE_IDS_BY_REQUESTOR,
                                                       LONELY_USER,
                                                       create_test_user)
-from terraintracker.tests.custom_test_case import CustomTestCase
+from terraintracker.tests.custom_test_case import CustomTestCase, mock_live_config
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +46,39 @@ class TowRequestBatchTest(CustomTestCase):
             # Check num_requests
             self.assertEqual(len(expected_ids), int(res.json['num_requests']))
 
+    def test_wave_bulk_writes_requests_and_requestee_pointers(self):
+        requestor = [u for u in self.eligible_users if u.id == 'test_middle'][0]
+        expected_ids = EXPECTED_REQUESTEE_IDS_BY_REQUESTOR[requestor.id]
+        trb = TowRequestBatch(requestor)
+        db.session.add(trb)
+        db.session.commit()
+        trb.fire(requestor)
+
+        def stored():
+            # Straight from the DB, not the session
+            tow_request_table, user_table = TowRequest.__table__, User.__table__
+            with db.engine.connect() as connection:
+                tow_requests = dict(connection.execute(
+                    db.select([tow_request_table.c.requestee_id, tow_request_table.c.id])
+                      .where(tow_request_table.c.tow_request_batch_id == trb.id)).fetchall())
+                pointers = dict(connection.execute(
+                    db.select([user_table.c.id, user_table.c.requestee_tow_request_id])
+                      .where(user_table.c.id.in_(list(expected_ids)))).fetchall())
+            return tow_requests, pointers
+
+        tow_requests, pointers = stored()
+        self.assertEqual(set(tow_requests), expected_ids)
+        self.assertEqual(pointers, tow_requests)
+
+        # The session doesn't think it still has them to write
+        for requestee_id in expected_ids:
+            requestee = User.query.get(requestee_id)
+            self.assertNotIn(requestee, db.session.dirty)
+            self.assertEqual(requestee.requestee_tow_request_id, tow_requests[requestee_id])
+            requestee.middle_name = 'Q'  # An unrelated change, so the requestees do get flushed
+        db.session.commit()
+        self.assertEqual(stored(), (tow_requests, pointers))
+
     def test_get_tow_request_batch(self):
         # Post a TowRequestBatch
         requestor = self.eligible_users.pop(randint(0, len(self.eligible_users) - 1))
@@ -128,6 +165,40 @@ class TowRequestTest(CustomTestCase):
 
             self.assertEqual(tow_batch.status, TowRequestBatch.Status.all_rejected.value)
 
+    @mock.patch.object(mock_live_config, 'dispatch_wave_size', 2)
+    def test_wave_dispatch_escalates_after_rejections(self):
+        requestor = [u for u in self.eligible_users if u.id == 'test_middle'][0]
+        expected_ids = EXPECTED_REQUESTEE_IDS_BY_REQUESTOR[requestor.id]
+        res = self.make_api_post_request(api.url_for(TowRequestBatchResource), requestor)
+        self.assertEqual(res.status_code, 201)
+        tow_request_batch_id = res.json['tow_request_batch_id']
+
+        # First wave only goes to the 2 nearest
+        self.assertEqual(int(res.json['num_requests']), 2)
+
+        asked = set()
+        while True:
+            tow_batch = TowRequestBatch.query.get(tow_request_batch_id)
+            outstanding = [r for r in TowRequest.get_tow_requests_in_batch(tow_request_batch_id)
+                           if r.status == TowRequest.Status.active.value]
+            if not outstanding:
+                break
+            for tow_request in outstanding:
+                asked.add(tow_request.requestee_id)
+                requestee = User.query.get(tow_request.requestee_id)
+                res = self.make_api_put_request(api.url_for(TowRequestResource),
+                                                requestee,
+                                                {'action': 'reject', 'tow_request_id': tow_request.id})
+                self.assert200(res)
+
+        # Everybody in range got asked eventually, and the batch only gave up after the last wave
+        tow_batch = TowRequestBatch.query.get(tow_request_batch_id)
+        self.assertEqual(asked, expected_ids)
+        self.assertEqual(tow_batch.num_waves, 2)
+        self.assertEqual(tow_batch.num_requests, len(expected_ids))
+        self.assertEqual(tow_batch.num_rejections, len(expected_ids))
+        self.assertEqual(tow_batch.status, TowRequestBatch.Status.all_rejected.value)
+
     def test_two_people_try_to_accept_the_same_tow_request_batch(self):
         # Post TowRequestBatch
         requestor = self.eligible_users.pop(randint(0, len(self.eligible_users) - 1))
@@ -167,6 +238,110 @@ class TowRequestTest(CustomTestCase):
 
         # TODO ADD STUFF
 
+    def test_simultaneous_acceptances_make_one_tow_event(self):
+        requestor = [u for u in self.eligible_users if u.id == 'test_middle'][0]
+        res = self.make_api_post_request(api.url_for(TowRequestBatchResource), requestor)
+        self.assertEqual(res.status_code, 201)
+        tow_request_batch_id = res.json['tow_request_batch_id']
+        requests = [(r.requestee_id, r.id) for r in TowRequest.get_tow_requests_in_batch(tow_request_batch_id)]
+        self.assertGreater(len(requests), 1)
+        db.session.commit()
+
+        # Everybody says yes at the same moment, each on their own connection
+        results = []
+        barrier = threading.Barrier(len(requests))
+
+        def accept(requestee_id, tow_request_id):
+            with self.app.app_context():
+                requestee = User.query.get(requestee_id)
+                barrier.wait()
+                try:
+                    requestee.accept_tow_request(tow_request_id)
+                    results.append('accepted')
+                except TowRequestAlreadyAcceptedError:
+                    db.session.rollback()
+                    results.append('already_accepted')
+                except Exception as e:
+                    db.session.rollback()
+                    results.append(repr(e))
+
+        threads = [threading.Thread(target=accept, args=r) for r in requests]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), ['accepted'] + ['already_accepted'] * (len(requests) - 1))
+        self.assertEqual(TowEvent.query.filter_by(tow_request_batch_id=tow_request_batch_id).count(), 1)
+
+    def test_simultaneous_rejections_all_count(self):
+        requestor = [u for u in self.eligible_users if u.id == 'test_middle'][0]
+        res = self.make_api_post_request(api.url_for(TowRequestBatchResource), requestor)
+        self.assertEqual(res.status_code, 201)
+        tow_request_batch_id = res.json['tow_request_batch_id']
+        requests = [(r.requestee_id, r.id) for r in TowRequest.get_tow_requests_in_batch(tow_request_batch_id)]
+        self.assertGreater(len(requests), 1)
+        db.session.commit()
+
+        # Everybody says no at the same moment, each on their own connection
+        errors = []
+        barrier = threading.Barrier(len(requests))
+
+        def reject(requestee_id, tow_request_id):
+            with self.app.app_context():
+                requestee = User.query.get(requestee_id)
+                barrier.wait()
+                try:
+                    requestee.reject_tow(tow_request_id)
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(repr(e))
+
+        threads = [threading.Thread(target=reject, args=r) for r in requests]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        db.session.expire_all()
+        tow_batch = TowRequestBatch.query.get(tow_request_batch_id)
+        self.assertEqual(tow_batch.num_rejections, len(requests))
+        self.assertEqual(tow_batch.status, TowRequestBatch.Status.all_rejected.value)
+        # Only the last one in tells the boater
+        self.assertEqual(self.mock_snc.call_count, 1)
+
+    @mock.patch.object(mock_live_config, 'dispatch_wave_size', 2)
+    def test_stale_escalation_doesnt_send_a_second_wave(self):
+        requestor = [u for u in self.eligible_users if u.id == 'test_middle'][0]
+        res = self.make_api_post_request(api.url_for(TowRequestBatchResource), requestor)
+        self.assertEqual(res.status_code, 201)
+        tow_batch = TowRequestBatch.query.get(res.json['tow_request_batch_id'])
+        first_wave_time = tow_batch.last_wave_time
+        self.assertEqual(tow_batch.num_requests, 2)
+
+        already_asked = set(r.requestee_id for r in TowRequest.get_tow_requests_in_batch(tow_batch.id))
+        candidates = [u for u in requestor.get_possible_requestees() if u.id not in already_asked]
+        self.assertTrue(candidates)
+        self.assertTrue(tow_batch._send_wave(requestor, candidates))
+        self.assertEqual(tow_batch.num_waves, 2)
+
+        # Another thread/process still has the batch as it was before that wave, and tries to send it too.
+        # Its claim matches no row, so it inserts nothing and notifies nobody
+        set_committed_value(tow_batch, 'last_wave_time', first_wave_time)
+        self.mock_twilio.reset_mock()
+        self.mock_sendTowRequests.reset_mock()
+        self.assertFalse(tow_batch._send_wave(requestor, candidates))
+        db.session.commit()
+        self.mock_twilio.assert_not_called()
+        self.mock_sendTowRequests.assert_not_called()
+
+        db.session.expire_all()
+        tow_batch = TowRequestBatch.query.get(tow_batch.id)
+        self.assertEqual(tow_batch.num_waves, 2)
+        self.assertEqual(tow_batch.num_requests, 2 + len(candidates[:2]))
+        self.assertEqual(tow_batch.num_requests, TowRequest.get_tow_requests_in_batch(tow_batch.id).count())
+
     def test_action_on_timed_out_tow_request(self):
         # Post TowRequestBatch
         requestor = self.eligible_users.pop(randint(0, len(self.eligible_users) - 1))
@@ -0,0 +1,73 @@
+import threading
+import time
+
+from terraintracker.app import api
+from terraintracker.app_init import db
+from terraintracker.models.tow_request import TowRequest, TowRequestBatch
+from terraintracker.models.tow_request_batch_watcher import TooManyWaitersError, TowRequestBatchWatcher
+from terraintracker.models.user import User
+from terraintracker.resources.tow_request_batch import TowRequestBatchResource
+from terraintracker.tests.data.user_test_data import ELIGIBLE_USERS, create_test_user
+from terraintracker.tests.custom_test_case import CustomTestCase
+
+
+class TowRequestBatchLongPollTest(CustomTestCase):
+
+    def setUp(self):
+        self.eligible_users = [create_test_user(u) for u in ELIGIBLE_USERS]
+        self.requestor = [u for u in self.eligible_users if u.id == 'test_middle'][0]
+        res = self.make_api_post_request(api.url_for(TowRequestBatchResource), self.requestor)
+        self.assertEqual(res.status_code, 201)
+        self.tow_request_batch_id = res.json['tow_request_batch_id']
+
+    def get_batch(self, **args):
+        args['tow_request_batch_id'] = self.tow_request_batch_id
+        res = self.make_api_get_request(api.url_for(TowRequestBatchResource), self.requestor, args)
+        self.assert200(res)
+        return res.json
+
+    def test_stale_version_answers_straight_away(self):
+        version = self.get_batch()['version']
+        start = time.time()
+        self.assertEqual(self.get_batch(version=version - 1, wait=10)['version'], version)
+        self.assertLess(time.time() - start, 5)
+
+    def test_rejection_wakes_long_poll(self):
+        version = self.get_batch()['version']
+        tow_request = TowRequest.get_tow_requests_in_batch(self.tow_request_batch_id)[0]
+        requestee_id, tow_request_id = tow_request.requestee_id, tow_request.id
+        db.session.commit()
+
+        def reject():
+            time.sleep(0.5)
+            with self.app.app_context():
+                User.query.get(requestee_id).reject_tow(tow_request_id)
+
+        rejecter = threading.Thread(target=reject)
+        rejecter.start()
+        start = time.time()
+        res = self.get_batch(version=version, wait=20)
+        rejecter.join()
+
+        self.assertGreater(res['version'], version)
+        self.assertEqual(res['num_rejections'], 1)
+        self.assertLess(time.time() - start, 10)
+
+    def test_nothing_changes(self):
+        version = self.get_batch()['version']
+        res = self.get_batch(version=version, wait=1)
+        self.assertEqual(res['version'], version)
+        self.assertEqual(res['status'], TowRequestBatch.Status.active.name)
+
+    def test_bad_wait_is_rejected(self):
+        version = self.get_batch()['version']
+        for wait in ('nan', 'inf', '-1', 'soon'):
+            res = self.make_api_get_request(api.url_for(TowRequestBatchResource), self.requestor,
+                                            {'tow_request_batch_id': self.tow_request_batch_id,
+                                             'version': version, 'wait': wait})
+            self.assertEqual(res.status_code, 400, wait)
+
+    def test_waiters_are_bounded(self):
+        watcher = TowRequestBatchWatcher(max_waiters=0)
+        with self.assertRaises(TooManyWaitersError):
+            watcher.wait(self.tow_request_batch_id, 0, 1)
@@ -0,0 +1,134 @@
+import logging
+import unittest
+
+from unittest import mock
+
+from terraintracker.app import api
+from terraintracker.constants import TOWER_CRUISING_SPEED_METERS_PER_SECOND
+from terraintracker.models.tower_availability import TowerAvailability, eta_band, tower_availability
+from terraintracker.resources.mweb_tow_request import MWebTowRequest
+from terraintracker.tests.custom_test_case import CustomTestCase
+from terraintracker.tests.data.user_test_data import ELIGIBLE_USERS, create_test_user
+
+logger = logging.getLogger(__name__)
+
+
+def meters_for_minutes(minutes):
+    return minutes * 60 * TOWER_CRUISING_SPEED_METERS_PER_SECOND
+
+
+class EtaBandTest(unittest.TestCase):
+
+    def test_no_tower(self):
+        self.assertIsNone(eta_band(None))
+
+    def test_bands(self):
+        self.assertEqual(eta_band(0), 'under_15_min')
+        self.assertEqual(eta_band(meters_for_minutes(14.9)), 'under_15_min')
+        self.assertEqual(eta_band(meters_for_minutes(15)), '15_to_30_min')
+        self.assertEqual(eta_band(meters_for_minutes(29.9)), '15_to_30_min')
+        self.assertEqual(eta_band(meters_for_minutes(30)), '30_to_60_min')
+        self.assertEqual(eta_band(meters_for_minutes(60)), 'over_60_min')
+        self.assertEqual(eta_band(meters_for_minutes(500)), 'over_60_min')
+
+
+class TowerAvailabilityCacheTest(unittest.TestCase):
+    """ No DB here. tower_index and the clock are mocked """
+
+    def setUp(self):
+        self.availability = TowerAvailability(cell_degrees=0.01, ttl=30, max_cells=100)
+        self.now = 1000000.0
+
+        self.patch_time = mock.patch('terraintracker.models.tower_availability.time.time', lambda: self.now)
+        self.patch_time.start()
+        self.patch_index = mock.patch('terraintracker.models.tower_availability.tower_index')
+        self.mock_index = self.patch_index.start()
+        self.mock_index.query_radius.return_value = [('tower_a', 5000.0), ('tower_b', 12000.0)]
+        self.patch_live_config = mock.patch('terraintracker.models.tower_availability.live_config',
+                                            mock.MagicMock(tow_radius=16093))
+        self.patch_live_config.start()
+
+    def tearDown(self):
+        self.patch_time.stop()
+        self.patch_index.stop()
+        self.patch_live_config.stop()
+
+    def test_cell_snapping(self):
+        self.assertEqual(self.availability._cell(31.251, -81.331), (3125, -8134))
+        self.assertEqual(self.availability._cell(31.259, -81.339), (3125, -8134))
+        self.assertNotEqual(self.availability._cell(31.261, -81.331), (3125, -8134))
+
+        center_lat, center_lon = self.availability._cell_center((3125, -8134))
+        self.assertAlmostEqual(center_lat, 31.255)
+        self.assertAlmostEqual(center_lon, -81.335)
+
+    def test_points_in_a_cell_share_the_answer(self):
+        first = self.availability.check(31.251, -81.331)
+        second = self.availability.check(31.259, -81.339)
+        self.assertEqual(first, second)
+        self.assertEqual(first, {'num_found': 2, 'nearest_meters': 5000.0, 'eta_band': 'under_15_min'})
+
+        # Asked once, about the cell's center
+        self.assertEqual(self.mock_index.query_radius.call_count, 1)
+        lat, lon, radius = self.mock_index.query_radius.call_args[0]
+        self.assertAlmostEqual(lat, 31.255)
+        self.assertAlmostEqual(lon, -81.335)
+        self.assertEqual(radius, 16093)
+
+        # Next cell over is its own question
+        self.availability.check(31.261, -81.331)
+        self.assertEqual(self.mock_index.query_radius.call_count, 2)
+
+    def test_cache_expires_after_ttl(self):
+        self.availability.check(31.251, -81.331)
+
+        self.now += 29
+        self.mock_index.query_radius.return_value = []
+        self.assertEqual(self.availability.check(31.251, -81.331)['num_found'], 2)
+        self.assertEqual(self.mock_index.query_radius.call_count, 1)
+
+        self.now += 1
+        self.assertEqual(self.availability.check(31.251, -81.331),
+                         {'num_found': 0, 'nearest_meters': None, 'eta_band': None})
+        self.assertEqual(self.mock_index.query_radius.call_count, 2)
+
+    def test_full_cache_drops_expired_cells(self):
+        self.availability.max_cells = 2
+        self.availability.check(31.251, -81.331)
+        self.now += 31
+        self.availability.check(32.251, -81.331)
+        self.availability.check(33.251, -81.331)
+        self.assertEqual(set(self.availability._cache.keys()),
+                         {self.availability._cell(32.251, -81.331), self.availability._cell(33.251, -81.331)})
+
+
+class MWebTowerAvailabilityTest(CustomTestCase):
+
+    def setUp(self):
+        self.eligible_users = [create_test_user(u) for u in ELIGIBLE_USERS]
+        self.middle = [u for u in self.eligible_users if u.id == 'test_middle'][0]
+        tower_availability.clear()
+
+    def tearDown(self):
+        tower_availability.clear()
+
+    def get_availability(self, lat, lon):
+        res = self.client.get('{}?lat={}&lon={}'.format(api.url_for(MWebTowRequest), lat, lon))
+        self.assertEqual(res.status_code, 200)
+        return res.json
+
+    def test_towers_in_range(self):
+        availability = self.get_availability(self.middle.last_lat_seen, self.middle.last_long_seen)
+        self.assertEqual(set(availability.keys()), {'num_found', 'eta_band'})
+        # num_found stays a string, like it's always been
+        self.assertIsInstance(availability['num_found'], str)
+        self.assertGreaterEqual(int(availability['num_found']), len(ELIGIBLE_USERS))
+        # test_middle is in the same cell, so it's right around the corner
+        self.assertEqual(availability['eta_band'], 'under_15_min')
+
+    def test_no_towers_in_range(self):
+        availability = self.get_availability(0.0, -140.0)
+        self.assertEqual(availability, {'num_found': '0', 'eta_band': None})
+
+    def test_bad_point(self):
+        self.assertEqual(self.get_availability('north', -81.2), {'status': 'error'})
@@ -0,0 +1,69 @@
+import logging
+
+from terraintracker.app import api
+from terraintracker.constants import MAX_COVERAGE_POINTS
+from terraintracker.resources.tower_coverage import TowerCoverageResource
+from terraintracker.tests.custom_test_case import CustomTestCase
+from terraintracker.tests.data.user_test_data import ELIGIBLE_USERS, create_test_user
+
+logger = logging.getLogger(__name__)
+
+MID_PACIFIC = {'lat': 0.0, 'lon': -140.0}  # Nobody tows out here
+
+
+class TowerCoverageTest(CustomTestCase):
+
+    def setUp(self):
+        self.eligible_users = [create_test_user(u) for u in ELIGIBLE_USERS]
+        self.middle = [u for u in self.eligible_users if u.id == 'test_middle'][0]
+        self.left = [u for u in self.eligible_users if u.id == 'test_left'][0]
+
+    def post_points(self, data):
+        return self.make_api_post_request(api.url_for(TowerCoverageResource), self.middle, data)
+
+    def assert_bad_request(self, data, status_prefix):
+        res = self.post_points(data)
+        self.assertEqual(res.status_code, 400)
+        self.assertTrue(res.json['status'].startswith(status_prefix), res.json)
+
+    def test_invalid_points(self):
+        self.assert_bad_request({}, 'points must be a list')
+        self.assert_bad_request({'points': 5}, 'points must be a list')
+        self.assert_bad_request({'points': [{'lat': 31.25}]}, 'points must be a list')
+        self.assert_bad_request({'points': [{'lat': 'north', 'lon': -81.2}]}, 'points must be a list')
+        self.assert_bad_request({'points': [{'lat': 91, 'lon': -81.2}]}, 'invalid point')
+        self.assert_bad_request({'points': [{'lat': 31.25, 'lon': -181}]}, 'invalid point')
+        self.assert_bad_request({'points': [MID_PACIFIC] * (MAX_COVERAGE_POINTS + 1)}, 'too many points')
+
+    def test_no_points(self):
+        res = self.post_points({'points': []})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json['points'], [])
+
+    def test_point_with_no_towers(self):
+        # Comes back through the LEFT JOIN with no matches, rather than going missing
+        res = self.post_points({'points': [MID_PACIFIC]})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json['points'], [dict(MID_PACIFIC, num_found=0, nearest_meters=None)])
+
+    def test_mixed_batch_keeps_input_order(self):
+        points = [{'lat': float(self.middle.last_lat_seen), 'lon': float(self.middle.last_long_seen)},
+                  MID_PACIFIC,
+                  {'lat': float(self.left.last_lat_seen), 'lon': float(self.left.last_long_seen)},
+                  MID_PACIFIC]
+        res = self.post_points({'points': points})
+        self.assertEqual(res.status_code, 200)
+        coverage = res.json['points']
+
+        self.assertEqual([(p['lat'], p['lon']) for p in coverage], [(p['lat'], p['lon']) for p in points])
+
+        # Everybody's in range of the middle, and it's sitting right on top of one of them
+        self.assertGreaterEqual(coverage[0]['num_found'], len(ELIGIBLE_USERS))
+        self.assertLess(coverage[0]['nearest_meters'], 1)
+        # Left reaches everybody but right
+        self.assertGreaterEqual(coverage[2]['num_found'], len(ELIGIBLE_USERS) - 1)
+        self.assertLess(coverage[2]['nearest_meters'], 1)
+
+        for p in (coverage[1], coverage[3]):
+            self.assertEqual(p['num_found'], 0)
+            self.assertIsNone(p['nearest_meters'])
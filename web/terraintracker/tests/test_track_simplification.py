@@ -0,0 +1,84 @@
+"""
+Track simplification is pure NumPy, so these are plain unittest tests
+"""
+import unittest
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from terraintracker.lib.geodesy import EARTH_RADIUS_METERS, destination_point
+from terraintracker.lib.track_simplification import douglas_peucker, simplify, simplify_stream
+
+START = (31.25, -81.33)
+
+
+def zigzag_track(num_fixes, wiggle_meters):
+    """ Heading east at ~5 m/s, wobbling `wiggle_meters` north/south every other fix """
+    fixes = []
+    for i in range(num_fixes):
+        lat, lon = destination_point(START[0], START[1], 90.0, 5.0 * i)
+        lat, lon = destination_point(lat, lon, 0.0 if i % 2 else 180.0, wiggle_meters)
+        fixes.append((float(lat), float(lon), datetime(2018, 6, 18) + timedelta(seconds=i)))
+    return fixes
+
+
+def max_error_meters(fixes, kept):
+    """ Farthest any original fix is from the simplified path (each fix vs. the kept segment around it) """
+    lat0 = np.radians(fixes[0][0])
+    xy = [(np.radians(f[1]) * EARTH_RADIUS_METERS * np.cos(lat0), np.radians(f[0]) * EARTH_RADIUS_METERS)
+          for f in fixes]
+    index = dict((f, i) for i, f in enumerate(fixes))
+    worst = 0.0
+    for a, b in zip(kept[:-1], kept[1:]):
+        (ax, ay), (bx, by) = xy[index[a]], xy[index[b]]
+        for px, py in xy[index[a]:index[b] + 1]:
+            dx, dy = bx - ax, by - ay
+            along = 0.0 if dx == dy == 0 else min(max(((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy), 0), 1)
+            worst = max(worst, float(np.hypot(px - ax - along * dx, py - ay - along * dy)))
+    return worst
+
+
+class TrackSimplificationTest(unittest.TestCase):
+
+    def test_wiggles_under_tolerance_are_dropped(self):
+        fixes = zigzag_track(500, 2.0)
+        kept = simplify(fixes, 10.0)
+        self.assertEqual(kept, [fixes[0], fixes[-1]])
+
+    def test_wiggles_over_tolerance_are_kept(self):
+        fixes = zigzag_track(50, 20.0)
+        kept = simplify(fixes, 10.0)
+        self.assertGreater(len(kept), len(fixes) * 0.8)
+        self.assertLessEqual(max_error_meters(fixes, kept), 10.0)
+
+    def test_zero_tolerance_keeps_everything(self):
+        fixes = zigzag_track(20, 1.0)
+        self.assertEqual(simplify(fixes, 0), fixes)
+
+    def test_doubling_back_keeps_the_turn(self):
+        out = [destination_point(START[0], START[1], 90.0, 10.0 * i) for i in range(20)]
+        lats = [float(p[0]) for p in out] + [float(p[0]) for p in reversed(out)]
+        lons = [float(p[1]) for p in out] + [float(p[1]) for p in reversed(out)]
+        kept = douglas_peucker(lats, lons, 5.0)
+        self.assertIn(19, kept)
+        self.assertEqual(kept[0], 0)
+        self.assertEqual(kept[-1], len(lats) - 1)
+
+    def test_stream_is_connected_and_within_tolerance(self):
+        # A lazy S-curve: heading east, drifting north then south
+        fixes = [(lat + 0.001 * np.sin(i / 100.0), lon, t) for i, (lat, lon, t) in enumerate(zigzag_track(1000, 3.0))]
+        kept = list(simplify_stream(iter(fixes), 10.0, chunk_size=64))
+        self.assertEqual(kept[0], fixes[0])
+        self.assertEqual(kept[-1], fixes[-1])
+
+        # In order, no repeats at chunk boundaries, every one a real fix, and most of them dropped
+        timestamps = [k[2] for k in kept]
+        self.assertEqual(timestamps, sorted(set(timestamps)))
+        self.assertTrue(set(kept) <= set(fixes))
+        self.assertLess(len(kept), len(fixes) / 5)
+        self.assertLessEqual(max_error_meters(fixes, kept), 10.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
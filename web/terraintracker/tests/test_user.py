@@ -4,10 +4,13 @@ from random import randint
 import logging
 import unittest
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest import mock
 
-from terraintracker.models.user import User
+from terraintracker.app_init import db
+from terraintracker.lib.geodesy import distance_meters
+from terraintracker.models.location_history import location_history_buffer
+from terraintracker.models.user import User, tower_index
 from terraintracker.models.tow_request import TowRequestBatch
 from terraintracker.tests.custom_test_case import CustomTestCase
 from terraintracker.tests.data.user_test_data import (ALL_USERS,
@@ -44,24 +47,116 @@ class UserTest(CustomTestCase):
                              "Requestor {} grabbed incorrect basket of users\nExpected:{}\nActual:  {}".format(
                                  requestor.id, expected_requestee_ids, actual_requestee_ids))
 
+    def test_get_nearest_towers(self):
+        """
+        Nearest towers come back closest first, and `limit` caps how many come back.
+        """
+        middle = User.query.get('test_middle')
+        towers = User.get_nearest_towers(middle.coords[0], middle.coords[1], limit=3, exclude_ids=[middle.id])
+        self.assertEqual(len(towers), 3)
+        self.assertNotIn(middle.id, [t.id for t in towers])
+
+        distances = [float(distance_meters(middle.coords[0], middle.coords[1], t.coords[0], t.coords[1]))
+                     for t in towers]
+        self.assertEqual(distances, sorted(distances))
+
+        all_towers = User.get_nearest_towers(middle.coords[0], middle.coords[1], exclude_ids=[middle.id])
+        self.assertEqual(set([t.id for t in all_towers]), EXPECTED_REQUESTEE_IDS_BY_REQUESTOR[middle.id])
+
+    def test_tower_index_follows_commits(self):
+        left = User.query.get('test_left')
+        self.assertIn(left.id, tower_index)
+
+        # Nothing changes until it commits, and nothing at all if it rolls back
+        left.active = False
+        self.assertIn(left.id, tower_index)
+        db.session.rollback()
+        self.assertIn(left.id, tower_index)
+
+        left.active = False
+        db.session.commit()
+        self.assertNotIn(left.id, tower_index)
+
+        left.active = True
+        db.session.commit()
+        self.assertIn(left.id, tower_index)
+
     # Mock db.session, not all of db (since User object depends on db.Model)
+    @mock.patch('terraintracker.models.user.location_history_buffer')
     @mock.patch('terraintracker.models.user.db.session')
-    def test_update_position(self, mock_db_sesh):
-        # Mock db so we don't actually create location objects
+    def test_update_position(self, mock_db_sesh, mock_history_buffer):
+        # Mock db + history buffer so we don't actually create location objects
         mock_db_sesh.add.return_value = None
         mock_db_sesh.commit.return_value = None
 
         u = self.ELIGIBLE_USERS[0]
         TEST_LAT, TEST_LON = 0.0, 0.0
-        new_loc = u.update_position(TEST_LAT, TEST_LON)
-        self.assertEqual(new_loc.lat, TEST_LAT)
-        self.assertEqual(new_loc.lon, TEST_LON)
+        self.assertTrue(u.update_position(TEST_LAT, TEST_LON))
+        mock_history_buffer.add_on_commit.assert_called_once_with(u.id, TEST_LAT, TEST_LON, u.last_time_seen)
 
         self.assertTrue(type(u.last_time_seen), type(datetime.now()))
+        self.assertEqual(u.last_fix_time, u.last_time_seen)
         self.assertEqual(u.last_lat_seen, str(TEST_LAT))
         self.assertEqual(u.last_long_seen, str(TEST_LON))
         self.assertEqual(u.last_geo_point_seen, 'POINT({} {})'.format(TEST_LAT, TEST_LON))
 
+    @mock.patch('terraintracker.models.user.location_history_buffer')
+    @mock.patch('terraintracker.models.user.db.session')
+    def test_update_position_inside_dead_band(self, mock_db_sesh, mock_history_buffer):
+        u = self.ELIGIBLE_USERS[0]
+        u.update_position(0.0, 0.0)
+        stored_fix_time = u.last_fix_time - timedelta(seconds=5)
+        u.last_fix_time = u.last_time_seen = stored_fix_time
+        mock_history_buffer.reset_mock()
+        mock_db_sesh.reset_mock()
+
+        # A couple of meters away, straight after. Not worth storing, but they're still around
+        self.assertFalse(u.update_position(0.00001, 0.0))
+        mock_history_buffer.add_on_commit.assert_not_called()
+        self.assertEqual(mock_db_sesh.commit.call_count, 1)
+        self.assertEqual(u.last_lat_seen, str(0.0))
+        self.assertEqual(u.last_fix_time, stored_fix_time)
+        self.assertGreater(u.last_time_seen, stored_fix_time)
+
+    def test_update_position_history_waits_for_commit(self):
+        u = User.query.get(self.ELIGIBLE_USERS[0].id)
+        with mock.patch.object(location_history_buffer, 'add') as mock_add:
+            # The request rolls back, and so does its history
+            location_history_buffer.add_on_commit(u.id, 1.0, 2.0)
+            db.session.rollback()
+            mock_add.assert_not_called()
+
+            # Far from where they were, so it's stored
+            self.assertTrue(u.update_position(10.0, 10.0))
+            mock_add.assert_called_once_with(u.id, 10.0, 10.0, u.last_fix_time)
+
+    @mock.patch('terraintracker.models.user.db.session')
+    def test_record_positions(self, mock_db_sesh):
+        u = self.ELIGIBLE_USERS[0]
+        start = u.last_time_seen + timedelta(minutes=1)
+        fixes = [(10.0 + i * 0.01, 10.0, start + timedelta(seconds=30 * i)) for i in range(5)]
+        # Sitting still for a bit. These get dropped by the dead-band filter
+        fixes += [(10.04, 10.0, fixes[-1][2] + timedelta(seconds=10 * i)) for i in range(1, 4)]
+
+        num_stored = u.record_positions(fixes)
+        self.assertEqual(num_stored, 5)
+        self.assertEqual(mock_db_sesh.execute.call_count, 1)
+        self.assertEqual(len(mock_db_sesh.execute.call_args[0][1]), 5)
+        self.assertEqual(mock_db_sesh.commit.call_count, 1)
+
+        # Newest fix wins
+        self.assertEqual(u.last_time_seen, fixes[-1][2])
+        self.assertEqual(u.last_geo_point_seen, 'POINT({} {})'.format(10.04, 10.0))
+
+        # The fix we already have counts too, so a backlog that picks up right where it left off is dropped
+        mock_db_sesh.reset_mock()
+        self.assertEqual(u.record_positions([(10.04, 10.0, u.last_fix_time + timedelta(seconds=5))]), 0)
+        mock_db_sesh.execute.assert_not_called()
+
+        # An old backlog doesn't move us backwards
+        u.record_positions([(20.0, 20.0, start - timedelta(days=1))])
+        self.assertEqual(u.last_lat_seen, str(10.04))
+
     @mock.patch('terraintracker.models.user.TowRequestBatch')
     @mock.patch('terraintracker.models.user.db.session')
     def test_request_tow(self, mock_db_sesh, mock_tow_request_batch):
@@ -0,0 +1,91 @@
+"""
+Water masks are just files, so these are plain unittest tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+import numpy as np
+
+from terraintracker.lib.water_mask import WaterMask, WaterMaskError, write_water_mask
+from terraintracker.scripts.build_water_mask import shapefile_classifier
+
+# Water west of -81.2 (the ocean), land east of it
+MIN_LAT, MIN_LON, CELL_DEGREES, ROWS, COLS = 31.0, -81.4, 0.01, 40, 48
+SHORELINE_LON = -81.2
+
+
+def west_is_water(lats, lons):
+    return lons < SHORELINE_LON
+
+
+class WaterMaskTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'water_mask.bin')
+        write_water_mask(self.path, MIN_LAT, MIN_LON, CELL_DEGREES, ROWS, COLS, west_is_water)
+        self.mask = WaterMask(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lookup(self):
+        self.assertTrue(self.mask.is_water(31.2, -81.3))
+        self.assertFalse(self.mask.is_water(31.2, -81.1))
+        self.assertIsNone(self.mask.is_water(30.0, -81.3))
+        self.assertIsNone(self.mask.is_water(31.2, MIN_LON + COLS * CELL_DEGREES))
+
+    def test_many_matches_one_at_a_time(self):
+        lats = np.random.uniform(30.9, 31.5, 500)
+        lons = np.random.uniform(-81.5, -80.8, 500)
+        water, covered = self.mask.is_water_many(lats, lons)
+        for lat, lon, w, c in zip(lats, lons, water, covered):
+            expected = self.mask.is_water(lat, lon)
+            self.assertEqual(c, expected is not None)
+            self.assertEqual(w, bool(expected))
+
+    def test_rejects_garbage(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a mask' * 10)
+        with self.assertRaises(WaterMaskError):
+            WaterMask(self.path)
+        with self.assertRaises(WaterMaskError):
+            write_water_mask(self.path, MIN_LAT, MIN_LON, CELL_DEGREES, ROWS, 7, west_is_water)
+
+
+class ShapefileClassifierTest(unittest.TestCase):
+    """ pyshp is optional, so it's faked here """
+
+    def fake_shapefile(self, shape_type, shapes):
+        reader = mock.MagicMock(shapeType=shape_type)
+        reader.shapes.return_value = shapes
+        return mock.MagicMock(POLYGON=5, POLYGONZ=15, POLYGONM=25, Reader=mock.MagicMock(return_value=reader))
+
+    def classifier(self, shape_type, shapes):
+        with mock.patch.dict('sys.modules', shapefile=self.fake_shapefile(shape_type, shapes)):
+            return shapefile_classifier('water.shp')
+
+    def test_square(self):
+        square = mock.MagicMock(parts=[0], points=[(-81.4, 31.0), (-81.2, 31.0), (-81.2, 31.4), (-81.4, 31.4)])
+        classify = self.classifier(5, [square])
+        lons = np.array([-81.5, -81.3, -81.1])
+        self.assertEqual(list(classify(np.full(3, 31.2), lons)), [False, True, False])
+
+    def test_no_polygons(self):
+        with self.assertRaises(ValueError):
+            self.classifier(5, [])
+        # Rings too short to be polygons don't count
+        with self.assertRaises(ValueError):
+            self.classifier(5, [mock.MagicMock(parts=[0], points=[(-81.4, 31.0), (-81.2, 31.0)])])
+
+    def test_not_polygons(self):
+        with self.assertRaises(ValueError):
+            self.classifier(3, [mock.MagicMock(parts=[0], points=[(-81.4, 31.0), (-81.2, 31.0)])])
+
+
+if __name__ == '__main__':
+    unittest.main()